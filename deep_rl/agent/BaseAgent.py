@@ -4,9 +4,19 @@
 # declaration at the top                                              #
 #######################################################################
 
+import hashlib
 import torch
 import numpy as np
 from ..utils import *
+from ..component import ParallelizedTask
+
+# helper function
+def _episode_hash(episode_info):
+    # hash of an evaluation trajectory (actions taken, rewards and terminals)
+    h = hashlib.sha1()
+    for k in ['deterministic_action', 'reward', 'terminal']:
+        h.update(np.asarray(episode_info[k], dtype=np.float64).tobytes())
+    return h.hexdigest()
 
 class BaseAgent:
     def __init__(self, config):
@@ -74,6 +84,12 @@ class BaseAgent:
 class BaseContinualLearnerAgent(BaseAgent):
     def __init__(self, config):
         BaseAgent.__init__(self, config)
+        self.evaluation_vec_env = None
+
+    def close(self):
+        BaseAgent.close(self)
+        if hasattr(self.evaluation_vec_env, 'close'):
+            self.evaluation_vec_env.close()
 
     def consolidate(self, config=None):
         raise NotImplementedError
@@ -100,6 +116,41 @@ class BaseContinualLearnerAgent(BaseAgent):
             q = out.detach().cpu().numpy().ravel()
             return np.argmax(q), {'logits': q}
 
+    def eval_task_indices(self, task_labels):
+        # internal task index of each task label, for agents that run the evaluation of
+        # several tasks in one forward pass (see task_eval_switch). None if unsupported
+        return None
+
+    def eval_task_slots(self, task_labels):
+        # internal task index (e.g. mask) of each task label, switched with task_eval_switch
+        # between the tasks of a batched evaluation. None for agents whose evaluation of a
+        # task only depends on the task label input.
+        return None
+
+    def task_eval_switch(self, task_idx):
+        # switch the evaluated task (started with task_eval_start) to internal task index
+        # task_idx, or to one task per sample given an array of indices
+        raise NotImplementedError
+
+    def evaluation_actions(self, states, task_labels):
+        # batched version of evaluation_action. returns the deterministic actions and the
+        # per sample output info (same entries as evaluation_action).
+        self.config.state_normalizer.set_read_only()
+        states = self.config.state_normalizer(states)
+        out = self.network.predict(states, task_label=task_labels)
+        self.config.state_normalizer.unset_read_only()
+        if isinstance(out, dict) or isinstance(out, list) or isinstance(out, tuple):
+            # for actor-critic and policy gradient approaches
+            actions = np.argmax(out[0].cpu().numpy(), axis=1)
+            infos = [{'logits': out[0][i:i+1], 'sampled_action': out[1][i:i+1], \
+                'log_prob': out[2][i:i+1], 'entropy': out[3][i:i+1], 'value': out[4][i:i+1], \
+                'deterministic_action': actions[i]} for i in range(len(actions))]
+            return actions, infos
+        else:
+            # for dqn approaches
+            q = out.detach().cpu().numpy().reshape(len(states), -1)
+            return np.argmax(q, axis=1), [{'logits': q[i]} for i in range(len(q))]
+
     def deterministic_episode(self):
         epi_info = {'logits': [], 'sampled_action': [], 'log_prob': [], 'entropy': [],
             'value': [], 'deterministic_action': [], 'reward': [], 'terminal': []}
@@ -123,13 +174,127 @@ class BaseContinualLearnerAgent(BaseAgent):
             if done: break
         return total_rewards, epi_info
 
+    def _replicate_eval(self):
+        # evaluation actions are greedy (argmax), so evaluation episodes are all the same
+        # when the evaluation environment declares itself deterministic.
+        return not self.config.eval_full_runs and \
+            getattr(self.evaluation_env, 'deterministic', False)
+
     def evaluate_cl(self, num_iterations=100):
         # evaluation method for continual learning agents
         rewards = []
         episodes = []
         with torch.no_grad():
             for ep in range(num_iterations):
+                if ep == 2 and self._replicate_eval() and \
+                    _episode_hash(episodes[0]) == _episode_hash(episodes[1]):
+                    # deterministic evaluation (checked by the second episode): replicate
+                    # the first episode instead of running the remaining ones
+                    rewards += rewards[:1] * (num_iterations - ep)
+                    episodes += episodes[:1] * (num_iterations - ep)
+                    break
                 total_episode_reward, episode_info = self.deterministic_episode()
                 rewards.append(total_episode_reward)
                 episodes.append(episode_info)
         return rewards, episodes
+
+    def _evaluation_vec_env(self, num_envs):
+        # vectorized environment set used by evaluate_cl_batched, rebuilt when more
+        # environments are needed. without config.eval_vec_task_fn, eval_task_fn instances
+        # are stepped in parallel by (at most config.num_workers) worker processes, each
+        # hosting several environments. evaluation environments are not monitored.
+        env = self.evaluation_vec_env
+        if env is None or env.num_envs < num_envs:
+            if env is not None: env.close()
+            if self.config.eval_vec_task_fn is not None:
+                env = self.config.eval_vec_task_fn(num_envs)
+            else:
+                num_processes = max(1, min(self.config.num_workers, num_envs))
+                envs_per_worker = -(-num_envs // num_processes)
+                env = ParallelizedTask(self.config.eval_task_fn, num_processes * envs_per_worker, \
+                    log_dir=None, envs_per_worker=envs_per_worker)
+            self.evaluation_vec_env = env
+        return env
+
+    def evaluate_cl_batched(self, tasks_info, num_iterations=100):
+        # batched evaluation method for continual learning agents (see _evaluate_cl_batched).
+        # on a deterministic evaluation environment, two episodes per task are run and the
+        # first one is replicated if they match (as in evaluate_cl). the remaining episodes of
+        # the tasks where they do not match are run.
+        if num_iterations <= 2 or not self._replicate_eval():
+            return self._evaluate_cl_batched(tasks_info, num_iterations)
+        results = self._evaluate_cl_batched(tasks_info, 2)
+        mismatch = [idx for idx, (_, episodes) in enumerate(results) \
+            if _episode_hash(episodes[0]) != _episode_hash(episodes[1])]
+        if len(mismatch) > 0:
+            remaining = self._evaluate_cl_batched([tasks_info[idx] for idx in mismatch], \
+                num_iterations - 2)
+            remaining = dict(zip(mismatch, remaining))
+        ret = []
+        for idx, (rewards, episodes) in enumerate(results):
+            if idx in mismatch:
+                ret.append((rewards + remaining[idx][0], episodes + remaining[idx][1]))
+            else:
+                ret.append((rewards + rewards[:1] * (num_iterations - 2), \
+                    episodes + episodes[:1] * (num_iterations - 2)))
+        return ret
+
+    def _evaluate_cl_batched(self, tasks_info, num_iterations):
+        # the `num_iterations` episodes of every task in `tasks_info` run at once (one
+        # environment per episode). each step needs a single network forward pass over all
+        # the active environments, or one per task for agents that switch the task's mask
+        # (see eval_task_slots), batched over the task's episodes. for agents that support
+        # it, a mixed task forward pass replaces the per task ones (see eval_task_indices).
+        # returns the (rewards, episodes) of each task, as returned by evaluate_cl.
+        num_tasks = len(tasks_info)
+        env = self._evaluation_vec_env(num_tasks * num_iterations)
+        num_envs = env.num_envs
+        # spare environments of a larger (reused) set run the first task and are ignored
+        env_tasks = np.repeat(np.arange(num_tasks), num_iterations)
+        env_tasks = np.concatenate([env_tasks, -np.ones(num_envs-len(env_tasks), np.int64)])
+        task_labels = np.stack([tasks_info[max(idx, 0)]['task_label'] for idx in env_tasks])
+        states = env.reset_tasks([tasks_info[max(idx, 0)] for idx in env_tasks])
+        epi_infos = [{'logits': [], 'sampled_action': [], 'log_prob': [], 'entropy': [],
+            'value': [], 'deterministic_action': [], 'reward': [], 'terminal': []} \
+            for _ in range(num_envs)]
+        total_rewards = np.zeros(num_envs)
+        active = env_tasks >= 0
+        actions = np.zeros(num_envs, dtype=np.int64)
+        # the task of each forward pass is resolved once, only the mask is switched per step
+        labels = [info['task_label'] for info in tasks_info]
+        task_idxs = self.eval_task_indices(labels)
+        task_slots = self.eval_task_slots(labels) if task_idxs is None else None
+        self.task_eval_start(labels[0], verbose=False)
+        with torch.no_grad():
+            while active.any():
+                if task_slots is None:
+                    groups = [(None, np.nonzero(active)[0])]
+                else:
+                    groups = [(task_idx, np.nonzero(active & (env_tasks == task_idx))[0]) \
+                        for task_idx in range(num_tasks)]
+                for task_idx, envs in groups:
+                    if len(envs) == 0: continue
+                    if task_idxs is not None:
+                        self.task_eval_switch(task_idxs[env_tasks[envs]])
+                    elif task_idx is not None:
+                        self.task_eval_switch(task_slots[task_idx])
+                    actions_, output_infos = self.evaluation_actions(states[envs], \
+                        task_labels[envs])
+                    actions[envs] = actions_
+                    for env_idx, output_info in zip(envs, output_infos):
+                        for k, v in output_info.items(): epi_infos[env_idx][k].append(v)
+                # finished environments keep stepping (and auto resetting) until all
+                # episodes are done, their transitions are ignored.
+                states, rewards, dones, _ = env.step(actions)
+                for env_idx in np.nonzero(active)[0]:
+                    total_rewards[env_idx] += rewards[env_idx]
+                    epi_infos[env_idx]['reward'].append(rewards[env_idx])
+                    epi_infos[env_idx]['terminal'].append(dones[env_idx])
+                active &= ~dones
+        self.task_eval_end(verbose=False)
+        results = []
+        for task_idx in range(num_tasks):
+            envs = np.nonzero(env_tasks == task_idx)[0]
+            results.append(([total_rewards[env_idx] for env_idx in envs], \
+                [epi_infos[env_idx] for env_idx in envs]))
+        return results
@@ -8,6 +8,8 @@ from ..network import *
 from ..component import *
 from .BaseAgent import *
 from copy import deepcopy
+import json
+import time
 import numpy as np
 
 class PPOAgent(BaseAgent):
@@ -22,12 +24,13 @@ class PPOAgent(BaseAgent):
         self.last_episode_rewards = np.zeros(config.num_workers)
         self.states = self.task.reset()
         self.states = config.state_normalizer(self.states)
+        self.storage = RolloutStorage(config.rollout_length, config.num_workers)
 
     def iteration(self):
         config = self.config
-        rollout = []
+        storage = self.storage
         states = self.states
-        for _ in range(config.rollout_length):
+        for t in range(config.rollout_length):
             actions, log_probs, _, values = self.network.predict(states)
             next_states, rewards, terminals, _ = self.task.step(actions.cpu().detach().numpy())
             self.episode_rewards += rewards
@@ -37,31 +40,19 @@ class PPOAgent(BaseAgent):
                     self.last_episode_rewards[i] = self.episode_rewards[i]
                     self.episode_rewards[i] = 0
             next_states = config.state_normalizer(next_states)
-            rollout.append([states, values.detach(), actions.detach(), log_probs.detach(), rewards, 1 - terminals])
+            storage.insert(t, states=states, values=values, actions=actions, log_probs=log_probs, \
+                rewards=np.reshape(rewards, (-1, 1)), masks=np.reshape(1 - terminals, (-1, 1)))
             states = next_states
 
         self.states = states
         pending_value = self.network.predict(states)[-1]
-        rollout.append([states, pending_value, None, None, None, None])
-        processed_rollout = [None] * (len(rollout) - 1)
-        advantages = tensor(np.zeros((config.num_workers, 1)))
-        returns = pending_value.detach()
-        for i in reversed(range(len(rollout) - 1)):
-            states, value, actions, log_probs, rewards, terminals = rollout[i]
-            terminals = tensor(terminals).unsqueeze(1)
-            rewards = tensor(rewards).unsqueeze(1)
-            actions = tensor(actions)
-            states = tensor(states)
-            next_value = rollout[i + 1][1]
-            returns = rewards + config.discount * terminals * returns
-            if not config.use_gae:
-                advantages = returns - value.detach()
-            else:
-                td_error = rewards + config.discount * terminals * next_value.detach() - value.detach()
-                advantages = advantages * config.gae_tau * config.discount * terminals + td_error
-            processed_rollout[i] = [states, actions, log_probs, returns, advantages]
+        storage.insert(config.rollout_length, states=states, values=pending_value)
+        returns, advantages = returns_and_advantages(storage.rewards, storage.masks, \
+            storage.values, config.discount, config.use_gae, config.gae_tau)
+        storage.insert(None, returns=returns, advantages=advantages)
 
-        states, actions, log_probs_old, returns, advantages = map(lambda x: torch.cat(x, dim=0), zip(*processed_rollout))
+        states, actions, log_probs_old, returns, advantages = storage.flat('states', 'actions', \
+            'log_probs', 'returns', 'advantages')
         advantages = (advantages - advantages.mean()) / advantages.std()
 
         batcher = Batcher(states.size(0) // config.num_mini_batches, [np.arange(states.size(0))])
@@ -122,13 +113,34 @@ class PPOContinualLearnerAgent(BaseContinualLearnerAgent):
         self.states = config.state_normalizer(self.states)
         self.layers_output = None
         self.data_buffer = Replay(memory_size=int(1e4), batch_size=256)
+        self.storage = RolloutStorage(config.rollout_length, config.num_workers)
 
         self.curr_train_task_label = None
         self.curr_eval_task_label = None
 
+    def _setup_mask_layers(self):
+        # supermask agents: execution/storage modes of the network's mask layers
+        config = self.config
+        if config.sparse_kernel:
+            set_sparse_kernel(self.network, True, config.sparse_kernel_crossover)
+        if config.mask_bank:
+            if config.archive_masks:
+                raise ValueError('archive_masks frees no memory with mask_bank (an archived ' \
+                    'task keeps its bank row), enable only one of them')
+            MaskBank(self.network)
+        if config.share_backbone:
+            share_backbone(self.network, config.seed)
+
+    def _add_task_slot(self, task_idx):
+        # supermask agents: allocate the mask layers' scores of task_idx on first use and
+        # train them with the existing optimizer
+        new_scores = add_tasks(self.network, task_idx + 1)
+        if len(new_scores) > 0:
+            self.opt.add_param_group({'params': new_scores})
+
     def iteration(self):
         config = self.config
-        rollout = []
+        storage = self.storage
         states = self.states
         if self.curr_train_task_label is not None:
             task_label = self.curr_train_task_label
@@ -143,48 +155,37 @@ class PPOContinualLearnerAgent(BaseContinualLearnerAgent):
         else:
             batch_task_label = torch.repeat_interleave(task_label.reshape(1, -1), batch_dim, dim=0)
 
-        for _ in range(config.rollout_length):
-            _, actions, log_probs, _, values, _ = self.network.predict(states, \
-                task_label=batch_task_label)
-            next_states, rewards, terminals, _ = self.task.step(actions.cpu().detach().numpy())
-            self.episode_rewards += rewards
-            rewards = config.reward_normalizer(rewards)
-            for i, terminal in enumerate(terminals):
-                if terminals[i]:
-                    self.last_episode_rewards[i] = self.episode_rewards[i]
-                    self.episode_rewards[i] = 0
-            next_states = config.state_normalizer(next_states)
-
-            # save data to buffer for the detect module
-            self.data_buffer.feed_batch([states, actions, rewards, terminals, next_states])
-
-            rollout.append([states, values.detach(), actions.detach(), log_probs.detach(), \
-                rewards, 1 - terminals])
-            states = next_states
+        if isinstance(self.task, AsyncParallelizedTask):
+            states = self._async_rollout(task_label)
+        else:
+            for t in range(config.rollout_length):
+                actions, log_probs, values = self.network.act(states, task_label=batch_task_label)
+                next_states, rewards, terminals, _ = self.task.step(actions.cpu().detach().numpy())
+                self.episode_rewards += rewards
+                rewards = config.reward_normalizer(rewards)
+                for i, terminal in enumerate(terminals):
+                    if terminals[i]:
+                        self.last_episode_rewards[i] = self.episode_rewards[i]
+                        self.episode_rewards[i] = 0
+                next_states = config.state_normalizer(next_states)
+
+                # save data to buffer for the detect module
+                self.data_buffer.feed_batch([states, actions, rewards, terminals, next_states])
+
+                storage.insert(t, states=states, values=values, actions=actions, \
+                    log_probs=log_probs, rewards=np.reshape(rewards, (-1, 1)), \
+                    masks=np.reshape(1 - terminals, (-1, 1)))
+                states = next_states
 
         self.states = states
-        pending_value = self.network.predict(states, task_label=batch_task_label)[-2]
-        rollout.append([states, pending_value, None, None, None, None])
-        processed_rollout = [None] * (len(rollout) - 1)
-        advantages = tensor(np.zeros((config.num_workers, 1)))
-        returns = pending_value.detach()
-        for i in reversed(range(len(rollout) - 1)):
-            states, value, actions, log_probs, rewards, terminals = rollout[i]
-            terminals = tensor(terminals).unsqueeze(1)
-            rewards = tensor(rewards).unsqueeze(1)
-            actions = tensor(actions)
-            states = tensor(states)
-            next_value = rollout[i + 1][1]
-            returns = rewards + config.discount * terminals * returns
-            if not config.use_gae:
-                advantages = returns - value.detach()
-            else:
-                td_error = rewards + config.discount*terminals*next_value.detach() - value.detach()
-                advantages = advantages * config.gae_tau * config.discount * terminals + td_error
-            processed_rollout[i] = [states, actions, log_probs, returns, advantages]
-
-        states, actions, log_probs_old, returns, advantages = map(lambda x: torch.cat(x, dim=0), \
-            zip(*processed_rollout))
+        pending_value = self.network.act(states, task_label=batch_task_label)[-1]
+        storage.insert(config.rollout_length, states=states, values=pending_value)
+        returns, advantages = returns_and_advantages(storage.rewards, storage.masks, \
+            storage.values, config.discount, config.use_gae, config.gae_tau)
+        storage.insert(None, returns=returns, advantages=advantages)
+
+        states, actions, log_probs_old, returns, advantages = storage.flat('states', 'actions', \
+            'log_probs', 'returns', 'advantages')
         advantages = (advantages - advantages.mean()) / advantages.std()
 
         grad_norms_ = []
@@ -225,6 +226,57 @@ class PPOContinualLearnerAgent(BaseContinualLearnerAgent):
         self.layers_output = outs
         return np.mean(grad_norms_)
 
+    def _async_rollout(self, task_label):
+        # ready-first collection with an AsyncParallelizedTask: each environment is stepped
+        # again as soon as its previous step returns, until every environment has
+        # rollout_length transitions, written to the rollout storage at each environment's
+        # own time step. returns the last states.
+        config = self.config
+        task = self.task
+        storage = self.storage
+        num_envs = config.num_workers
+        states = np.copy(self.states)
+        step_idx = np.zeros(num_envs, dtype=np.int64)
+        actions_ = np.zeros(num_envs, dtype=np.int64)
+
+        def _act(env_ids):
+            batch_task_label = torch.repeat_interleave(task_label.reshape(1, -1), len(env_ids), \
+                dim=0)
+            actions, log_probs, values = self.network.act(states[env_ids], \
+                task_label=batch_task_label)
+            storage.insert(step_idx[env_ids], env_ids, states=states[env_ids], values=values, \
+                actions=actions, log_probs=log_probs)
+            actions_[env_ids] = actions.cpu().detach().numpy()
+            task.send(actions_[env_ids], env_ids)
+
+        _act(np.arange(num_envs))
+        num_in_flight = num_envs
+        while num_in_flight > 0:
+            next_states, rewards, terminals, _, env_ids = task.recv()
+            num_in_flight -= len(env_ids)
+            t = step_idx[env_ids]
+            self.episode_rewards[env_ids] += rewards
+            rewards = config.reward_normalizer(rewards)
+            for i, env_id in enumerate(env_ids):
+                if terminals[i]:
+                    self.last_episode_rewards[env_id] = self.episode_rewards[env_id]
+                    self.episode_rewards[env_id] = 0
+            next_states = config.state_normalizer(next_states)
+
+            # save data to buffer for the detect module
+            self.data_buffer.feed_batch([states[env_ids], actions_[env_ids], rewards, \
+                terminals, next_states])
+
+            storage.insert(t, env_ids, rewards=np.reshape(rewards, (-1, 1)), \
+                masks=np.reshape(1 - terminals, (-1, 1)))
+            states[env_ids] = next_states
+            step_idx[env_ids] += 1
+            env_ids = env_ids[step_idx[env_ids] < config.rollout_length]
+            if len(env_ids) > 0:
+                _act(env_ids)
+                num_in_flight += len(env_ids)
+        return states
+
 class BaselineAgent(PPOContinualLearnerAgent):
     '''
     PPO continual learning agent baseline (experience catastrophic forgetting)
@@ -240,11 +292,11 @@ class BaselineAgent(PPOContinualLearnerAgent):
         self.curr_train_task_label = None
         return
 
-    def task_eval_start(self, task_label):
+    def task_eval_start(self, task_label, verbose=True):
         self.curr_eval_task_label = task_label
         return
 
-    def task_eval_end(self):
+    def task_eval_end(self, verbose=True):
         self.curr_eval_task_label = None
         return
 
@@ -261,6 +313,9 @@ class LLAgent(PPOContinualLearnerAgent):
        self.seen_tasks = {} # contains task labels that agent has experienced so far.
        self.new_task = False
        self.curr_train_task_label = None
+       self._setup_mask_layers()
+       # evaluation cache: (task, eval env config, seed, episodes) -> (subnet hash, results)
+       self.eval_cache = {}
 
     def _label_to_idx(self, task_label):
         eps = 1e-5
@@ -289,19 +344,38 @@ class LLAgent(PPOContinualLearnerAgent):
             task_idx = len(self.seen_tasks) # generate an internal task index for new task
             self.seen_tasks[task_idx] = task_label
             self.new_task = True
+        else:
+            # task trained again, bring back its scores if it was archived
+            restore_task(self.network, task_idx)
+        self._add_task_slot(task_idx)
         set_model_task(self.network, task_idx)
         self.curr_train_task_label = task_label
         return
 
     def task_train_end(self):
+        task_idx = self._label_to_idx(self.curr_train_task_label)
         self.curr_train_task_label = None
-        cache_masks(self.network)
+        cache_masks(self.network, task_idx)
         if self.new_task:
             set_num_tasks_learned(self.network, len(self.seen_tasks))
         self.new_task = False # reset flag
+        if self.config.archive_masks:
+            self._archive_task(task_idx)
         return
 
-    def task_eval_start(self, task_label):
+    def _archive_task(self, task_idx):
+        # keep the finished task's mask bit packed and release its scores, along with their
+        # optimizer state
+        archive_task(self.network, task_idx, self.config.archived_scores_dtype)
+        for m in self.network.modules():
+            if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse):
+                self.opt.state.pop(m.scores[task_idx], None)
+        if self.config.logger is not None:
+            report = mask_memory_report(self.network)
+            self.config.logger.info('{0} mask memory (MB): {1}'.format(self.config.agent_name, \
+                ', '.join('{0} {1:.3f}'.format(k, v / 2**20) for k, v in report.items())))
+
+    def task_eval_start(self, task_label, verbose=True):
         self.network.eval()
         task_idx = self._label_to_idx(task_label)
         if task_idx is None:
@@ -313,20 +387,84 @@ class LLAgent(PPOContinualLearnerAgent):
             # agent to use an ensemble of different mask
             # internally for the task not yet seen.
             task_idx = 0
-        set_model_task(self.network, task_idx)
+        set_model_task(self.network, task_idx, verbose)
         self.curr_eval_task_label = task_label
         return
 
-    def task_eval_end(self):
+    def task_eval_end(self, verbose=True):
         self.curr_eval_task_label = None
         self.network.train()
         # resume training the model on train task label if training
         # was on before running evaluations.
         if self.curr_train_task_label is not None:
             task_idx = self._label_to_idx(self.curr_train_task_label)
-            set_model_task(self.network, task_idx)
+            set_model_task(self.network, task_idx, verbose)
+        return
+
+    def eval_task_indices(self, task_labels):
+        if not self.config.eval_mixed_tasks:
+            return None
+        return self.eval_task_slots(task_labels)
+
+    def eval_task_slots(self, task_labels):
+        # tasks not trained on use the first task's mask (see task_eval_start)
+        task_idxs = [self._label_to_idx(task_label) for task_label in task_labels]
+        return np.array([0 if task_idx is None else task_idx for task_idx in task_idxs])
+
+    def task_eval_switch(self, task_idx):
+        # an array of indices selects one mask per sample (see mixed_task_linear)
+        if isinstance(task_idx, np.ndarray):
+            task_idx = torch.as_tensor(task_idx, device=Config.DEVICE)
+        else:
+            task_idx = int(task_idx)
+        set_model_task(self.network, task_idx, False)
         return
 
+    def _eval_cache_key(self, task_label, task_name, num_iterations):
+        # the evaluation of a task only depends on the subnetwork used for it (see
+        # task_eval_start) and on the (fixed seed) evaluation environment. returns the cache
+        # key of the task and the hash of its current subnetwork.
+        task_idx = self._label_to_idx(task_label)
+        if task_idx is None: task_idx = 0
+        env_config = getattr(self.evaluation_env, 'env_config', None)
+        key = (str(task_name), np.asarray(task_label).tobytes(), \
+            json.dumps(env_config, sort_keys=True, default=str), self.config.seed, num_iterations)
+        return key, get_subnet_hash(self.network, task_idx)
+
+    def _eval_cache_log(self, num_hits, num_tasks):
+        if self.config.logger is not None:
+            self.config.logger.info('eval cache: {0}/{1} task(s) reused, {2} evaluated'.format(\
+                num_hits, num_tasks, num_tasks - num_hits))
+
+    def evaluate_cl(self, num_iterations=100):
+        if not self.config.eval_cache:
+            return PPOContinualLearnerAgent.evaluate_cl(self, num_iterations)
+        key, subnet_hash = self._eval_cache_key(self.curr_eval_task_label, \
+            self.evaluation_env.get_task()['task'], num_iterations)
+        if key in self.eval_cache and self.eval_cache[key][0] == subnet_hash:
+            self._eval_cache_log(1, 1)
+            return self.eval_cache[key][1]
+        ret = PPOContinualLearnerAgent.evaluate_cl(self, num_iterations)
+        self.eval_cache[key] = (subnet_hash, ret)
+        self._eval_cache_log(0, 1)
+        return ret
+
+    def evaluate_cl_batched(self, tasks_info, num_iterations=100):
+        if not self.config.eval_cache:
+            return PPOContinualLearnerAgent.evaluate_cl_batched(self, tasks_info, num_iterations)
+        keys = [self._eval_cache_key(task_info['task_label'], task_info['task'], \
+            num_iterations) for task_info in tasks_info]
+        missing = [idx for idx, (key, subnet_hash) in enumerate(keys) \
+            if key not in self.eval_cache or self.eval_cache[key][0] != subnet_hash]
+        if len(missing) > 0:
+            results = PPOContinualLearnerAgent.evaluate_cl_batched(self, \
+                [tasks_info[idx] for idx in missing], num_iterations)
+            for idx, result in zip(missing, results):
+                key, subnet_hash = keys[idx]
+                self.eval_cache[key] = (subnet_hash, result)
+        self._eval_cache_log(len(tasks_info) - len(missing), len(tasks_info))
+        return [self.eval_cache[key][1] for key, _ in keys]
+
 class ShellAgent_SP(LLAgent):
     '''
     Lifelong learning (ppo continual learning with supermask) agent in ShELL
@@ -334,6 +472,16 @@ class ShellAgent_SP(LLAgent):
     '''
     def __init__(self, config):
         LLAgent.__init__(self, config)
+        # knowledge directory shared by the agents (config.knowledge_directory), set by the
+        # runner along with the agent's index
+        self.agent_id = None
+        self.directory = None
+
+    def task_train_end(self):
+        task_label = self.curr_train_task_label
+        LLAgent.task_train_end(self)
+        if self.directory is not None:
+            self.directory.publish(task_label, self.agent_id)
 
     def ping_agents(self, agents):
         task_label = self.task.get_task()['task_label']
@@ -341,6 +489,7 @@ class ShellAgent_SP(LLAgent):
         masks = [agent.ping_response(task_label) for agent in agents]
         mask = self._select_mask(agents, masks)
         if mask is not None:
+            self._add_task_slot(task_idx)
             # function from deep_rl/network/ssmask_utils.py
             set_mask(self.network, mask, task_idx)
             return True
@@ -371,18 +520,131 @@ class ShellAgent_DP(LLAgent):
         for k, v in self.mask_info.items():
             model_mask_dim += np.prod(v)
         self.model_mask_dim = model_mask_dim
-            
-    def infuse_masks(self, masks):
-        print('to be implemented')
-        return False
+        # message transport to the other agents (Communications), set by the runner
+        self.comm = None
+        self.ping_id = 0
+        self.peers_done = set()
+        # asynchronous pings (config.async_pings): ping id -> [task label, ping time,
+        # total steps at ping time, number of answers still expected]
+        self.pending_pings = {}
+        # knowledge directory shared by the agents (config.knowledge_directory), set by the
+        # runner
+        self.directory = None
+
+    def task_train_end(self):
+        task_label = self.curr_train_task_label
+        LLAgent.task_train_end(self)
+        if self.directory is not None:
+            self.directory.publish(task_label, self.comm.agent_id)
+
+    def ping_agents(self):
+        # ask the other agents (the holders of the task in the knowledge directory, if any)
+        # for a mask of the current task and install the first one found. blocks until all
+        # of them answered, serving their own pings meanwhile. with config.async_pings,
+        # returns straight away (None once pings are sent) and the answers are handled as
+        # they arrive (see handle_message)
+        task_label = self.task.get_task()['task_label']
+        if self.directory is not None:
+            receivers = self.directory.holders(task_label, exclude=self.comm.agent_id)
+        else:
+            receivers = [agent_id for agent_id in range(self.comm.num_agents) \
+                if agent_id != self.comm.agent_id]
+        if len(receivers) == 0:
+            return False
+        self.ping_id += 1
+        for receiver in receivers:
+            self.comm.send(receiver, Communications.PING, (self.ping_id, task_label))
+        if self.config.async_pings:
+            self.pending_pings[self.ping_id] = [task_label, time.time(), self.total_steps, \
+                len(receivers)]
+            return None
+        senders, masks = [], []
+        while len(masks) < len(receivers):
+            msg = self.comm.recv(block=True)
+            msg_type, sender, payload = msg
+            if msg_type == Communications.RESPONSE and payload[0] == self.ping_id:
+                senders.append(sender)
+                masks.append(payload[1])
+            else:
+                self.handle_message(msg)
+        return self.infuse_masks(masks, senders)
+
+    def handle_message(self, msg):
+        msg_type, sender, payload = msg
+        if msg_type == Communications.PING:
+            ping_id, task_label = payload
+            self.comm.send(sender, Communications.RESPONSE, (ping_id, \
+                self.ping_response(task_label)))
+        elif msg_type == Communications.RESPONSE:
+            self._handle_response(sender, *payload)
+        elif msg_type == Communications.DONE:
+            self.peers_done.add(sender)
+
+    def _handle_response(self, sender, ping_id, mask):
+        # answer to an asynchronous ping. the first useful (not stale) mask is installed,
+        # the later answers are dropped. answers to blocking pings that were already
+        # resolved are dropped too.
+        ping = self.pending_pings.get(ping_id, None)
+        if ping is None:
+            return
+        task_label, ping_time, ping_steps, _ = ping
+        latency = time.time() - ping_time
+        logger = self.config.logger
+        if logger is not None:
+            logger.scalar_summary('ping/latency', latency)
+        ping[3] -= 1
+        if ping[3] == 0:
+            del self.pending_pings[ping_id]
+        if mask is None:
+            return
+        stale = self._stale_mask(task_label, ping_steps)
+        if stale is not None:
+            if logger is not None:
+                logger.info('rejected stale mask from agent {0} ({1})'.format(sender, stale))
+            return
+        self.infuse_masks([mask], [sender])
+        self.pending_pings.pop(ping_id, None)
+        if logger is not None:
+            logger.info('installed mask from agent {0}, {1:.3f}s / {2} steps after ping'.format(\
+                sender, latency, self.total_steps - ping_steps))
+            logger.scalar_summary('ping/time_to_first_mask', latency)
+
+    def _stale_mask(self, task_label, ping_steps):
+        # staleness policy of asynchronous masks: reason for rejecting the mask, or None
+        if not np.array_equal(task_label, self.task.get_task()['task_label']):
+            return 'agent moved on to another task'
+        limit = self.config.mask_staleness_steps
+        if limit is not None and self.total_steps - ping_steps > limit:
+            return 'task trained for {0} steps since ping'.format(self.total_steps - ping_steps)
+        return None
+
+    def process_messages(self):
+        # serve the pending messages (e.g., between training iterations)
+        msg = self.comm.recv()
+        while msg is not None:
+            self.handle_message(msg)
+            msg = self.comm.recv()
+
+    def infuse_masks(self, masks, senders=None):
+        senders = [None] * len(masks) if senders is None else senders
+        mask = self._select_mask(senders, masks)
+        if mask is None:
+            return False
+        if mask.size != self.model_mask_dim:
+            raise ValueError('received mask of size {0}, expected {1}'.format(mask.size, \
+                self.model_mask_dim))
+        task_idx = self._label_to_idx(self.task.get_task()['task_label'])
+        self._add_task_slot(task_idx)
+        set_mask(self.network, tensor(mask), task_idx)
+        return True
 
     def ping_response(self, task_label):
         task_idx = self._label_to_idx(task_label)
-        # get task mask.
+        # get task mask (flat, as a numpy array to be sent to the requester).
         if task_idx is None:
             mask = None
         else:
-            mask = get_mask(self.network, task_idx)
+            mask = get_mask(self.network, task_idx, flat=True).detach().cpu().numpy().copy()
         return mask
 
 class LLAgent_NoOracle(PPOContinualLearnerAgent):
@@ -397,23 +659,17 @@ class LLAgent_NoOracle(PPOContinualLearnerAgent):
     def __init__(self, config):
        PPOContinualLearnerAgent.__init__(self, config)
        self.seen_tasks = {} # contains task labels that agent has experienced so far.
+       # environment task name -> internal task index, only used to pick the mask of an
+       # evaluation task (see record_task_name)
+       self.task_names = {}
        self.new_task = False
        self.curr_train_task_label = None
-
-    def _name_to_idx(self, name):
-        found_task_idx = None
-        for task_idx, value in self.seen_tasks.items():
-            seen_task_label, task_name = value
-            if name == task_name:
-                found_task_idx = task_idx
-                break
-        return found_task_idx
+       self._setup_mask_layers()
 
     def _label_to_idx(self, task_label):
         eps = 1e-5
         found_task_idx = None
-        for task_idx, value in self.seen_tasks.items():
-            seen_task_label, task_name = value
+        for task_idx, seen_task_label in self.seen_tasks.items():
             if np.linalg.norm((task_label - seen_task_label), ord=2) < eps:
                 found_task_idx = task_idx
                 break
@@ -430,46 +686,99 @@ class LLAgent_NoOracle(PPOContinualLearnerAgent):
                     break
         return found_mask
 
+    def infer_task(self, states):
+        # one-shot inference (see infer_task in ssmask_utils) of the task of a batch of
+        # (normalised) states among the tasks seen so far, the current one included.
+        # returns the internal task index, None if the policy is too uncertain under the
+        # inferred task's mask (normalised entropy above config.detect_unknown_entropy,
+        # i.e., a task not seen before), and that normalised entropy.
+        curr_task_idx = self._label_to_idx(self.curr_train_task_label)
+        cache_masks(self.network, curr_task_idx, verbose=False)
+        task_label = tensor(self.curr_train_task_label).reshape(1, -1)
+        task_label = torch.repeat_interleave(task_label, len(states), dim=0)
+        logits_fn = lambda: self.network.policy_logits(states, task_label)
+        task_idx, _ = infer_task(self.network, logits_fn, len(self.seen_tasks))
+        set_model_task(self.network, task_idx, False)
+        with torch.no_grad():
+            log_probs = F.log_softmax(logits_fn(), dim=-1)
+        set_model_task(self.network, curr_task_idx, False)
+        entropy = -(log_probs.exp() * log_probs).sum(dim=-1).mean().item()
+        entropy /= np.log(log_probs.shape[-1])
+        if entropy > self.config.detect_unknown_entropy:
+            task_idx = None
+        return task_idx, entropy
+
+    def infer_task_label(self, states):
+        # label of the task inferred for a batch of states (None for a task not seen before,
+        # see infer_task) and whether it is the task being trained
+        task_idx, _ = self.infer_task(states)
+        if task_idx is None:
+            return None, False
+        return self.seen_tasks[task_idx], \
+            task_idx == self._label_to_idx(self.curr_train_task_label)
+
+    def new_task_label(self):
+        # internal label of a detected task not seen before: one-hot, on the first index
+        # not used by a seen task's label
+        label_dim = len(self.curr_train_task_label)
+        used = set(int(np.argmax(seen_task_label)) for seen_task_label in \
+            self.seen_tasks.values())
+        free = [idx for idx in range(label_dim) if idx not in used]
+        if len(free) == 0:
+            raise ValueError('no free task label left ({0} tasks seen, label dim {1})'.format(\
+                len(self.seen_tasks), label_dim))
+        task_label = np.zeros(label_dim, dtype=np.float32)
+        task_label[free[0]] = 1.
+        return task_label
+
     def update_task_label(self, task_label):
         # TODO: consider other ways to update the label as detect module
         # alters it. Maybe moving average?
         task_idx = self._label_to_idx(self.curr_train_task_label)
-        self.seen_tasks[task_idx][0] = task_label
+        self.seen_tasks[task_idx] = task_label
         self.curr_train_task_label = task_label
 
-    def set_first_task(self, task_label, task_name):
+    def record_task_name(self, task_name):
+        # evaluation bookkeeping: evaluations on the environment task `task_name` use the
+        # mask of the task being trained. takes no part in task change detection
+        if self.curr_train_task_label is not None:
+            self.task_names[task_name] = self._label_to_idx(self.curr_train_task_label)
+
+    def set_first_task(self, task_label):
         # start first task
         task_idx = 0 # first task idx is 0
-        self.seen_tasks[task_idx] = [task_label, task_name]
+        self.seen_tasks[task_idx] = task_label
         self.new_task = True
+        self._add_task_slot(task_idx)
         set_model_task(self.network, task_idx)
         self.curr_train_task_label = task_label
         return
 
-    def task_change_detected(self, task_label, task_name):
+    def task_change_detected(self, task_label):
         # end current task (if any)
         if self.curr_train_task_label is not None:
-            cache_masks(self.network)
+            cache_masks(self.network, self._label_to_idx(self.curr_train_task_label))
             if self.new_task:
                 set_num_tasks_learned(self.network, len(self.seen_tasks))
             self.new_task = False # reset flag
             self.curr_train_task_label = None
 
         # start next task
-        # use task label or task name to check if task already exist in model
+        # use task label to check if task already exist in model
         task_idx = self._label_to_idx(task_label)
         if task_idx is None:
             # new task. add it to the agent's seen_tasks dictionary
             task_idx = len(self.seen_tasks) # generate an internal task index for new task
-            self.seen_tasks[task_idx] = [task_label, task_name]
+            self.seen_tasks[task_idx] = task_label
             self.new_task = True
+        self._add_task_slot(task_idx)
         set_model_task(self.network, task_idx)
         self.curr_train_task_label = task_label
         return
 
     def task_eval_start(self, task_name):
         self.network.eval()
-        task_idx = self._name_to_idx(task_name)
+        task_idx = self.task_names.get(task_name, None)
         if task_idx is None:
             # agent has not been trained on current task
             # being evaluated. therefore use a random mask
@@ -480,10 +789,13 @@ class LLAgent_NoOracle(PPOContinualLearnerAgent):
             # internally for the task not yet seen.
             task_idx = 0
         set_model_task(self.network, task_idx)
+        # the (internal) label of the task whose mask is used
+        self.curr_eval_task_label = self.seen_tasks[task_idx]
         return
 
     def task_eval_end(self):
         self.network.train()
+        self.curr_eval_task_label = None
         # resume training the model on train task label if training
         # was on before running evaluations.
         if self.curr_train_task_label is not None:
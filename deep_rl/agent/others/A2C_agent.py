@@ -9,6 +9,19 @@ from ...network import *
 from ...component import *
 from ..BaseAgent import *
 
+# helper function
+def _process_rollout(config, rollout, pending_value):
+    # returns and advantages of a rollout of [log_probs, values, actions, rewards,
+    # 1 - terminals, entropy] time steps. returns the (rollout_length * num_workers, ...)
+    # log probs, values, returns, advantages and entropies.
+    log_prob, value, _, rewards, masks, entropy = zip(*rollout)
+    values = torch.stack([v.detach() for v in value + (pending_value, )])
+    returns, advantages = returns_and_advantages(np.stack(rewards)[..., None], \
+        np.stack(masks)[..., None], values, config.discount, config.use_gae, config.gae_tau)
+    return torch.cat(log_prob, dim=0), torch.cat(value, dim=0), \
+        tensor(returns).reshape(-1, 1), tensor(advantages).reshape(-1, 1), \
+        torch.cat(entropy, dim=0)
+
 class A2CAgent(BaseAgent):
     def __init__(self, config):
         BaseAgent.__init__(self, config)
@@ -40,25 +53,8 @@ class A2CAgent(BaseAgent):
 
         self.states = states
         pending_value = self.network.predict(config.state_normalizer(states))[-1]
-        rollout.append([None, pending_value, None, None, None, None])
-
-        processed_rollout = [None] * (len(rollout) - 1)
-        advantages = tensor(np.zeros((config.num_workers, 1)))
-        returns = pending_value.detach()
-        for i in reversed(range(len(rollout) - 1)):
-            log_prob, value, actions, rewards, terminals, entropy = rollout[i]
-            terminals = tensor(terminals).unsqueeze(1)
-            rewards = tensor(rewards).unsqueeze(1)
-            next_value = rollout[i + 1][1]
-            returns = rewards + config.discount * terminals * returns
-            if not config.use_gae:
-                advantages = returns - value.detach()
-            else:
-                td_error = rewards + config.discount * terminals * next_value.detach() - value.detach()
-                advantages = advantages * config.gae_tau * config.discount * terminals + td_error
-            processed_rollout[i] = [log_prob, value, returns, advantages, entropy]
-
-        log_prob, value, returns, advantages, entropy = map(lambda x: torch.cat(x, dim=0), zip(*processed_rollout))
+        log_prob, value, returns, advantages, entropy = _process_rollout(config, rollout, \
+            pending_value)
         policy_loss = -log_prob * advantages
         value_loss = 0.5 * (returns - value).pow(2)
         entropy_loss = entropy.mean()
@@ -148,26 +144,8 @@ class A2CContinualLearnerAgent(BaseContinualLearnerAgent):
 
         self.states = states
         pending_value = self.network.predict(states, task_label=current_task_label)[-1]
-        rollout.append([None, pending_value, None, None, None, None])
-
-        processed_rollout = [None] * (len(rollout) - 1)
-        advantages = tensor(np.zeros((config.num_workers, 1)))
-        returns = pending_value.detach()
-        for i in reversed(range(len(rollout) - 1)):
-            log_prob, value, actions, rewards, terminals, entropy = rollout[i]
-            terminals = tensor(terminals).unsqueeze(1)
-            rewards = tensor(rewards).unsqueeze(1)
-            next_value = rollout[i + 1][1]
-            returns = rewards + config.discount * terminals * returns
-            if not config.use_gae:
-                advantages = returns - value.detach()
-            else:
-                td_error=rewards + config.discount * terminals * next_value.detach() - value.detach()
-                advantages = advantages * config.gae_tau * config.discount * terminals + td_error
-            processed_rollout[i] = [log_prob, value, returns, advantages, entropy]
-
-        log_prob, value, returns, advantages, entropy = map(lambda x: torch.cat(x, dim=0), \
-            zip(*processed_rollout))
+        log_prob, value, returns, advantages, entropy = _process_rollout(config, rollout, \
+            pending_value)
         policy_loss = -log_prob * advantages
         value_loss = 0.5 * (returns - value).pow(2)
         entropy_loss = entropy.mean()
@@ -404,26 +382,8 @@ class A2CAgentEWC(A2CContinualLearnerAgent):
 
             self.states = states
             pending_value = self.network.predict(states, task_label=current_task_label)[-1]
-            rollout.append([None, pending_value, None, None, None, None])
-
-            processed_rollout = [None] * (len(rollout) - 1)
-            advantages = tensor(np.zeros((config.num_workers, 1)))
-            returns = pending_value.detach()
-            for i in reversed(range(len(rollout) - 1)):
-                log_prob, value, actions, rewards, terminals, entropy = rollout[i]
-                terminals = tensor(terminals).unsqueeze(1)
-                rewards = tensor(rewards).unsqueeze(1)
-                next_value = rollout[i + 1][1]
-                returns = rewards + config.discount * terminals * returns
-                if not config.use_gae:
-                    advantages = returns - value.detach()
-                else:
-                    td_error=rewards + config.discount*terminals*next_value.detach() - value.detach()
-                    advantages = advantages * config.gae_tau * config.discount * terminals + td_error
-                processed_rollout[i] = [log_prob, value, returns, advantages, entropy]
-
-            log_prob, value, returns, advantages, entropy = map(lambda x: torch.cat(x, dim=0), \
-                zip(*processed_rollout))
+            log_prob, value, returns, advantages, entropy = _process_rollout(config, rollout, \
+                pending_value)
             policy_loss = -log_prob * advantages
             value_loss = 0.5 * (returns - value).pow(2)
             entropy_loss = entropy.mean()
@@ -50,19 +50,14 @@ class NStepDQNAgent(BaseAgent):
 
         self.states = states
 
-        processed_rollout = [None] * (len(rollout))
-        returns = self.target_network.predict(config.state_normalizer(states)).detach()
-        returns, _ = torch.max(returns, dim=1, keepdim=True)
-        for i in reversed(range(len(rollout))):
-            q, actions, rewards, terminals = rollout[i]
-            actions = tensor(actions).unsqueeze(1).long()
-            q = q.gather(1, actions)
-            terminals = tensor(terminals).unsqueeze(1)
-            rewards = tensor(rewards).unsqueeze(1)
-            returns = rewards + config.discount * terminals * returns
-            processed_rollout[i] = [q, returns]
-
-        q, returns= map(lambda x: torch.cat(x, dim=0), zip(*processed_rollout))
+        pending_value = self.target_network.predict(config.state_normalizer(states)).detach()
+        pending_value, _ = torch.max(pending_value, dim=1, keepdim=True)
+        q, actions, rewards, masks = zip(*rollout)
+        actions = tensor(np.asarray(actions)).unsqueeze(2).long()
+        q = torch.stack(q).gather(2, actions).reshape(-1, 1)
+        returns = discounted_returns(np.stack(rewards)[..., None], np.stack(masks)[..., None], \
+            pending_value, config.discount)
+        returns = tensor(returns).reshape(-1, 1)
         loss = 0.5 * (q - returns).pow(2).mean()
         self.optimizer.zero_grad()
         loss.backward()
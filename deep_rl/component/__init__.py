@@ -3,4 +3,5 @@ from .policy import *
 from .replay import *
 from .task import *
 from .random_process import *
-from .bench import *
\ No newline at end of file
+from .bench import *
+from .vec_task import *
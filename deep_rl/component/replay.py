@@ -5,6 +5,8 @@
 #######################################################################
 
 import numpy as np
+import torch
+from ..utils import *
 
 class Replay:
     def __init__(self, memory_size, batch_size):
@@ -43,3 +45,49 @@ class Replay:
     def clear(self):
         self.data.clear()
         self.pos = 0
+
+class RolloutStorage:
+    '''
+    on-policy rollout storage of fixed size (rollout_length, num_workers, ...). the storage
+    tensors are allocated (on Config.DEVICE) the first time an entry is written, with the
+    shape and dtype of the written data, and reused in place by all subsequent rollouts.
+    states and values hold one extra time step for the pending (bootstrap) state and value.
+    '''
+    KEYS = ['states', 'values', 'actions', 'log_probs', 'rewards', 'masks', 'returns', \
+        'advantages']
+
+    def __init__(self, rollout_length, num_workers):
+        self.rollout_length = rollout_length
+        self.num_workers = num_workers
+        for key in self.KEYS: setattr(self, key, None)
+
+    def _write(self, key, index, x, batch_dims=1):
+        if not isinstance(x, torch.Tensor):
+            x = torch.from_numpy(np.asarray(x, dtype=np.float32))
+        buf = getattr(self, key)
+        if buf is None:
+            length = self.rollout_length + 1 if key in ['states', 'values'] \
+                else self.rollout_length
+            buf = torch.zeros((length, self.num_workers) + tuple(x.shape[batch_dims:]), \
+                dtype=x.dtype, device=Config.DEVICE)
+            setattr(self, key, buf)
+        buf[index] = x.detach().reshape(buf[index].shape)
+
+    def insert(self, step, env_ids=None, **kwargs):
+        # writes the given entries (e.g., states=..., rewards=...) of time step `step`, for
+        # all workers or only for the `env_ids` workers (`step` is then per worker). a
+        # `step` of None writes whole (rollout_length, num_workers, ...) entries.
+        if step is None:
+            for key, x in kwargs.items():
+                self._write(key, slice(0, self.rollout_length), x, batch_dims=2)
+            return
+        index = step if env_ids is None else (step, env_ids)
+        for key, x in kwargs.items():
+            self._write(key, index, x)
+
+    def flat(self, *keys):
+        # (rollout_length * num_workers, ...) views of the given entries, time step major
+        # (the layout expected for minibatching)
+        return [getattr(self, key)[:self.rollout_length].reshape(\
+            (self.rollout_length * self.num_workers, ) + getattr(self, key).shape[2:]) \
+            for key in keys]
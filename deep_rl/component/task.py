@@ -4,9 +4,12 @@
 # declaration at the top                                              #
 #######################################################################
 import copy
+import functools
 from .atari_wrapper import *
 import multiprocessing as mp
+import multiprocessing.connection as mp_connection
 import sys
+import time
 from .bench import Monitor
 from ..utils import *
 import uuid
@@ -321,9 +324,13 @@ class MiniGrid(BaseTask):
         env_names = env_config['tasks']
         self.envs = {name : ReseedWrapper(ImgObsWrapper(gym.make(name)), seeds=[seed,]) \
             for name in env_names}
+        # single reseed value: every episode of a task is the same given the same actions,
+        # unless (stateful) exploration bonus wrappers are applied
+        self.deterministic = True
         # apply exploration bonus wrapper only to training envs
         if not eval_mode:
             if 'wrappers' in env_config.keys():
+                self.deterministic = False
                 for str_wrapper in env_config['wrappers']:
                     cls_wrapper = self.wrappers_dict[str_wrapper]
                     for k in self.envs.keys():
@@ -497,6 +504,56 @@ class PixelBullet(BaseTask):
         self.state_dim = env.observation_space.shape
         self.env = env
 
+class SubVecTask:
+    '''
+    hosts `num_envs` task instances and steps them one after the other, exposing
+    them as a single task whose step/reset/reset_task return arrays stacked over
+    the hosted instances. used as the task of a worker process so that a process
+    serves several environments (see `envs_per_worker` in ParallelizedTask).
+    '''
+    def __init__(self, task_fn, num_envs, log_dir=None):
+        self.tasks = [task_fn(log_dir=log_dir) for _ in range(num_envs)]
+        self.num_envs = num_envs
+        self.state_dim = self.tasks[0].state_dim
+        self.action_dim = self.tasks[0].action_dim
+        self.name = self.tasks[0].name
+
+    def step(self, actions):
+        results = [task.step(action) for task, action in zip(self.tasks, actions)]
+        return tuple(map(lambda x: np.stack(x), zip(*results)))
+
+    def reset(self):
+        return np.stack([task.reset() for task in self.tasks])
+
+    def seed(self, random_seed):
+        for idx, task in enumerate(self.tasks):
+            task.seed((random_seed + idx) % sys.maxsize)
+
+    def reset_task(self, task_info):
+        return np.stack([task.reset_task(task_info) for task in self.tasks])
+
+    def reset_tasks(self, task_infos):
+        # one task per hosted instance
+        return np.stack([task.reset_task(task_info) for task, task_info in \
+            zip(self.tasks, task_infos)])
+
+    def set_task(self, task_info):
+        for task in self.tasks:
+            task.set_task(task_info)
+
+    def get_task(self):
+        return self.tasks[0].get_task()
+
+    def get_tasks(self):
+        # task of each hosted instance (see reset_tasks)
+        return [task.get_task() for task in self.tasks]
+
+    def get_all_tasks(self, requires_task_label):
+        return self.tasks[0].get_all_tasks(requires_task_label)
+
+    def random_tasks(self, num_tasks, requires_task_label):
+        return self.tasks[0].random_tasks(num_tasks, requires_task_label)
+
 class ProcessTask:
     def __init__(self, task_fn, log_dir=None):
         self.pipe, worker_pipe = mp.Pipe()
@@ -522,6 +579,8 @@ class ProcessTask:
 
     def set_task(self, task_info):
         self.pipe.send([ProcessWrapper.SET_TASK, task_info])
+        # the worker always replies, drain it so later replies stay in order
+        return self.pipe.recv()
 
     def get_task(self):
         self.pipe.send([ProcessWrapper.GET_TASK, None])
@@ -535,6 +594,14 @@ class ProcessTask:
         self.pipe.send([ProcessWrapper.RANDOM_TASKS, [num_tasks, requires_task_label]])
         return self.pipe.recv()
 
+    # split send/recv halves of a command, used by ParallelizedTask to
+    # broadcast a command to every worker before gathering the replies.
+    def send(self, op, data=None):
+        self.pipe.send([op, data])
+
+    def recv(self):
+        return self.pipe.recv()
+
 class ProcessWrapper(mp.Process):
     STEP = 0
     RESET = 1
@@ -545,6 +612,9 @@ class ProcessWrapper(mp.Process):
     GET_TASK = 6
     GET_ALL_TASKS = 7
     RANDOM_TASKS = 8
+    ATTACH_SHM = 9
+    RESET_TASKS = 10
+    GET_TASKS = 11
     def __init__(self, pipe, task_fn, log_dir):
         mp.Process.__init__(self)
         self.pipe = pipe
@@ -556,72 +626,339 @@ class ProcessWrapper(mp.Process):
         seed = np.random.randint(0, sys.maxsize)
         task = self.task_fn(log_dir=self.log_dir)
         task.seed(seed)
+        # shared memory transport: once attached, observations, rewards and
+        # dones are written into the worker's rows of the block and only the
+        # (small) info/acknowledgement goes through the pipe
+        block = None
         while True:
             op, data = self.pipe.recv()
             if op == self.STEP:
-                self.pipe.send(task.step(data))
+                if block is None:
+                    self.pipe.send(task.step(data))
+                else:
+                    state, reward, done, info = task.step(data)
+                    block.states[rows] = state
+                    block.rewards[rows] = reward
+                    block.dones[rows] = done
+                    self.pipe.send(info)
             elif op == self.RESET:
-                self.pipe.send(task.reset())
+                if block is None:
+                    self.pipe.send(task.reset())
+                else:
+                    block.states[rows] = task.reset()
+                    self.pipe.send(None)
             elif op == self.EXIT:
+                if block is not None: block.close()
                 self.pipe.close()
                 return
             elif op == self.SPECS:
                 self.pipe.send([task.state_dim, task.action_dim, task.name])
             elif op == self.RESET_TASK:
-                self.pipe.send(task.reset_task(data))
+                if block is None:
+                    self.pipe.send(task.reset_task(data))
+                else:
+                    block.states[rows] = task.reset_task(data)
+                    self.pipe.send(None)
+            elif op == self.RESET_TASKS:
+                if block is None:
+                    self.pipe.send(task.reset_tasks(data))
+                else:
+                    block.states[rows] = task.reset_tasks(data)
+                    self.pipe.send(None)
             elif op == self.SET_TASK:
                 self.pipe.send(task.set_task(data))
             elif op == self.GET_TASK:
                 self.pipe.send(task.get_task())
+            elif op == self.GET_TASKS:
+                self.pipe.send(task.get_tasks())
             elif op == self.GET_ALL_TASKS:
                 self.pipe.send(task.get_all_tasks(data))
             elif op == self.RANDOM_TASKS:
                 self.pipe.send(task.random_tasks(*data))
+            elif op == self.ATTACH_SHM:
+                name, num_workers, state_dim, rows = data
+                block = SharedTransitionBlock(num_workers, state_dim, name=name)
+                self.pipe.send(None)
             else:
                 raise Exception('Unknown command')
 
-class ParallelizedTask:
-    def __init__(self, task_fn, num_workers, log_dir=None, single_process=False):
+class SharedTransitionBlock:
+    '''
+    preallocated shared memory block holding the latest observation, reward and
+    done flag of every worker, viewed as numpy arrays of shape
+    (num_workers, *state_dim), (num_workers,) and (num_workers,). observations
+    are stored as float32. the block is created by the parent process and
+    attached by name in the workers.
+    '''
+    def __init__(self, num_workers, state_dim, name=None):
+        from multiprocessing import shared_memory
+        if isinstance(state_dim, (tuple, list)):
+            states_shape = (num_workers, ) + tuple(state_dim)
+        else:
+            states_shape = (num_workers, state_dim)
+        rewards_nbytes = num_workers * np.dtype(np.float64).itemsize
+        states_nbytes = int(np.prod(states_shape)) * np.dtype(np.float32).itemsize
+        dones_nbytes = num_workers * np.dtype(np.bool_).itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, \
+                size=rewards_nbytes + states_nbytes + dones_nbytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = name is None
+        self.name = self.shm.name
+        buf = self.shm.buf
+        self.rewards = np.ndarray((num_workers, ), dtype=np.float64, buffer=buf)
+        self.states = np.ndarray(states_shape, dtype=np.float32, buffer=buf, \
+            offset=rewards_nbytes)
+        self.dones = np.ndarray((num_workers, ), dtype=np.bool_, buffer=buf, \
+            offset=rewards_nbytes + states_nbytes)
+
+    def close(self):
+        del self.rewards, self.states, self.dones
+        try:
+            self.shm.close()
+        except BufferError:
+            # views handed out to the caller are still alive. the memory is
+            # released once they are garbage collected.
+            pass
+        if self.owner:
+            self.shm.unlink()
 
+class ParallelizedTask:
+    '''
+    pipelined: when the tasks live in worker processes, a command (step, reset,
+    reset_task) is first sent to every worker and the replies are gathered
+    afterwards, so the workers run concurrently and the call costs the latency
+    of the slowest worker instead of the sum over all workers. set
+    `pipelined=False` to get the serial send/recv round trip per worker.
+
+    shared_memory: the workers write observations, rewards and dones directly
+    into a preallocated SharedTransitionBlock and the pipes only carry control
+    messages and infos. step/reset/reset_task then return zero-copy views of
+    the block, which are overwritten by the next call (copy them to keep them).
+
+    envs_per_worker: each worker process hosts that many environments (a
+    SubVecTask) behind a single pipe and a single slice of the shared memory
+    block. `num_workers` is the total number of environments, so
+    num_workers / envs_per_worker processes are started.
+    '''
+    def __init__(self, task_fn, num_workers, log_dir=None, single_process=False, pipelined=True,
+        shared_memory=False, envs_per_worker=1):
+
+        if shared_memory and not single_process:
+            # workers must share the parent's resource tracker, otherwise the
+            # tracker of a worker unlinks the block when the worker exits
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        if single_process:
+            envs_per_worker = 1
+        if num_workers % envs_per_worker != 0:
+            raise ValueError('`num_workers` ({0}) should be a multiple of `envs_per_worker` ' \
+                '({1})'.format(num_workers, envs_per_worker))
+        self.num_envs = num_workers
+        self.envs_per_worker = envs_per_worker
+        num_processes = num_workers // envs_per_worker
         if single_process:
             self.tasks = [task_fn(log_dir=log_dir) for _ in range(num_workers)]
+        elif envs_per_worker > 1:
+            sub_task_fn = functools.partial(SubVecTask, task_fn, envs_per_worker)
+            self.tasks = [ProcessTask(sub_task_fn, log_dir) for _ in range(num_processes)]
         else:
-            self.tasks = [ProcessTask(task_fn, log_dir) for _ in range(num_workers)]
+            self.tasks = [ProcessTask(task_fn, log_dir) for _ in range(num_processes)]
         self.state_dim = self.tasks[0].state_dim
         self.action_dim = self.tasks[0].action_dim
         self.name = self.tasks[0].name
         self.single_process = single_process
+        self.pipelined = pipelined and not single_process
+        self.block = None
+        if shared_memory and not single_process:
+            self.block = SharedTransitionBlock(num_workers, self.state_dim)
+            self._broadcast(ProcessWrapper.ATTACH_SHM, [(self.block.name, num_workers, \
+                self.state_dim, self._worker_rows(idx)) for idx in range(num_processes)])
+
+    def _worker_rows(self, idx):
+        # rows of the batch (and of the shared memory block) served by worker `idx`
+        if self.envs_per_worker == 1:
+            return idx
+        return slice(idx * self.envs_per_worker, (idx + 1) * self.envs_per_worker)
+
+    def _split(self, data):
+        # per worker payload
+        if self.envs_per_worker == 1:
+            return data
+        return [data[self._worker_rows(idx)] for idx in range(len(self.tasks))]
+
+    def _merge(self, results):
+        if self.envs_per_worker == 1:
+            return np.stack(results)
+        return np.concatenate(results)
+
+    def _broadcast(self, op, data):
+        # send a command to every worker and gather the replies
+        if self.pipelined:
+            for task, data_ in zip(self.tasks, data):
+                task.send(op, data_)
+            return [task.recv() for task in self.tasks]
+        results = []
+        for task, data_ in zip(self.tasks, data):
+            task.send(op, data_)
+            results.append(task.recv())
+        return results
 
     def step(self, actions):
-        results = [task.step(action) for task, action in zip(self.tasks, actions)]
-        results = map(lambda x: np.stack(x), zip(*results))
+        if self.single_process:
+            results = [task.step(action) for task, action in zip(self.tasks, actions)]
+        elif self.block is not None:
+            infos = self._broadcast(ProcessWrapper.STEP, self._split(actions))
+            return self.block.states, self.block.rewards, self.block.dones, self._merge(infos)
+        else:
+            results = self._broadcast(ProcessWrapper.STEP, self._split(actions))
+        results = map(lambda x: self._merge(x), zip(*results))
         return results
 
     def reset(self):
-        results = [task.reset() for task in self.tasks]
-        return np.stack(results)
+        if self.single_process:
+            results = [task.reset() for task in self.tasks]
+        else:
+            results = self._broadcast(ProcessWrapper.RESET, [None] * len(self.tasks))
+        if self.block is not None:
+            return self.block.states
+        return self._merge(results)
 
     def close(self):
         if self.single_process:
             return
         for task in self.tasks: task.close()
+        if self.block is not None:
+            for task in self.tasks: task.worker.join()
+            self.block.close()
+            self.block = None
 
     def reset_task(self, task_info):
-        results = [task.reset_task(task_info) for task in self.tasks]
-        return np.stack(results)
+        if self.single_process:
+            results = [task.reset_task(task_info) for task in self.tasks]
+        else:
+            results = self._broadcast(ProcessWrapper.RESET_TASK, [task_info] * len(self.tasks))
+        if self.block is not None:
+            return self.block.states
+        return self._merge(results)
+
+    def reset_tasks(self, task_infos):
+        # reset each environment to its own task (one task info per environment)
+        if self.single_process:
+            results = [task.reset_task(task_info) for task, task_info in zip(self.tasks, task_infos)]
+        elif self.envs_per_worker == 1:
+            results = self._broadcast(ProcessWrapper.RESET_TASK, task_infos)
+        else:
+            k = self.envs_per_worker
+            results = self._broadcast(ProcessWrapper.RESET_TASKS, [task_infos[i : i + k] \
+                for i in range(0, len(task_infos), k)])
+        if self.block is not None:
+            return self.block.states
+        return self._merge(results)
 
     def set_task(self, task_info):
-        for task in self.tasks:
-            task.set_task(task_info)
+        if self.single_process:
+            for task in self.tasks:
+                task.set_task(task_info)
+        else:
+            self._broadcast(ProcessWrapper.SET_TASK, [task_info] * len(self.tasks))
 
     def get_task(self, all_workers=False):
+        # all_workers: the task of each environment (num_workers entries)
         if not all_workers:
             return self.tasks[0].get_task()
-        else:
+        elif self.single_process or self.envs_per_worker == 1:
             return [task.get_task() for task in self.tasks]
+        else:
+            results = self._broadcast(ProcessWrapper.GET_TASKS, [None] * len(self.tasks))
+            return [task_info for tasks in results for task_info in tasks]
 
     def get_all_tasks(self, requires_task_label):
         return self.tasks[0].get_all_tasks(requires_task_label)
     
     def random_tasks(self, num_tasks, requires_task_label):
         return self.tasks[0].random_tasks(num_tasks, requires_task_label)
+
+class AsyncParallelizedTask(ParallelizedTask):
+    '''
+    ready-first environment pool. steps are sent to a subset of the environments with
+    send(actions, env_ids) and recv() returns the transitions of whichever workers finish
+    first (at least `batch_size` environments, or all environments in flight if fewer),
+    together with their environment ids, so a slow worker (e.g., minigrid grid
+    regeneration on reset) does not stall the others. env ids index the rows of the full
+    batch (0 .. num_workers-1); the environments of a worker (envs_per_worker > 1) are
+    always sent and received together.
+
+    the synchronous ParallelizedTask interface (step, reset, reset_task, ...) is still
+    available while no step is in flight. the time from sending a step to a worker until
+    its result is ready is recorded per worker (see log_env_latencies).
+    '''
+    def __init__(self, task_fn, num_workers, batch_size=None, log_dir=None, shared_memory=False,
+        envs_per_worker=1):
+        self.send_time = {} # worker idx -> time at which its in-flight step was sent
+        ParallelizedTask.__init__(self, task_fn, num_workers, log_dir=log_dir, \
+            shared_memory=shared_memory, envs_per_worker=envs_per_worker)
+        batch_size = num_workers if batch_size is None else batch_size
+        if batch_size <= 0 or batch_size > num_workers or batch_size % envs_per_worker != 0:
+            raise ValueError('`batch_size` ({0}) should be a multiple of `envs_per_worker` ({1}) ' \
+                'and at most `num_workers` ({2})'.format(batch_size, envs_per_worker, num_workers))
+        self.batch_size = batch_size
+        self.latencies = [[] for _ in self.tasks]
+
+    def _broadcast(self, op, data):
+        assert len(self.send_time) == 0, 'synchronous command issued while steps are in flight'
+        return ParallelizedTask._broadcast(self, op, data)
+
+    def send(self, actions, env_ids):
+        env_ids = np.asarray(env_ids).reshape(-1)
+        order = np.argsort(env_ids)
+        env_ids = env_ids[order]
+        actions = np.asarray(actions)[order]
+        k = self.envs_per_worker
+        workers = env_ids[::k] // k
+        assert len(env_ids) % k == 0 and \
+            (env_ids.reshape(-1, k) == workers[:, None] * k + np.arange(k)).all(), \
+            'all environments of a worker should be sent together'
+        for i, idx in enumerate(workers):
+            assert idx not in self.send_time, 'worker {0} already has a step in flight'.format(idx)
+            action = actions[i] if k == 1 else actions[i * k : (i + 1) * k]
+            self.tasks[idx].send(ProcessWrapper.STEP, action)
+            self.send_time[idx] = time.perf_counter()
+
+    def recv(self):
+        assert len(self.send_time) > 0, 'no step in flight'
+        k = self.envs_per_worker
+        pipes = {self.tasks[idx].pipe: idx for idx in self.send_time.keys()}
+        num_ready = min(self.batch_size // k, len(pipes))
+        ready = []
+        while len(ready) < num_ready:
+            ready_pipes = mp_connection.wait(list(pipes.keys()))
+            now = time.perf_counter()
+            for pipe in ready_pipes:
+                idx = pipes.pop(pipe)
+                self.latencies[idx].append(now - self.send_time[idx])
+                ready.append(idx)
+        ready.sort()
+        results = []
+        for idx in ready:
+            results.append(self.tasks[idx].recv())
+            del self.send_time[idx]
+        env_ids = np.concatenate([np.arange(idx * k, (idx + 1) * k) for idx in ready])
+        if self.block is not None:
+            return self.block.states[env_ids], self.block.rewards[env_ids], \
+                self.block.dones[env_ids], self._merge(results), env_ids
+        states, rewards, dones, infos = map(lambda x: self._merge(x), zip(*results))
+        return states, rewards, dones, infos, env_ids
+
+    def log_env_latencies(self, logger, prefix=''):
+        # histograms (tensorboard) of the per worker step latencies recorded since the last
+        # call, in seconds
+        for idx, latencies in enumerate(self.latencies):
+            if len(latencies) == 0: continue
+            logger.histo_summary(prefix + 'env_latency/worker_{0}'.format(idx), \
+                np.array(latencies))
+        self.reset_latencies()
+
+    def reset_latencies(self):
+        self.latencies = [[] for _ in self.tasks]
@@ -0,0 +1,504 @@
+#######################################################################
+# Copyright (C) 2017 Shangtong Zhang(zhangshangtong.cpp@gmail.com)    #
+# Permission given to modify the code as long as you keep this        #
+# declaration at the top                                              #
+#######################################################################
+
+'''
+vectorized environment engines. each engine steps a whole batch of environments with
+numpy array operations in a single process, and exposes the same interface as
+ParallelizedTask (step/reset/reset_task/set_task/get_task/...), so it can be used as a
+drop-in replacement for config.task_fn, e.g.:
+config.task_fn = lambda: MiniGridVecFlatObs(name, env_config_path, config.num_workers,
+    seed=config.seed)
+'''
+
+import copy
+import json
+import numpy as np
+import gym
+
+class MiniGridVec:
+    '''
+    vectorized re-implementation of the static minigrid crossing environments
+    (MiniGrid-SimpleCrossing*, MiniGrid-LavaCrossing*). the layout of each task is generated
+    once by gym_minigrid (using the same fixed seed as the ReseedWrapper in MiniGrid), after
+    which movement, termination, rewards and the agent's partial (egocentric 7x7) view are
+    computed for all `num_envs` environments at once. observations, rewards and dones
+    match MiniGrid task step for step. environments are automatically reset when done.
+
+    only grids made of empty, wall, goal and lava cells are supported (no doors, keys
+    or other objects), as well as the navigation actions (left, right, forward). the other
+    minigrid actions are no-ops in such grids. exploration bonus wrappers and episode
+    monitors are not supported.
+    '''
+    # gym_minigrid object/color encodings
+    EMPTY = (1, 0, 0)
+    WALL = (2, 5, 0)
+    GOAL = 8
+    LAVA = 9
+    WALL_IDX = 2
+    SUPPORTED_OBJECTS = (1, 2, 8, 9)
+    DIR_TO_VEC = np.array([[1, 0], [0, 1], [-1, 0], [0, -1]])
+    VIEW_SIZE = 7
+
+    def __init__(self, name, env_config_path, num_envs, log_dir=None, seed=1000, eval_mode=False):
+        self.name = name
+        self.num_envs = num_envs
+        with open(env_config_path, 'r') as f:
+            env_config = json.load(f)
+        self.env_config = env_config
+        env_names = env_config['tasks']
+        if not eval_mode and len(env_config.get('wrappers', [])) > 0:
+            raise ValueError('exploration bonus wrappers are not supported by MiniGridVec')
+        self._build_layouts(env_names, seed)
+        self._build_view_offsets()
+        # fixed layouts and no exploration bonus: episodes only depend on the actions
+        self.deterministic = True
+        self.state_dim = (self.VIEW_SIZE, self.VIEW_SIZE, 3)
+        self.action_dim = env_config['action_dim'] if 'action_dim' in env_config.keys() else 3
+        # task label config
+        self.task_label_dim = env_config['label_dim']
+        self.one_hot_labels = True if env_config['one_hot'] else False
+        # all tasks
+        self.tasks = [{'name': name, 'task': name, 'task_label': None} for name in env_names]
+        # generate label for each task
+        if self.one_hot_labels:
+            for idx in range(len(self.tasks)):
+                label = np.zeros((self.task_label_dim,)).astype(np.float32)
+                label[idx] = 1.
+                self.tasks[idx]['task_label'] = label
+        else:
+            labels = np.random.uniform(low=-1.,high=1.,size=(len(self.tasks), self.task_label_dim))
+            labels = labels.astype(np.float32)
+            for idx in range(len(self.tasks)):
+                self.tasks[idx]['task_label'] = labels[idx]
+        self._task_idx = {name: idx for idx, name in enumerate(env_names)}
+        # per environment state
+        self.env_task = np.zeros(num_envs, dtype=np.int64)
+        self.agent_pos = np.zeros((num_envs, 2), dtype=np.int64)
+        self.agent_dir = np.zeros(num_envs, dtype=np.int64)
+        self.step_count = np.zeros(num_envs, dtype=np.int64)
+        # set default task
+        self.current_task = self.tasks[0]
+
+    def _build_layouts(self, env_names, seed):
+        import gym_minigrid
+        from gym_minigrid.wrappers import ImgObsWrapper, ReseedWrapper
+        pad = self.VIEW_SIZE - 1
+        grids = []
+        start_pos = []
+        start_dir = []
+        max_steps = []
+        for env_name in env_names:
+            env = ReseedWrapper(ImgObsWrapper(gym.make(env_name)), seeds=[seed,])
+            env.reset()
+            env = env.unwrapped
+            grid = env.grid.encode()
+            objects = np.unique(grid[..., 0])
+            if not np.isin(objects, self.SUPPORTED_OBJECTS).all():
+                raise ValueError('{0} contains objects not supported by MiniGridVec, only '\
+                    'empty/wall/goal/lava grids (crossing environments) are supported'.format(\
+                    env_name))
+            grids.append(grid)
+            start_pos.append(env.agent_pos)
+            start_dir.append(env.agent_dir)
+            max_steps.append(env.max_steps)
+            env.close()
+        width = max(grid.shape[0] for grid in grids)
+        height = max(grid.shape[1] for grid in grids)
+        # pad each layout with walls so that views extending beyond the grid read as walls,
+        # like Grid.slice in gym_minigrid.
+        self.grids = np.zeros((len(grids), width + 2 * pad, height + 2 * pad, 3), dtype=np.uint8)
+        self.grids[:] = self.WALL
+        for idx, grid in enumerate(grids):
+            self.grids[idx, pad : pad + grid.shape[0], pad : pad + grid.shape[1]] = grid
+        self.start_pos = np.array(start_pos, dtype=np.int64) + pad
+        self.start_dir = np.array(start_dir, dtype=np.int64)
+        self.max_steps = np.array(max_steps, dtype=np.int64)
+
+    def _build_view_offsets(self):
+        # offsets (relative to the agent position) of the world cell seen at each view cell,
+        # per agent direction. mirrors MiniGridEnv.get_view_exts followed by rotate_left
+        # applied agent_dir + 1 times.
+        size = self.VIEW_SIZE
+        half = size // 2
+        tops = [(0, -half), (-half, 0), (-size + 1, -half), (-half, -size + 1)]
+        self.view_offsets = np.zeros((4, size, size, 2), dtype=np.int64)
+        for direction, (top_x, top_y) in enumerate(tops):
+            xs, ys = np.meshgrid(np.arange(size) + top_x, np.arange(size) + top_y, indexing='ij')
+            offsets = np.stack([xs, ys], axis=-1)
+            self.view_offsets[direction] = np.rot90(offsets, k=-(direction + 1), axes=(0, 1))
+
+    def _gen_obs(self):
+        size = self.VIEW_SIZE
+        num_envs = self.num_envs
+        offsets = self.view_offsets[self.agent_dir]
+        xs = self.agent_pos[:, 0, None, None] + offsets[..., 0]
+        ys = self.agent_pos[:, 1, None, None] + offsets[..., 1]
+        view = self.grids[self.env_task[:, None, None], xs, ys]
+        # visibility propagation from the agent's position (see Grid.process_vis)
+        transparent = view[..., 0] != self.WALL_IDX
+        mask = np.zeros((num_envs, size, size), dtype=bool)
+        mask[:, size // 2, size - 1] = True
+        for j in reversed(range(size)):
+            for i in range(size - 1):
+                m = mask[:, i, j] & transparent[:, i, j]
+                mask[:, i + 1, j] |= m
+                if j > 0:
+                    mask[:, i + 1, j - 1] |= m
+                    mask[:, i, j - 1] |= m
+            for i in reversed(range(1, size)):
+                m = mask[:, i, j] & transparent[:, i, j]
+                mask[:, i - 1, j] |= m
+                if j > 0:
+                    mask[:, i - 1, j - 1] |= m
+                    mask[:, i, j - 1] |= m
+        view[~mask] = 0
+        # the agent is not carrying anything, so its own cell encodes as empty
+        view[:, size // 2, size - 1] = self.EMPTY
+        return view
+
+    def _reset_envs(self, envs):
+        tasks = self.env_task[envs]
+        self.agent_pos[envs] = self.start_pos[tasks]
+        self.agent_dir[envs] = self.start_dir[tasks]
+        self.step_count[envs] = 0
+
+    def step(self, actions):
+        actions = np.asarray(actions).reshape(-1)
+        self.step_count += 1
+        # forward cell is computed from the direction before turning
+        fwd_pos = self.agent_pos + self.DIR_TO_VEC[self.agent_dir]
+        self.agent_dir = np.where(actions == 0, (self.agent_dir - 1) % 4, self.agent_dir)
+        self.agent_dir = np.where(actions == 1, (self.agent_dir + 1) % 4, self.agent_dir)
+        fwd_cell = self.grids[self.env_task, fwd_pos[:, 0], fwd_pos[:, 1], 0]
+        moved = (actions == 2) & (fwd_cell != self.WALL_IDX)
+        self.agent_pos = np.where(moved[:, None], fwd_pos, self.agent_pos)
+        at_goal = moved & (fwd_cell == self.GOAL)
+        at_lava = moved & (fwd_cell == self.LAVA)
+        max_steps = self.max_steps[self.env_task]
+        rewards = np.where(at_goal, 1. - 0.9 * (self.step_count / max_steps), 0.)
+        dones = at_goal | at_lava | (self.step_count >= max_steps)
+        if dones.any():
+            self._reset_envs(dones)
+        infos = np.array([{} for _ in range(self.num_envs)])
+        return self._gen_obs(), rewards, dones, infos
+
+    def reset(self):
+        self._reset_envs(slice(None))
+        return self._gen_obs()
+
+    def seed(self, random_seed):
+        # layouts are fixed by the seed given at construction (as with ReseedWrapper)
+        pass
+
+    def close(self):
+        pass
+
+    def reset_task(self, task_info):
+        self.set_task(task_info)
+        return self.reset()
+
+    def set_task(self, task_info):
+        self.current_task = task_info
+        self.env_task[:] = self._task_idx[task_info['task']]
+
+    def reset_tasks(self, task_infos):
+        # reset each environment to its own task (one task info per environment)
+        self.env_task[:] = [self._task_idx[task_info['task']] for task_info in task_infos]
+        self.current_task = task_infos[0]
+        return self.reset()
+
+    def get_task(self, all_workers=False):
+        if not all_workers:
+            return self.current_task
+        else:
+            return [self.current_task] * self.num_envs
+
+    def get_all_tasks(self, requires_task_label=True):
+        return self.tasks
+
+    def random_tasks(self, num_tasks, requires_task_label=True):
+        raise NotImplementedError
+
+class MiniGridVecFlatObs(MiniGridVec):
+    def __init__(self, name, env_config_path, num_envs, log_dir=None, seed=1000, eval_mode=False):
+        super(MiniGridVecFlatObs, self).__init__(name, env_config_path, num_envs, log_dir, seed, \
+            eval_mode)
+        self.state_dim = int(np.prod(self.state_dim))
+
+    def step(self, actions):
+        states, rewards, dones, infos = super(MiniGridVecFlatObs, self).step(actions)
+        return states.reshape(self.num_envs, -1), rewards, dones, infos
+
+    def reset(self):
+        return super(MiniGridVecFlatObs, self).reset().reshape(self.num_envs, -1)
+
+class CTgraphVec:
+    '''
+    vectorized re-implementation of the CT-graph environment. a batch of `num_envs` graph
+    walkers is stepped with array indexing: each walker keeps its state type (0: home,
+    1: wait, 2: decision, 3: graph end, 4: crash), the number of decisions taken, the path
+    recorded so far and the high reward path (task) it is evaluated against. the image
+    dataset is generated once (by gym_CTgraph, from the same ctgraph.json config as CTgraph)
+    and observations are looked up from a preloaded image bank. environments are
+    automatically reset when done.
+
+    differences from the gym_CTgraph implementation: small rotations on read are drawn
+    from a bank of images pre-rotated at each integer angle of the same signed range,
+    [-small_rotation_on_read, small_rotation_on_read], and image noise is added after the
+    rotation. the high reward path is only changed through set_task/reset_task.
+    '''
+    def __init__(self, name, env_config_path, num_envs, log_dir=None):
+        self.name = name
+        self.num_envs = num_envs
+        from gym_CTgraph.CTgraph_images import CTgraph_images
+        with open(env_config_path, 'r') as f:
+            env_config = json.load(f)
+        self.env_config = env_config
+        self.depth = env_config['graph_shape']['depth']
+        self.branch = env_config['graph_shape']['branching_factor']
+        self.wait_prob = env_config['graph_shape']['wait_prob']
+        self.high_reward_value = env_config['reward']['high_reward_value']
+        self.crash_reward_value = env_config['reward']['crash_reward_value']
+        self.stochastic_sampling = env_config['reward']['stochastic_sampling']
+        self.reward_std = env_config['reward']['reward_std']
+        self.reward_distribution = env_config['reward']['reward_distribution']
+        if self.reward_distribution not in ('needle_in_haystack', 'linear'):
+            raise ValueError('reward distribution {0} not supported'.format(\
+                self.reward_distribution))
+        self.mdp_waits = env_config['observations']['MDP_wait_s']
+        self.mdp_decisions = env_config['observations']['MDP_decision_s']
+        # observation subsets (first and last image id) per state type. images 0 and 1 are
+        # reserved for the home and crash states.
+        self.obs_subsets = np.array([[0, 0], env_config['observations']['wait_states'], \
+            env_config['observations']['decision_states'], \
+            env_config['observations']['graph_ends'], [1, 1]], dtype=np.int64)
+        self.subset_sizes = self.obs_subsets[:, 1] - self.obs_subsets[:, 0] + 1
+        self.rnd = np.random.RandomState(env_config['general_seed'])
+
+        # preload image dataset
+        image_config = env_config['image_dataset']
+        self.oneD = image_config['1D']
+        self.noise = image_config['noise_on_images_on_read']
+        self.high_value = 254 - self.noise
+        self.img_rnd = np.random.RandomState(image_config['seed'])
+        images = CTgraph_images(env_config).image.astype(np.uint8)
+        if self.oneD:
+            self.rotation_angles = np.zeros(1, dtype=np.int64)
+            self.images = images[None, ...]
+        else:
+            from skimage import transform
+            max_angle = image_config['small_rotation_on_read']
+            self.rotation_angles = np.arange(-max_angle, max_angle + 1)
+            self.images = np.stack([np.stack([transform.rotate(img.astype(np.float64), \
+                angle).astype(np.uint8) for img in images]) for angle in self.rotation_angles])
+        self.image_shape = self.images.shape[2:]
+        self.action_dim = self.branch + 1
+        if self.oneD:
+            self.state_dim = int(np.prod(self.image_shape))
+        else:
+            self.state_dim = self.image_shape
+
+        # task label config
+        self.task_label_dim = self.branch**self.depth
+        self.one_hot_labels = True
+
+        # get all tasks in graph environment instance
+        from itertools import product
+        tasks = list(product(list(range(self.branch)), repeat=self.depth))
+        names = ['ctgraph_d{0}_b{1}_task_{2}'.format(self.depth, self.branch, idx+1) \
+            for idx in range(len(tasks))]
+        self.tasks = [{'name': name, 'task': np.array(task), 'task_label': None} \
+            for name, task in zip(names, tasks)]
+        # generate label for each task
+        if self.one_hot_labels:
+            for idx in range(len(self.tasks)):
+                label = np.zeros((self.task_label_dim,)).astype(np.float32)
+                label[idx] = 1.
+                self.tasks[idx]['task_label'] = label
+        else:
+            labels = np.random.uniform(low=-1.,high=1.,size=(len(self.tasks), self.task_label_dim))
+            labels = labels.astype(np.float32)
+            for idx in range(len(self.tasks)):
+                self.tasks[idx]['task_label'] = labels[idx]
+
+        # per environment (walker) state
+        self.state_type = np.zeros(num_envs, dtype=np.int64)
+        self.decision_counter = np.zeros(num_envs, dtype=np.int64)
+        # path code: branch**decision_counter + path number (base branch)
+        self.path_code = np.ones(num_envs, dtype=np.int64)
+        self.recorded_path = -np.ones((num_envs, self.depth), dtype=np.int64)
+        self.high_reward_path = np.zeros((num_envs, self.depth), dtype=np.int64)
+        # set default task
+        self.set_task(self.tasks[0])
+
+    def _image_ids(self):
+        state_type = self.state_type
+        code = np.where(self.decision_counter > 0, self.path_code, 0)
+        ids = np.maximum(code - 1, 0) % self.subset_sizes[state_type] + \
+            self.obs_subsets[state_type, 0]
+        # non-MDP state types draw a random image from their subset
+        random_types = []
+        if not (self.mdp_waits or self.mdp_decisions):
+            random_types = [1, 2, 3]
+        else:
+            if not self.mdp_waits: random_types.append(1)
+            if not self.mdp_decisions: random_types.append(2)
+        for t in random_types:
+            envs = state_type == t
+            if envs.any():
+                ids[envs] = self.rnd.randint(self.obs_subsets[t, 0], self.obs_subsets[t, 1] + 1, \
+                    size=envs.sum())
+        return ids
+
+    def _gen_obs(self, rewards):
+        num_envs = self.num_envs
+        rotations = self.img_rnd.randint(0, self.images.shape[0], size=num_envs)
+        obs = self.images[rotations, self._image_ids()]
+        if self.noise > 0:
+            noise = self.img_rnd.randint(0, self.noise + 1, size=obs.shape)
+            obs = (obs + noise).astype(np.uint8)
+        # reward cue at graph ends
+        ends = self.state_type == 3
+        if ends.any():
+            cue = np.clip(self.high_value * rewards[ends] / self.high_reward_value, 0, 254)
+            cue = cue.astype(np.uint8)
+            if self.oneD:
+                obs[ends, -1] = cue[:, None]
+            else:
+                h, w = self.image_shape[0] // 2, self.image_shape[1] // 2
+                obs[ends, h - 3 : h + 3, w - 3 : w + 3] = cue[:, None, None]
+        if self.oneD:
+            obs = obs.reshape(num_envs, -1)
+        return obs
+
+    def _reward(self, envs):
+        path = self.recorded_path[envs]
+        high_reward_path = self.high_reward_path[envs]
+        if self.reward_distribution == 'needle_in_haystack':
+            reward = self.high_reward_value * (path == high_reward_path).all(axis=1)
+        else:
+            weights = np.arange(self.depth, 0, -1)
+            score = weights * (1 - np.abs(high_reward_path - path))
+            reward = score.sum(axis=1) / weights.sum() * self.high_reward_value
+        if self.stochastic_sampling:
+            reward = reward + reward * self.rnd.normal(0, self.reward_std, size=reward.shape)
+        return reward
+
+    def _reset_envs(self, envs):
+        self.state_type[envs] = 0
+        self.decision_counter[envs] = 0
+        self.path_code[envs] = 1
+        self.recorded_path[envs] = -1
+
+    def step(self, actions):
+        actions = np.asarray(actions).reshape(-1)
+        state_type = self.state_type
+        rewards = np.zeros(self.num_envs)
+        home = state_type == 0
+        wait = state_type == 1
+        decision = state_type == 2
+        dones = state_type == 3 # any action at a graph end terminates the episode
+        crash = (wait & (actions != 0)) | (decision & (actions == 0))
+        advance = wait & (actions == 0)
+        if self.wait_prob > 0:
+            advance &= self.rnd.rand(self.num_envs) >= self.wait_prob
+        to_end = advance & (self.decision_counter == self.depth)
+        choose = decision & (actions > 0)
+        # record decisions
+        if choose.any():
+            envs = np.nonzero(choose)[0]
+            choice = actions[envs] - 1
+            self.recorded_path[envs, self.decision_counter[envs]] = choice
+            self.path_code[envs] = self.path_code[envs] * self.branch + choice
+            self.decision_counter[envs] += 1
+        new_state_type = state_type.copy()
+        new_state_type[home | choose] = 1
+        new_state_type[advance] = 2
+        new_state_type[to_end] = 3
+        new_state_type[crash] = 4
+        self.state_type = new_state_type
+        if to_end.any():
+            rewards[to_end] = self._reward(to_end)
+        rewards[crash] = self.crash_reward_value
+        dones = dones | crash
+        if dones.any():
+            self._reset_envs(dones)
+        infos = np.array([{} for _ in range(self.num_envs)])
+        return self._gen_obs(rewards), rewards, dones, infos
+
+    def reset(self):
+        self._reset_envs(slice(None))
+        return self._gen_obs(np.zeros(self.num_envs))
+
+    def seed(self, random_seed):
+        self.rnd.seed(random_seed)
+
+    def close(self):
+        pass
+
+    def reset_task(self, taskinfo):
+        self.set_task(taskinfo)
+        return self.reset()
+
+    def set_task(self, taskinfo):
+        task = np.asarray(taskinfo['task'])
+        assert len(task) == self.depth, 'length of the high reward path must equal graph depth'
+        self.high_reward_path[:] = task
+        self.current_task = taskinfo
+
+    def reset_tasks(self, task_infos):
+        # reset each walker to its own task (one task info per environment)
+        self.high_reward_path[:] = np.stack([task_info['task'] for task_info in task_infos])
+        self.current_task = task_infos[0]
+        return self.reset()
+
+    def get_task(self, all_workers=False):
+        if not all_workers:
+            return self.current_task
+        else:
+            return [self.current_task] * self.num_envs
+
+    def get_all_tasks(self, requires_task_label=False):
+        if requires_task_label:
+            # randomly sampled labels from uniform distribution
+            tasks_label=np.random.uniform(low=-1.,high=1.,size=(len(self.tasks),self.task_label_dim))
+            tasks_label = tasks_label.astype(np.float32)
+            tasks = copy.deepcopy(self.tasks)
+            for task, label in zip(tasks, tasks_label):
+                task['task_label'] = label
+            return tasks
+        else:
+            return self.tasks
+
+    def random_tasks(self, num_tasks, requires_task_label=True):
+        tasks_idx = np.random.randint(low=0, high=len(self.tasks), size=(num_tasks,))
+        if requires_task_label:
+            all_tasks = copy.deepcopy(self.tasks)
+            # randomly sampled labels from uniform distribution
+            tasks_label=np.random.uniform(low=-1.,high=1.,size=(len(all_tasks),self.task_label_dim))
+            tasks_label = tasks_label.astype(np.float32)
+            tasks = []
+            for idx in tasks_idx:
+                task = all_tasks[idx]
+                task['task_label'] = tasks_label[idx]
+                tasks.append(task)
+            return tasks
+        else:
+            tasks = [self.tasks[idx] for idx in tasks_idx]
+            return tasks
+
+class CTgraphVecFlatObs(CTgraphVec):
+    # CTgraphVec environment with flattend (1d vector) observations.
+    def __init__(self, name, env_config_path, num_envs, log_dir=None):
+        super(CTgraphVecFlatObs, self).__init__(name, env_config_path, num_envs, log_dir)
+        self.state_dim = int(np.prod(self.image_shape))
+
+    def step(self, actions):
+        states, rewards, dones, infos = super(CTgraphVecFlatObs, self).step(actions)
+        return states.reshape(self.num_envs, -1), rewards, dones, infos
+
+    def reset(self):
+        return super(CTgraphVecFlatObs, self).reset().reshape(self.num_envs, -1)
@@ -251,6 +251,22 @@ class CategoricalActorCriticNet(nn.Module, BaseNet):
         log_prob = dist.log_prob(action).unsqueeze(-1)
         return action, log_prob, dist.entropy().unsqueeze(-1), v
 
+@torch.inference_mode()
+def _categorical_act(network, obs, task_label):
+    # lean inference path of the categorical actor-critic nets taking a task label
+    # (CategoricalActorCriticNet_SS/_CL act): returns the sampled action, its log prob and
+    # the value (no entropy, no layer outputs, no autograd graph)
+    obs = tensor(obs)
+    if not isinstance(task_label, torch.Tensor):
+        task_label = tensor(task_label)
+    phi, _ = network.phi_body(obs, task_label, False, 'network.phi_body')
+    phi_a, _ = network.actor_body(phi, False, 'network.actor_body')
+    phi_v, _ = network.critic_body(phi, False, 'network.critic_body')
+    logits = network.fc_action(phi_a)
+    dist = torch.distributions.Categorical(logits=logits)
+    action = dist.sample()
+    return action, dist.log_prob(action).unsqueeze(-1), network.fc_critic(phi_v)
+
 # actor-critic net for continual learning where tasks are labelled using
 # supermask superposition algorithm
 class CategoricalActorCriticNet_SS(nn.Module, BaseNet):
@@ -287,6 +303,19 @@ class CategoricalActorCriticNet_SS(nn.Module, BaseNet):
         log_prob = dist.log_prob(action).unsqueeze(-1)
         return logits, action, log_prob, dist.entropy().unsqueeze(-1), v, layers_output
 
+    def act(self, obs, task_label=None):
+        # lean inference path for collecting rollouts (see _categorical_act)
+        return _categorical_act(self.network, obs, task_label)
+
+    def policy_logits(self, obs, task_label=None):
+        # action logits only (e.g., task inference), differentiable and without sampling
+        obs = tensor(obs)
+        if not isinstance(task_label, torch.Tensor):
+            task_label = tensor(task_label)
+        phi, _ = self.network.phi_body(obs, task_label, False, 'network.phi_body')
+        phi_a, _ = self.network.actor_body(phi, False, 'network.actor_body')
+        return self.network.fc_action(phi_a)
+
 # actor-critic net for continual learning where tasks are labelled
 class CategoricalActorCriticNet_CL(nn.Module, BaseNet):
     def __init__(self,
@@ -321,3 +350,7 @@ class CategoricalActorCriticNet_CL(nn.Module, BaseNet):
         log_prob = dist.log_prob(action).unsqueeze(-1)
         return logits, action, log_prob, dist.entropy().unsqueeze(-1), v, layers_output
 
+    def act(self, obs, task_label=None):
+        # lean inference path for collecting rollouts (see _categorical_act)
+        return _categorical_act(self.network, obs, task_label)
+
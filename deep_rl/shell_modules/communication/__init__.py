@@ -1 +1,2 @@
 from .comms import *
+from .directory import *
@@ -1,5 +1,40 @@
 # -*- coding: utf-8 -*-
+import multiprocessing as mp
+import queue
 
 class Communications:
-    def __init__(self):
+    '''
+    local (single node) message transport between the agents of a multi-process ShELL run
+    (see shell_train_dp): one inbox (multiprocessing queue) per agent. a message is a
+    (type, sender, payload) tuple, masks travel as flat numpy arrays (see ShellAgent_DP).
+    '''
+    PING = 0 # payload: (ping id, task label)
+    RESPONSE = 1 # payload: (ping id, flat mask or None)
+    DONE = 2 # sender finished training, payload: None
+
+    def __init__(self, agent_id, inboxes):
+        self.agent_id = agent_id
+        self.inboxes = inboxes
+        self.num_agents = len(inboxes)
         return
+
+    @staticmethod
+    def make_inboxes(num_agents, ctx=mp):
+        # ctx: multiprocessing context of the agent processes
+        return [ctx.Queue() for _ in range(num_agents)]
+
+    def send(self, receiver, msg_type, payload):
+        self.inboxes[receiver].put((msg_type, self.agent_id, payload))
+
+    def broadcast(self, msg_type, payload):
+        for receiver in range(self.num_agents):
+            if receiver != self.agent_id:
+                self.send(receiver, msg_type, payload)
+
+    def recv(self, block=False, timeout=None):
+        # next message of the agent's inbox, None if there is none (non blocking) or on
+        # timeout
+        try:
+            return self.inboxes[self.agent_id].get(block, timeout)
+        except queue.Empty:
+            return None
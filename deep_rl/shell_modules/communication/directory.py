@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+import threading
+import numpy as np
+
+class KnowledgeDirectory:
+    '''
+    task label -> ids of the agents holding a trained mask of the task. agents publish a
+    task when its training ends (task_train_end), and a requester pings the holders of its
+    new task only, instead of all the other agents (see shell_train, shell_train_dp).
+    labels are indexed by hash of the label rounded to `decimals`. on a hash miss (e.g.,
+    two labels on either side of a rounding boundary), the nearest indexed label within an
+    L2 distance of `eps` is used, the label matching of the agents (_label_to_idx). with
+    shared=True, the index is served by a local manager process to the agents running in
+    their own process.
+    '''
+    def __init__(self, shared=False, decimals=4, eps=1e-5, ctx=mp):
+        self.decimals = decimals
+        self.eps = eps
+        if shared:
+            self.manager = ctx.Manager()
+            self.index = self.manager.dict() # key -> (label, holders)
+            self.lock = self.manager.Lock()
+        else:
+            self.manager = None
+            self.index = {}
+            self.lock = threading.Lock()
+        return
+
+    def key(self, task_label):
+        task_label = np.asarray(task_label, dtype=np.float32).round(self.decimals) + 0.
+        return task_label.tobytes()
+
+    def _find(self, task_label):
+        # key of the indexed label matching task_label, None if there is none
+        key = self.key(task_label)
+        if key in self.index:
+            return key
+        task_label = np.asarray(task_label, dtype=np.float32)
+        found_key, found_dist = None, self.eps
+        for key, (label, _) in self.index.items():
+            dist = np.linalg.norm(task_label - label, ord=2)
+            if dist < found_dist:
+                found_key, found_dist = key, dist
+        return found_key
+
+    def publish(self, task_label, agent_id):
+        with self.lock:
+            key = self._find(task_label)
+            if key is None:
+                key = self.key(task_label)
+                label = np.asarray(task_label, dtype=np.float32)
+                holders = ()
+            else:
+                label, holders = self.index[key]
+            if agent_id not in holders:
+                # reassigned (not updated in place) for the manager's dict proxy
+                self.index[key] = (label, holders + (agent_id,))
+
+    def holders(self, task_label, exclude=None):
+        key = self._find(task_label)
+        if key is None:
+            return []
+        return [agent_id for agent_id in self.index[key][1] if agent_id != exclude]
+
+    def close(self):
+        if self.manager is not None:
+            self.manager.shutdown()
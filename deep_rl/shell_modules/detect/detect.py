@@ -1,11 +1,35 @@
 # -*- coding: utf-8 -*-
 
 class Detect:
-    def __init__(self):
+    '''
+    task change detection. with an agent able to infer the task of its experience (e.g.,
+    LLAgent_NoOracle.infer_task_label, one-shot supermask task inference), detect samples a
+    batch of states from the agent's data buffer and returns the label of the inferred task
+    (None for a task not seen before) and whether it differs from the task being trained.
+    a task not seen before is only reported after `patience` consecutive unknown verdicts
+    (a single uncertain batch, e.g., early in the training of a task, is not a change).
+    without an agent, nothing is detected.
+    '''
+    def __init__(self, agent=None, batch_size=256, patience=1):
+        self.agent = agent
+        self.batch_size = batch_size
+        self.patience = patience
+        self.num_unknown = 0 # consecutive unknown verdicts
         return
 
     def detect(self, data):
         bool_new_task = None
         task_label = None
+        if self.agent is None or data.empty():
+            return task_label, bool_new_task
+        states = data.sample(self.batch_size)[0]
+        task_label, is_curr_task = self.agent.infer_task_label(states)
+        if task_label is None:
+            self.num_unknown += 1
+            bool_new_task = self.num_unknown >= self.patience
+            if bool_new_task:
+                self.num_unknown = 0
+        else:
+            self.num_unknown = 0
+            bool_new_task = not is_curr_task
         return task_label, bool_new_task
-
@@ -1,7 +1,10 @@
 '''
 Source from: https://github.com/RAIVNLab/supsup/blob/master/mnist.ipynb
 '''
+import hashlib
 import math
+import weakref
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.autograd as autograd
@@ -32,7 +35,181 @@ def signed_constant(module):
     std = gain / math.sqrt(fan)
     module.weight.data = module.weight.data.sign() * std
 
-class MultitaskMaskLinear(nn.Linear):
+def cached_masked_weight(module, task=None):
+    # masked weight (weight * subnet) of `task` (default: the module's current task),
+    # cached per task. an
+    # entry is recomputed once the task's scores (or archived mask), the weight or the
+    # sparsity change: in place updates (e.g., optimizer steps, load_state_dict) bump the
+    # tensors' version counters (a score parameter's own, per task, also when it is a view
+    # of a MaskBank row), and set_mask/archive_task/restore_task drop the entry of the task
+    # they change. the cached weight carries no autograd graph, so it is only
+    # used when no gradient w.r.t. the scores is needed.
+    task = module.task if task is None else task
+    source = module.scores[task] if not module.is_archived(task) else \
+        module.get_buffer('packed_masks_{0}'.format(task))
+    key = (source._version, source.data_ptr(), module.weight._version, \
+        module.weight.data_ptr(), getattr(module, 'sparsity', None))
+    entry = module.masked_weights.get(task, None)
+    if entry is None or entry[0] != key:
+        # normal (not inference mode) tensor, reusable outside of torch.inference_mode
+        with torch.inference_mode(False), torch.no_grad():
+            entry = (key, module.weight * module.subnet(task))
+        module.masked_weights[task] = entry
+    return entry[1]
+
+# mask density (fraction of edges kept) up to which a CSR sparse-dense matmul beats the dense
+# F.linear on CPU, measured with `python run_benchmarks.py sparse_kernel` (200-512 units,
+# batch 16-128). smaller batches (e.g., acting with a few workers) stay dense.
+SPARSE_KERNEL_CROSSOVER = 0.1
+SPARSE_KERNEL_MIN_BATCH = 16
+
+def cached_sparse_weight(module):
+    # CSR copy of the module's cached masked weight (see cached_masked_weight), converted
+    # again whenever the dense entry is recomputed
+    w = cached_masked_weight(module)
+    task = module.task
+    key = module.masked_weights[task][0]
+    entry = module.sparse_weights.get(task, None)
+    if entry is None or entry[0] != key:
+        with torch.inference_mode(False), torch.no_grad():
+            entry = (key, w.to_sparse_csr())
+        module.sparse_weights[task] = entry
+    return entry[1]
+
+def sparse_linear(x, weight, bias=None):
+    # F.linear with a sparse (CSR) weight: (weight @ x^T)^T
+    if bias is None:
+        return torch.mm(weight, x.t()).t()
+    return torch.addmm(bias.unsqueeze(1), weight, x.t()).t()
+
+# layer size (weight elements) up to which mixed_task_linear gathers a masked weight per
+# row for a batched matmul; beyond it, grouping the rows by task is faster (CPU, 4-10 tasks)
+MIXED_TASK_BMM_MAX_NUMEL = 2048
+
+def task_masked_weight(module, task):
+    # masked weight of `task`, with gradient w.r.t. the task's scores if they are trained
+    if torch.is_grad_enabled() and module.scores[task].requires_grad:
+        return module.weight * module.subnet(task)
+    return cached_masked_weight(module, task)
+
+def mixed_task_linear(module, x, tasks):
+    # F.linear where row i of x uses the subnetwork of task tasks[i] (see set_model_task
+    # with a tensor of task indices)
+    assert tasks.shape == (x.shape[0], ), 'expected one task index per sample'
+    uniq, inverse, counts = torch.unique(tasks.to(x.device), return_inverse=True, \
+        return_counts=True)
+    weights = [task_masked_weight(module, task) for task in uniq.tolist()]
+    if len(weights) == 1:
+        return F.linear(x, weights[0], module.bias)
+    if module.weight.numel() <= MIXED_TASK_BMM_MAX_NUMEL:
+        y = torch.bmm(torch.stack(weights)[inverse], x.unsqueeze(2)).squeeze(2)
+        return y if module.bias is None else y + module.bias
+    # group the rows by task (keeping their order within a task)
+    _, order = torch.sort(inverse, stable=True)
+    y = torch.cat([F.linear(x_, w, module.bias) for x_, w in \
+        zip(x[order].split(counts.tolist()), weights)])
+    return y[torch.argsort(order)]
+
+def pack_mask(mask):
+    # binary mask -> flat uint8 tensor holding 8 mask entries per byte
+    bits = mask.detach().flatten().bool().to(torch.uint8)
+    bits = F.pad(bits, (0, (-bits.numel()) % 8)).view(-1, 8)
+    shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=bits.device)
+    return (bits << shifts).sum(dim=1, dtype=torch.uint8)
+
+def unpack_mask(packed, shape):
+    # inverse of pack_mask, returns a float mask of the given shape
+    shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=packed.device)
+    bits = (packed.unsqueeze(1) >> shifts) & 1
+    return bits.flatten()[: math.prod(shape)].view(shape).float()
+
+class MaskState:
+    '''
+    active task and number of tasks learned of the mask layers. each layer starts with its
+    own state, a MaskBank makes all the mask layers of a model share one, so that the whole
+    model switches task with a single assignment.
+    '''
+    def __init__(self, task=None, num_tasks_learned=None):
+        self.task = task
+        self.num_tasks_learned = num_tasks_learned
+
+class SharedMaskState:
+    '''
+    task/num_tasks_learned attributes of the mask layers, stored in self.mask_state
+    '''
+    @property
+    def task(self):
+        return self.mask_state.task
+
+    @task.setter
+    def task(self, task):
+        self.mask_state.task = task
+
+    @property
+    def num_tasks_learned(self):
+        return self.mask_state.num_tasks_learned
+
+    @num_tasks_learned.setter
+    def num_tasks_learned(self, num_tasks_learned):
+        self.mask_state.num_tasks_learned = num_tasks_learned
+
+class MaskArchive:
+    '''
+    archive of finished tasks for the multitask mask layers below: the binary mask of an
+    archived task is kept bit packed (packed_masks_<task> buffer) and unpacked on demand,
+    and its float32 scores are released, optionally keeping a reduced precision copy
+    (archived_scores_<task> buffer) used when sharing or retraining the task.
+    '''
+    @torch.no_grad()
+    def archive_task(self, task, scores_dtype=torch.float16):
+        if self.is_archived(task): return
+        scores = self.scores[task]
+        self.register_buffer('packed_masks_{0}'.format(task), pack_mask(self.subnet(task)))
+        if scores_dtype is not None:
+            self.register_buffer('archived_scores_{0}'.format(task), scores.to(scores_dtype))
+        scores.data = torch.empty(0, dtype=scores.dtype, device=scores.device)
+        scores.grad = None
+        scores.requires_grad = False
+        self.masked_weights.pop(task, None)
+
+    @torch.no_grad()
+    def restore_task(self, task):
+        # back to trainable float32 scores (e.g., when a finished task is trained again)
+        if not self.is_archived(task): return
+        scores = self.scores[task]
+        self._assign_scores(task, self.get_archived_scores(task))
+        scores.requires_grad = True
+        del self._buffers['packed_masks_{0}'.format(task)]
+        self._buffers.pop('archived_scores_{0}'.format(task), None)
+        self.masked_weights.pop(task, None)
+
+    def _assign_scores(self, task, scores):
+        # set the scores of `task`, in place in the task's mask bank row if the layer is
+        # part of a MaskBank (see score_views)
+        if self.score_views is None:
+            self.scores[task].data = scores
+        else:
+            # written through the parameter, which bumps its own version counter (the per
+            # task version the mask caches are keyed on), not through the bank row
+            self.scores[task].data = self.score_views[task]
+            self.scores[task].copy_(scores)
+
+    def is_archived(self, task):
+        return 'packed_masks_{0}'.format(task) in self._buffers
+
+    def get_archived_mask(self, task):
+        return unpack_mask(self._buffers['packed_masks_{0}'.format(task)], self.weight.shape)
+
+    def get_archived_scores(self, task):
+        # float32 scores of an archived task: the reduced precision copy if kept, else
+        # scores at the initialisation scale whose sign follows the mask (same subnet)
+        scores = self._buffers.get('archived_scores_{0}'.format(task), None)
+        if scores is not None:
+            return scores.float()
+        bound = 1. / math.sqrt(nn.init._calculate_correct_fan(self.weight, 'fan_in'))
+        return (self.get_archived_mask(task) * 2. - 1.) * bound
+
+class MultitaskMaskLinear(SharedMaskState, MaskArchive, nn.Linear):
     def __init__(self, *args, num_tasks=1, **kwargs):
         super().__init__(*args, **kwargs)
         self.num_tasks = num_tasks
@@ -46,21 +223,52 @@ class MultitaskMaskLinear(nn.Linear):
         # Keep weights untrained
         self.weight.requires_grad = False
         signed_constant(self)
+
+        # task -> masked weight (see cached_masked_weight)
+        self.masked_weights = {}
+        # active task and number of tasks learned (shared with the other layers by a MaskBank)
+        self.mask_state = MaskState()
+        # per task views of the layer's scores in the model's MaskBank, if any
+        self.score_views = None
     
+    def add_tasks(self, num_tasks):
+        # grow the task slots (scores) to `num_tasks`, returns the new score parameters.
+        # layers of a model with a MaskBank are grown through the bank (see add_tasks below)
+        new_scores = [nn.Parameter(mask_init(self).to(self.weight.device)) \
+            for _ in range(self.num_tasks, num_tasks)]
+        self.scores.extend(new_scores)
+        self.num_tasks = max(self.num_tasks, num_tasks)
+        return new_scores
+
+    def subnet(self, task):
+        # binary mask of `task`
+        if self.is_archived(task):
+            return self.get_archived_mask(task)
+        return GetSubnet.apply(self.scores[task])
+
     @torch.no_grad()
-    def cache_masks(self):
+    def cache_masks(self, task=None):
+        # binary masks stored as bool (promoted to float by the superimposed forward pass).
+        # given a task, only its slot of an existing cache is updated, in place
+        stacked = self._buffers.get('stacked', None)
+        if task is not None and stacked is not None and stacked.shape[0] == self.num_tasks:
+            stacked[task] = self.subnet(task).bool()
+            return
         self.register_buffer(
             "stacked",
             torch.stack(
                 [
-                    GetSubnet.apply(self.scores[j])
+                    self.subnet(j).bool()
                     for j in range(self.num_tasks)
                 ]
             ),
         )
 
     def forward(self, x):
-        if self.task < 0:
+        if torch.is_tensor(self.task):
+            # Mixed task forward pass (one task index per sample in self.task)
+            return mixed_task_linear(self, x, self.task)
+        elif self.task < 0:
             # Superimposed forward pass
             alpha_weights = self.alphas[: self.num_tasks_learned]
             idxs = (alpha_weights > 0).squeeze().view(self.num_tasks_learned)
@@ -70,9 +278,13 @@ class MultitaskMaskLinear(nn.Linear):
                 alpha_weights[idxs]
                 * self.stacked[: self.num_tasks_learned][idxs]
             ).sum(dim=0)
-        else:
+        elif torch.is_grad_enabled() and self.scores[self.task].requires_grad:
             # Subnet forward pass (given task info in self.task)
             subnet = GetSubnet.apply(self.scores[self.task])
+        else:
+            # Subnet forward pass, no gradient w.r.t. the scores (e.g., acting, evaluation)
+            w = cached_masked_weight(self)
+            return F.linear(x, w, self.bias)
         w = self.weight * subnet
         x = F.linear(x, w, self.bias)
         return x
@@ -87,39 +299,65 @@ class MultitaskMaskLinear(nn.Linear):
         # scores are the parameters that will be trained in other
         # agents. the binary masks would not be trained but rather
         # generated from raw scores in other agents
+        if self.is_archived(task):
+            return self.get_archived_scores(task)
         return self.scores[task] 
         #return GetSubnet.apply(self.scores[task])
 
     @torch.no_grad()
     def set_mask(self, mask, task):
-        self.scores[task].data = mask
+        self.restore_task(task)
+        self._assign_scores(task, mask)
+        self.masked_weights.pop(task, None)
         # NOTE, this operation might not be required and could be remove to save compute time
-        self.cache_masks() 
+        self.cache_masks(task)
         return
 
 # Subnetwork forward from hidden networks
 # Sparse mask (using edge-pop algorithm)
 class GetSubnetSparse(autograd.Function):
     @staticmethod
-    def forward(ctx, scores, k):
-        # Get the supermask by sorting the scores and using the top k%
-        out = scores.clone()
-        _, idx = scores.flatten().sort()
-        j = int((1 - k) * scores.numel())
-
-        # flat_out and out access the same memory.
-        flat_out = out.flatten()
-        flat_out[idx[:j]] = 0
-        flat_out[idx[j:]] = 1
-
-        return out
+    def forward(ctx, scores, k, threshold=None, out=None):
+        # Get the supermask by keeping the top k% scores, i.e., the scores above the j-th
+        # smallest one. the threshold is found by selection (kthvalue, linear time) rather
+        # than a full sort. optionally written into a preallocated `out` buffer.
+        if threshold is None:
+            threshold = sparse_threshold(scores, k)
+        if out is None:
+            out = torch.empty_like(scores)
+        else:
+            ctx.mark_dirty(out)
+        return torch.sub(scores, threshold, out=out).gt_(0)
 
     @staticmethod
     def backward(ctx, g):
         # send the gradient g straight-through on the backward pass.
-        return g, None
+        return g, None, None, None
+
+@torch.no_grad()
+def sparse_threshold(scores, k):
+    # j-th smallest score, with the j = (1 - k) * n lowest scores masked out. same masks
+    # as sorting the scores, up to ties at the threshold (measure zero for float scores).
+    j = int((1 - k) * scores.numel())
+    if j == 0:
+        return scores.new_tensor(float('-inf'))
+    if j == scores.numel():
+        return scores.new_tensor(float('inf'))
+    return scores.detach().flatten().kthvalue(j).values
 
-class MultitaskMaskLinearSparse(nn.Linear):
+def cached_sparse_threshold(module, task):
+    # top k% threshold of the task's scores, cached per task until the scores (e.g., an
+    # optimizer step) or the sparsity change. see cached_masked_weight.
+    scores = module.scores[task]
+    key = (scores._version, scores.data_ptr(), module.sparsity)
+    entry = module.thresholds.get(task, None)
+    if entry is None or entry[0] != key:
+        with torch.inference_mode(False):
+            entry = (key, sparse_threshold(scores, module.sparsity))
+        module.thresholds[task] = entry
+    return entry[1]
+
+class MultitaskMaskLinearSparse(SharedMaskState, MaskArchive, nn.Linear):
     def __init__(self, *args, num_tasks=1, sparsity=0.5, **kwargs):
         super().__init__(*args, **kwargs)
         self.num_tasks = num_tasks
@@ -136,21 +374,64 @@ class MultitaskMaskLinearSparse(nn.Linear):
 
         # sparsity for top k%, edge pop up algorithm
         self.sparsity = sparsity
+
+        # task -> masked weight (see cached_masked_weight)
+        self.masked_weights = {}
+        # active task and number of tasks learned (shared with the other layers by a MaskBank)
+        self.mask_state = MaskState()
+        # per task views of the layer's scores in the model's MaskBank, if any
+        self.score_views = None
+        # task -> top k% threshold (see cached_sparse_threshold)
+        self.thresholds = {}
+        # output buffer of the training forward pass, reused across steps
+        self.subnet_buffer = None
+
+        # sparse kernel execution mode (see set_sparse_kernel): forward passes without
+        # gradient run a CSR sparse-dense matmul while the density is at most the crossover
+        self.sparse_kernel = False
+        self.sparse_crossover = SPARSE_KERNEL_CROSSOVER
+        # task -> CSR masked weight (see cached_sparse_weight)
+        self.sparse_weights = {}
     
+    def add_tasks(self, num_tasks):
+        # grow the task slots (scores) to `num_tasks`, returns the new score parameters.
+        # layers of a model with a MaskBank are grown through the bank (see add_tasks below)
+        new_scores = [nn.Parameter(mask_init(self).to(self.weight.device)) \
+            for _ in range(self.num_tasks, num_tasks)]
+        self.scores.extend(new_scores)
+        self.num_tasks = max(self.num_tasks, num_tasks)
+        return new_scores
+
+    def subnet(self, task):
+        # binary mask of `task`
+        if self.is_archived(task):
+            return self.get_archived_mask(task)
+        return GetSubnetSparse.apply(self.scores[task], self.sparsity, \
+            cached_sparse_threshold(self, task))
+
     @torch.no_grad()
-    def cache_masks(self):
+    def cache_masks(self, task=None):
+        # binary masks stored as bool (promoted to float by the superimposed forward pass).
+        # given a task, only its slot of an existing cache is updated, in place
+        stacked = self._buffers.get('stacked', None)
+        if task is not None and stacked is not None and stacked.shape[0] == self.num_tasks:
+            stacked[task] = self.subnet(task).bool()
+            return
         self.register_buffer(
             "stacked",
             torch.stack(
                 [
-                    GetSubnetSparse.apply(self.scores[j], self.sparsity)
+                    self.subnet(j).bool()
                     for j in range(self.num_tasks)
                 ]
             ),
         )
 
     def forward(self, x):
-        if self.task < 0:
+        if torch.is_tensor(self.task):
+            # Mixed task forward pass (one task index per sample in self.task)
+            return mixed_task_linear(self, x, self.task)
+        elif self.task < 0:
             # Superimposed forward pass
             alpha_weights = self.alphas[: self.num_tasks_learned]
             idxs = (alpha_weights > 0).squeeze().view(self.num_tasks_learned)
@@ -160,9 +441,23 @@ class MultitaskMaskLinearSparse(nn.Linear):
                 alpha_weights[idxs]
                 * self.stacked[: self.num_tasks_learned][idxs]
             ).sum(dim=0)
-        else:
+        elif torch.is_grad_enabled() and self.scores[self.task].requires_grad:
             # Subnet forward pass (given task info in self.task)
-            subnet = GetSubnetSparse.apply(self.scores[self.task], self.sparsity)
+            scores = self.scores[self.task]
+            if self.subnet_buffer is None or self.subnet_buffer.shape != scores.shape or \
+                self.subnet_buffer.device != scores.device:
+                self.subnet_buffer = torch.empty_like(scores, requires_grad=False)
+            # written through a detached alias, so that the buffer itself never carries the
+            # autograd history of a step (which would chain the graphs of successive steps)
+            subnet = GetSubnetSparse.apply(scores, self.sparsity, \
+                cached_sparse_threshold(self, self.task), self.subnet_buffer.detach())
+        else:
+            # Subnet forward pass, no gradient w.r.t. the scores (e.g., acting, evaluation)
+            if self.sparse_kernel and self.sparsity <= self.sparse_crossover and \
+                x.dim() == 2 and x.shape[0] >= SPARSE_KERNEL_MIN_BATCH:
+                return sparse_linear(x, cached_sparse_weight(self), self.bias)
+            w = cached_masked_weight(self)
+            return F.linear(x, w, self.bias)
         w = self.weight * subnet
         x = F.linear(x, w, self.bias)
         return x
@@ -177,54 +472,303 @@ class MultitaskMaskLinearSparse(nn.Linear):
         # scores are the parameters that will be trained in other
         # agents. the binary masks would not be trained but rather
         # generated from raw scores in other agents
+        if self.is_archived(task):
+            return self.get_archived_scores(task)
         return self.scores[task] 
         #return GetSubnet.apply(self.scores[task])
 
     @torch.no_grad()
     def set_mask(self, mask, task):
-        self.scores[task].data = mask
+        self.restore_task(task)
+        self._assign_scores(task, mask)
+        self.masked_weights.pop(task, None)
+        self.sparse_weights.pop(task, None)
+        self.thresholds.pop(task, None)
         # NOTE, this operation might not be required and could be remove to save compute time
-        self.cache_masks() 
+        self.cache_masks(task)
         return
 
+class MaskBank:
+    '''
+    contiguous storage of the scores of all the mask layers of a model, built once per
+    network (after it is moved to its device): row t of `scores` holds the scores of task t
+    of every layer, flattened in module order, and the layers' score parameters are views
+    of it (see views). the layers share a single MaskState, so set_model_task switches the
+    whole model in O(1), and the scores of a task are exported/imported as one tensor
+    (get_mask/set_mask with flat=True). new task slots are added with add_tasks, which
+    reallocates the rows.
+
+    notes: archiving a task (archive_task) releases the layers' views but not the task's
+    row, so it frees no memory (agents refuse archive_masks with mask_bank). the layers' score parameters keep their own version counters, so an optimizer step
+    or set_mask only invalidates the masked weight caches of the tasks it updates. the
+    rows must therefore be written through the score parameters (optimizer, set_mask,
+    load_state_dict), not through `scores` or get_mask's flat tensor, which would leave
+    the caches stale.
+    '''
+    def __init__(self, model):
+        self.layers = [(n, m) for n, m in model.named_modules() \
+            if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse)]
+        if len(self.layers) == 0:
+            raise ValueError('model has no mask layers')
+        num_tasks = set(m.num_tasks for _, m in self.layers)
+        if len(num_tasks) != 1:
+            raise ValueError('mask layers with different number of tasks: {0}'.format(num_tasks))
+        self.shapes = [tuple(m.weight.shape) for _, m in self.layers]
+        self.offsets = np.cumsum([0] + [math.prod(shape) for shape in self.shapes])
+        first = self.layers[0][1].mask_state
+        self.state = MaskState(first.task, first.num_tasks_learned)
+        for n, m in self.layers:
+            m.mask_state = self.state
+        self._bind(num_tasks.pop())
+        model.mask_bank = self
+
+    @torch.no_grad()
+    def _bind(self, num_tasks):
+        # (re)allocate the rows of `num_tasks` tasks and make the layers' scores views of them
+        weight = self.layers[0][1].weight
+        self.num_tasks = num_tasks
+        self.scores = torch.zeros(num_tasks, int(self.offsets[-1]), dtype=weight.dtype, \
+            device=weight.device)
+        for (n, m), start, end, shape in zip(self.layers, self.offsets[:-1], \
+            self.offsets[1:], self.shapes):
+            m.score_views = [self.scores[t, start : end].view(shape) for t in range(num_tasks)]
+            for t in range(num_tasks):
+                if not m.is_archived(t):
+                    m._assign_scores(t, m.scores[t].data)
+
+    def add_tasks(self, num_tasks):
+        # grow the layers' task slots and the bank to `num_tasks` rows (existing rows are
+        # copied over), returns the new score parameters
+        if num_tasks <= self.num_tasks:
+            return []
+        new_scores = []
+        for n, m in self.layers:
+            new_scores += m.add_tasks(num_tasks)
+        self._bind(num_tasks)
+        return new_scores
+
+    def views(self, task):
+        # layer name -> scores of `task` (views of the task's row)
+        return {n: m.score_views[task] for n, m in self.layers}
+
+    def set_task(self, task):
+        self.state.task = task
+
+    def set_num_tasks_learned(self, num_tasks_learned):
+        self.state.num_tasks_learned = num_tasks_learned
+
+    @torch.no_grad()
+    def get_mask(self, task):
+        # scores of `task` of all layers as a single flat tensor
+        if any(m.is_archived(task) for _, m in self.layers):
+            return torch.cat([m.get_mask(task).flatten() for _, m in self.layers])
+        return self.scores[task]
+
+    @torch.no_grad()
+    def set_mask(self, mask, task):
+        # install a flat mask (see get_mask) of `task`
+        if mask.numel() != self.scores.shape[1]:
+            raise ValueError('flat mask of size {0}, expected {1}'.format(mask.numel(), \
+                self.scores.shape[1]))
+        for (n, m), start, end, shape in zip(self.layers, self.offsets[:-1], \
+            self.offsets[1:], self.shapes):
+            m.set_mask(mask[start : end].view(shape), task)
+
+def _mask_layers(model):
+    # (name, module) of the mask layers of the model
+    bank = getattr(model, 'mask_bank', None)
+    if bank is not None:
+        return bank.layers
+    return [(n, m) for n, m in model.named_modules() \
+        if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse)]
+
 # Utility functions
+# (O(1) or a loop over the bank's layers, without logging, for models with a MaskBank)
+def add_tasks(model, num_tasks):
+    # grow the task slots of all the mask layers to `num_tasks` (no-op for existing slots),
+    # returns the new score parameters, to be added to the optimizer (add_param_group)
+    bank = getattr(model, 'mask_bank', None)
+    if bank is not None:
+        return bank.add_tasks(num_tasks)
+    new_scores = []
+    for n, m in _mask_layers(model):
+        new_scores += m.add_tasks(num_tasks)
+    return new_scores
+
 def set_model_task(model, task, verbose=True):
-    for n, m in model.named_modules():
-        if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse):
-            if verbose:
-                print(f"=> Set task of {n} to {task}")
-            m.task = task
+    # task: task index, or a tensor with the task index of each sample of the next forward
+    # passes (mixed task batch, see mixed_task_linear)
+    bank = getattr(model, 'mask_bank', None)
+    if bank is not None:
+        bank.set_task(task)
+        return
+    for n, m in _mask_layers(model):
+        if verbose:
+            print(f"=> Set task of {n} to {task}")
+        m.task = task
 
-def cache_masks(model):
-    for n, m in model.named_modules():
-        if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse):
+def cache_masks(model, task=None, verbose=True):
+    # task: only update the cached mask of that task (e.g., the one whose training ended)
+    verbose = verbose and getattr(model, 'mask_bank', None) is None
+    for n, m in _mask_layers(model):
+        if verbose:
             print(f"=> Caching mask state for {n}")
-            m.cache_masks()
+        m.cache_masks(task)
 
 def set_num_tasks_learned(model, num_tasks_learned):
-    for n, m in model.named_modules():
-        if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse):
-            print(f"=> Setting learned tasks of {n} to {num_tasks_learned}")
-            m.num_tasks_learned = num_tasks_learned
+    bank = getattr(model, 'mask_bank', None)
+    if bank is not None:
+        bank.set_num_tasks_learned(num_tasks_learned)
+        return
+    for n, m in _mask_layers(model):
+        print(f"=> Setting learned tasks of {n} to {num_tasks_learned}")
+        m.num_tasks_learned = num_tasks_learned
 
 def set_alphas(model, alphas, verbose=True):
-    for n, m in model.named_modules():
-        if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse):
-            if verbose:
-                print(f"=> Setting alphas for {n}")
-            m.alphas = alphas
+    verbose = verbose and getattr(model, 'mask_bank', None) is None
+    for n, m in _mask_layers(model):
+        if verbose:
+            print(f"=> Setting alphas for {n}")
+        m.alphas = alphas
 
-def get_mask(model, task):
+def infer_task(model, logits_fn, num_tasks):
+    # one-shot task inference (https://arxiv.org/abs/2006.14769): the cached masks of tasks
+    # 0..num_tasks-1 are superimposed with uniform alphas (task < 0 forward pass) and the
+    # inferred task is the one whose alpha decreases the entropy of the output the most
+    # (most negative gradient). logits_fn() runs the forward pass of the model. returns the
+    # task index and the entropy gradient. the layers' task/alphas are restored.
+    layers = _mask_layers(model)
+    prev = [(m.task, m.num_tasks_learned, getattr(m, 'alphas', None)) for _, m in layers]
+    alphas = torch.full((num_tasks, 1, 1), 1. / num_tasks, device=layers[0][1].weight.device, \
+        requires_grad=True)
+    try:
+        for n, m in layers:
+            m.task, m.num_tasks_learned, m.alphas = -1, num_tasks, alphas
+        with torch.enable_grad():
+            log_probs = F.log_softmax(logits_fn(), dim=-1)
+            entropy = -(log_probs.exp() * log_probs).sum(dim=-1).mean()
+            grad = autograd.grad(entropy, alphas)[0].flatten()
+    finally:
+        for (n, m), (task, num_tasks_learned, alphas_) in zip(layers, prev):
+            m.task, m.num_tasks_learned, m.alphas = task, num_tasks_learned, alphas_
+    return int(grad.argmin()), grad
+
+def get_mask(model, task, flat=False):
+    # layer name -> scores of `task`, or a single flat tensor (flat=True)
+    if flat:
+        bank = getattr(model, 'mask_bank', None)
+        if bank is not None:
+            return bank.get_mask(task)
+        return torch.cat([m.get_mask(task).flatten() for _, m in _mask_layers(model)])
     mask = {}
-    for n, m in model.named_modules():
-        if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse):
-            mask[n] = m.get_mask(task)
+    for n, m in _mask_layers(model):
+        mask[n] = m.get_mask(task)
     return mask 
 
 def set_mask(model, mask, task):
+    # mask: layer name -> scores, or a single flat tensor (see get_mask)
+    if torch.is_tensor(mask):
+        bank = getattr(model, 'mask_bank', None)
+        if bank is not None:
+            bank.set_mask(mask, task)
+            return
+        start = 0
+        for n, m in _mask_layers(model):
+            end = start + m.weight.numel()
+            m.set_mask(mask[start : end].view(m.weight.shape), task)
+            start = end
+        return
+    for n, m in _mask_layers(model):
+        m.set_mask(mask[n], task)
+
+def archive_task(model, task, scores_dtype=torch.float16):
+    for n, m in _mask_layers(model):
+        m.archive_task(task, scores_dtype)
+
+def restore_task(model, task):
+    for n, m in _mask_layers(model):
+        m.restore_task(task)
+
+def set_sparse_kernel(model, enabled=True, crossover=SPARSE_KERNEL_CROSSOVER):
+    # sparse kernel execution mode of the (sparse) mask layers, used by forward passes
+    # without gradient (e.g., acting, evaluation) when the layer density is <= crossover
+    for n, m in model.named_modules():
+        if isinstance(m, MultitaskMaskLinearSparse):
+            m.sparse_kernel = enabled
+            m.sparse_crossover = crossover
+            m.sparse_weights = {}
+
+# (seed, layer name, shape, device, weight digest) -> weight of the backbones shared by the
+# models of this process. weakly referenced: a backbone is released along with its last
+# model.
+_shared_backbone = weakref.WeakValueDictionary()
+
+def share_backbone(model, seed):
+    # make the mask layers of the model use the frozen (signed constant) weights of a live
+    # model registered in this process with the same seed and the same layer weights, so
+    # that in-process agents built with the same seed hold a single copy of the backbone
+    # (only scores/biases stay per model). a model whose layer weights match no registered
+    # ones (e.g., another seed or state_dim) is registered with its own backbone.
+    for n, m in _mask_layers(model):
+        if m.weight.requires_grad:
+            raise ValueError('{0}: only frozen weights can be shared'.format(n))
+        digest = hashlib.sha1(m.weight.detach().cpu().numpy().tobytes()).hexdigest()
+        key = (seed, n, tuple(m.weight.shape), str(m.weight.device), digest)
+        weight = _shared_backbone.get(key, None)
+        if weight is None or not torch.equal(weight, m.weight):
+            _shared_backbone[key] = m.weight
+            continue
+        m.weight = weight
+        m.masked_weights = {}
+
+def reset_shared_backbone():
+    # forget the registered backbones (e.g., between experiments run in the same process),
+    # the models already sharing one keep it
+    _shared_backbone.clear()
+
+def mask_memory_report(model):
+    # bytes held by the mask layers of the model, per kind of storage
+    report = {'scores': 0, 'packed_masks': 0, 'archived_scores': 0, 'stacked': 0, \
+        'masked_weights': 0, 'sparse_weights': 0}
+    for n, m in model.named_modules():
+        if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse):
+            for scores in m.scores:
+                report['scores'] += scores.numel() * scores.element_size()
+            for k, t in m._buffers.items():
+                kind = k.rsplit('_', 1)[0] if k.endswith(tuple('0123456789')) else k
+                if kind in report and t is not None:
+                    report[kind] += t.numel() * t.element_size()
+            for _, w in m.masked_weights.values():
+                report['masked_weights'] += w.numel() * w.element_size()
+            for _, w in getattr(m, 'sparse_weights', {}).values():
+                report['sparse_weights'] += sum(t.numel() * t.element_size() for t in \
+                    (w.crow_indices(), w.col_indices(), w.values()))
+    report['total'] = sum(report.values())
+    return report
+
+@torch.no_grad()
+def get_subnet_hash(model, task):
+    # hash of everything the subnetwork of `task` depends on: the task's binary mask in
+    # every mask layer and all the parameters/buffers shared across tasks (e.g., weights,
+    # biases and non-mask layers). the scores and archived masks of all tasks, the stacked
+    # mask cache and the superposition alphas are left out.
+    task_specific = []
+    for n, m in model.named_modules():
+        if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse):
+            task_specific.append(n + '.')
+    h = hashlib.sha1()
+    for n, t in list(model.named_parameters()) + list(model.named_buffers()):
+        prefix = [p for p in task_specific if n.startswith(p)]
+        if len(prefix) > 0 and n[len(prefix[0]):].split('.')[0].startswith(('scores', \
+            'stacked', 'alphas', 'packed_masks_', 'archived_scores_')):
+            continue
+        h.update(n.encode())
+        h.update(t.detach().cpu().numpy().tobytes())
     for n, m in model.named_modules():
         if isinstance(m, MultitaskMaskLinear) or isinstance(m, MultitaskMaskLinearSparse):
-            m.set_mask(mask[n], task)
+            h.update(n.encode())
+            h.update(m.subnet(task).detach().bool().cpu().numpy().tobytes())
+    return h.hexdigest()
 
 # Multitask Model, a simple fully connected model in this case
 class MultitaskFC(nn.Module):
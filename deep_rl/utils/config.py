@@ -30,6 +30,13 @@ class Config:
         self.double_q = False
         self.tag = 'vanilla'
         self.num_workers = 1
+        # environments hosted by each worker process of a ParallelizedTask.
+        # num_workers is the total number of environments.
+        self.num_envs_per_worker = 1
+        # workers of a ParallelizedTask write observations, rewards and dones into a shared
+        # memory block instead of sending them through the pipes (zero-copy step results,
+        # overwritten by the next step)
+        self.shared_memory_obs = False
         self.update_interval = 1
         self.gradient_clip = 0.5
         self.entropy_weight = 0.01
@@ -75,6 +82,49 @@ class Config:
         self.env_name = None
         self.env_config_path = None
         self.eval_task_fn = None
+        # batched evaluation: run all evaluation episodes of all tasks at once in a
+        # vectorized environment set built by eval_vec_task_fn(num_envs). the default is a
+        # ParallelizedTask of eval_task_fn instances (at most num_workers worker processes)
+        self.eval_batched = False
+        self.eval_vec_task_fn = None
+        # batched evaluation of supermask agents: a single forward pass for all the tasks,
+        # each sample using its task's mask (see mixed_task_linear)
+        self.eval_mixed_tasks = False
+        # reuse the evaluation results of a task while its subnetwork (mask scores) and the
+        # evaluation environment config and seed are unchanged (LLAgent and subclasses)
+        self.eval_cache = False
+        # greedy evaluation on a deterministic environment (see task.deterministic) runs one
+        # episode per task, checked against a second one, and replicates it. set to True to
+        # always run all evaluation episodes.
+        self.eval_full_runs = False
+        # supermask agents: archive the mask of a task when its training ends, bit packed,
+        # keeping its scores in archived_scores_dtype (None to drop them). not with mask_bank
+        self.archive_masks = False
+        self.archived_scores_dtype = torch.float16
+        # sparse supermask layers: run acting/evaluation forward passes as CSR sparse-dense
+        # matmuls while the layer density is at most sparse_kernel_crossover
+        self.sparse_kernel = False
+        self.sparse_kernel_crossover = 0.1
+        # supermask agents: keep the scores of all the mask layers in a contiguous MaskBank
+        # (O(1) task switching, single tensor mask export/import). not with archive_masks
+        self.mask_bank = False
+        # task inference without oracle (LLAgent_NoOracle.infer_task): a batch is from a
+        # task not seen before if the normalised policy entropy exceeds this threshold
+        self.detect_unknown_entropy = 0.9
+        # number of consecutive unknown verdicts before a new task is detected (see Detect)
+        self.detect_unknown_patience = 3
+        # supermask agents in the same process built with the same seed share one copy of
+        # the frozen mask layer weights (see share_backbone)
+        self.share_backbone = False
+        # ShELL agents in their own process (ShellAgent_DP): do not wait for the answers to a
+        # mask ping, install a mask when it arrives unless it is stale, i.e., the agent moved
+        # on to another task, or trained the task for more than mask_staleness_steps steps
+        # since the ping (None: no limit)
+        self.async_pings = False
+        self.mask_staleness_steps = None
+        # ShELL agents: publish the trained tasks in a shared KnowledgeDirectory and ping
+        # only the agents holding the new task, instead of all the other agents
+        self.knowledge_directory = False
         #self.reg_loss_coeff = 1e-3
 
         # extra config for continual learning (cl) experiments
@@ -45,6 +45,11 @@ class Logger(object):
         self.all_steps = {}
         self.log_dir = log_dir
 
+    def close(self):
+        # flush and stop the tensorboard writer (e.g., before a worker process exits)
+        if not self.skip:
+            self.writer.close()
+
     def to_numpy(self, v):
         if isinstance(v, torch.Tensor):
             v = v.cpu().detach().numpy()
@@ -365,6 +365,55 @@ def sync_grad(target_network, src_network):
 def mkdir(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
+def _float_array(x):
+    if isinstance(x, torch.Tensor): x = to_np(x)
+    return np.asarray(x, dtype=np.float32)
+
+def _scan_inputs(rewards, *xs):
+    # inputs of the reverse scans: torch tensors on the rewards' device if the rewards are
+    # a tensor (e.g., RolloutStorage entries, scanned without leaving the device), float32
+    # numpy arrays otherwise (e.g., the rollout lists of the A2C/n-step agents)
+    if isinstance(rewards, torch.Tensor):
+        return [rewards] + [torch.as_tensor(x, dtype=rewards.dtype, device=rewards.device) \
+            for x in xs]
+    return [_float_array(x) for x in (rewards, ) + xs]
+
+def discounted_returns(rewards, masks, pending_value, discount):
+    # n-step returns of a rollout: a reverse scan over time of its (rollout_length,
+    # num_workers, ...) rewards and masks (1 - terminals), bootstrapped from the
+    # (num_workers, ...) pending_value. returns a tensor on the rewards' device if the
+    # rewards are a tensor, a float32 numpy array otherwise.
+    rewards, masks, ret = _scan_inputs(rewards, masks, pending_value)
+    coeffs = discount * masks
+    if isinstance(rewards, torch.Tensor):
+        returns = rewards.new_empty(torch.broadcast_shapes(rewards.shape, coeffs.shape))
+    else:
+        returns = np.empty(np.broadcast(rewards, coeffs).shape, dtype=np.float32)
+    for t in reversed(range(len(rewards))):
+        ret = rewards[t] + coeffs[t] * ret
+        returns[t] = ret
+    return returns
+
+def returns_and_advantages(rewards, masks, values, discount, use_gae=False, gae_tau=1.0):
+    # returns and advantages of a rollout (see discounted_returns). values has one more
+    # time step than rewards and masks, the pending (bootstrap) value. the advantages are
+    # returns - values, or generalized advantage estimates when use_gae is set (td errors
+    # of all time steps at once, then a reverse scan of the gae recursion).
+    rewards, masks, values = _scan_inputs(rewards, masks, values)
+    returns = discounted_returns(rewards, masks, values[-1], discount)
+    if not use_gae:
+        return returns, returns - values[:-1]
+    td_errors = rewards + discount * masks * values[1:] - values[:-1]
+    coeffs = gae_tau * discount * masks
+    if isinstance(td_errors, torch.Tensor):
+        advantages, adv = torch.empty_like(td_errors), torch.zeros_like(td_errors[0])
+    else:
+        advantages, adv = np.empty_like(td_errors), np.zeros_like(td_errors[0])
+    for t in reversed(range(len(td_errors))):
+        adv = adv * coeffs[t] + td_errors[t]
+        advantages[t] = adv
+    return returns, advantages
+
 class Batcher:
     def __init__(self, batch_size, data):
         self.batch_size = batch_size
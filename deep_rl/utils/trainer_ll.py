@@ -4,6 +4,7 @@ import os
 import datetime
 import torch
 from .torch_utils import *
+from ..shell_modules import *
 
 # run iterations, lifelong learning
 # used by either a baseline agent (with no task knowledge preservation) or
@@ -63,6 +64,9 @@ def run_iterations_w_oracle(agent, tasks_info):
                     config.logger.scalar_summary('max reward', np.max(agent.last_episode_rewards))
                     config.logger.scalar_summary('min reward', np.min(agent.last_episode_rewards))
                     config.logger.scalar_summary('avg grad norm', avg_grad_norm)
+                    # per worker step latency of a ready-first env pool (AsyncParallelizedTask)
+                    if hasattr(agent.task, 'log_env_latencies'):
+                        agent.task.log_env_latencies(config.logger)
 
                     with open(config.log_dir + '/%s-%s-online-stats-%s.bin' % \
                         (agent_name, config.tag, agent.task.name), 'wb') as f:
@@ -85,13 +89,19 @@ def run_iterations_w_oracle(agent, tasks_info):
                     _names = [eval_task_info['task'] for eval_task_info in _tasks]
                     config.logger.info('eval tasks: {0}'.format(', '.join(_names)))
                     eval_data.append(np.zeros(len(_tasks),))
-                    for eval_task_idx, eval_task_info in enumerate(_tasks):
-                        agent.task_eval_start(eval_task_info['task_label'])
-                        eval_states = agent.evaluation_env.reset_task(eval_task_info)
-                        agent.evaluation_states = eval_states
-                        rewards, _ = agent.evaluate_cl(num_iterations=config.evaluation_episodes)
-                        agent.task_eval_end()
-                        eval_data[-1][eval_task_idx] = np.mean(rewards)
+                    if config.eval_batched:
+                        results = agent.evaluate_cl_batched(_tasks, \
+                            num_iterations=config.evaluation_episodes)
+                        for eval_task_idx, (rewards, _) in enumerate(results):
+                            eval_data[-1][eval_task_idx] = np.mean(rewards)
+                    else:
+                        for eval_task_idx, eval_task_info in enumerate(_tasks):
+                            agent.task_eval_start(eval_task_info['task_label'])
+                            eval_states = agent.evaluation_env.reset_task(eval_task_info)
+                            agent.evaluation_states = eval_states
+                            rewards, _ = agent.evaluate_cl(num_iterations=config.evaluation_episodes)
+                            agent.task_eval_end()
+                            eval_data[-1][eval_task_idx] = np.mean(rewards)
                     tcr = eval_data[-1].sum()
                     metric_tcr.append(tcr)
                     tp = np.sum(metric_tcr)
@@ -122,16 +132,23 @@ def run_iterations_w_oracle(agent, tasks_info):
             ret = agent.task_train_end()
             # evaluate agent across task exposed to agent so far
             config.logger.info('evaluating agent across all tasks exposed so far to agent')
+            if config.eval_batched:
+                results = agent.evaluate_cl_batched(tasks_info[ : task_idx+1], \
+                    num_iterations=config.evaluation_episodes)
             for j in range(task_idx+1):
-                _eval_task = tasks_info[j]
-                agent.task_eval_start(_eval_task['task_label'])
+                if config.eval_batched:
+                    rewards, episodes = results[j]
+                    eval_results[j] += rewards
+                else:
+                    _eval_task = tasks_info[j]
+                    agent.task_eval_start(_eval_task['task_label'])
 
-                eval_states = agent.evaluation_env.reset_task(tasks_info[j])
-                agent.evaluation_states = eval_states
-                rewards, episodes = agent.evaluate_cl(num_iterations=config.evaluation_episodes)
-                eval_results[j] += rewards
+                    eval_states = agent.evaluation_env.reset_task(tasks_info[j])
+                    agent.evaluation_states = eval_states
+                    rewards, episodes = agent.evaluate_cl(num_iterations=config.evaluation_episodes)
+                    eval_results[j] += rewards
 
-                agent.task_eval_end()
+                    agent.task_eval_end()
 
                 with open(config.log_dir+'/rewards-task{0}_{1}.bin'.format(\
                     task_idx+1, j+1), 'wb') as f:
@@ -158,6 +175,15 @@ def run_iterations_w_oracle(agent, tasks_info):
     agent.close()
     return steps, rewards
 
+# task change decision without oracle, from the detect module alone: returns the label of
+# the task of the agent's experience (an internal label for a task not seen before, see
+# new_task_label) and whether it differs from the task being trained
+def detect_task_change(agent, mod_detect):
+    task_label, task_change = mod_detect.detect(agent.data_buffer)
+    if task_change and task_label is None:
+        task_label = agent.new_task_label()
+    return task_label, task_change
+
 # run iterations, lifelong learning
 # used by an agent with knowledge preservation via supermask superposition (ss)
 # task oracle not available, therefore, a detect module is used to discover task boundaries
@@ -165,7 +191,7 @@ def run_iterations_w_oracle(agent, tasks_info):
 # modules off: n/a 
 def run_iterations_wo_oracle(agent, tasks_info):
     mod_rm = ResourceManager()
-    mod_detect = Detect()
+    mod_detect = Detect(agent, patience=agent.config.detect_unknown_patience)
 
     config = agent.config
 
@@ -188,7 +214,6 @@ def run_iterations_wo_oracle(agent, tasks_info):
     eval_data = []
     metric_tcr = [] # tcr => total cumulative reward
 
-    task_change = False
     for learn_block_idx in range(config.cl_num_learn_blocks):
         config.logger.info('********** start of learning block {0}'.format(learn_block_idx))
         eval_results = {task_idx:[] for task_idx in range(len(tasks_info))}
@@ -199,9 +224,9 @@ def run_iterations_wo_oracle(agent, tasks_info):
 
             states = agent.task.reset_task(task_info)
             agent.states = config.state_normalizer(states)
-            if task_idx == 0:
+            if len(agent.seen_tasks) == 0:
                 # boostrap learning w/o the detect module for only the first task.
-                agent.set_first_task(task_info['task_label'], task_info['name'])
+                agent.set_first_task(task_info['task_label'])
             while True:
                 # train step
                 bool_execute = mod_rm.operation(ResourceManager.OP_ID_TRAIN)
@@ -212,15 +237,15 @@ def run_iterations_wo_oracle(agent, tasks_info):
                 rewards.append(np.mean(agent.last_episode_rewards))
 
                 # detect task
+                task_label, task_change = None, False
                 bool_execute = mod_rm.operation(ResourceManager.OP_ID_DETECT)
                 if bool_execute:
-                    task_label, task_change = mod_detect.detect(agent.data_buffer)
-                if task_change and task_idx > 0:
+                    task_label, task_change = detect_task_change(agent, mod_detect)
+                if task_change and len(agent.seen_tasks) > 0:
                     config.logger.info('*****task change detected by agent')
                     config.logger.info('cacheing mask for current task')
-                    agent.task_change_detected(task_label, task_info['name'])
-                    task_change = False
-                else:
+                    agent.task_change_detected(task_label)
+                elif task_label is not None:
                     agent.update_task_label(task_label)
 
                 # logging
@@ -234,6 +259,9 @@ def run_iterations_wo_oracle(agent, tasks_info):
                     config.logger.scalar_summary('max reward', np.max(agent.last_episode_rewards))
                     config.logger.scalar_summary('min reward', np.min(agent.last_episode_rewards))
                     config.logger.scalar_summary('avg grad norm', avg_grad_norm)
+                    # per worker step latency of a ready-first env pool (AsyncParallelizedTask)
+                    if hasattr(agent.task, 'log_env_latencies'):
+                        agent.task.log_env_latencies(config.logger)
 
                     with open(config.log_dir + '/%s-%s-online-stats-%s.bin' % \
                         (agent_name, config.tag, agent.task.name), 'wb') as f:
@@ -254,6 +282,8 @@ def run_iterations_wo_oracle(agent, tasks_info):
                     if (agent.config.eval_interval is not None and \
                         iteration % agent.config.eval_interval == 0):
                         config.logger.info('*****agent / evaluation block')
+                        # evaluate the environment's current task with the mask being trained
+                        agent.record_task_name(task_info['name'])
                         _tasks = tasks_info
                         _names = [eval_task_info['name'] for eval_task_info in _tasks]
                         config.logger.info('eval tasks: {0}'.format(', '.join(_names)))
@@ -291,6 +321,7 @@ def run_iterations_wo_oracle(agent, tasks_info):
             # final evaluation block after completing traning on a task (for debugging purpose)
             # only evaluate agent across task exposed to agent so far
             config.logger.info('evaluating agent across all tasks exposed so far to agent')
+            agent.record_task_name(task_info['name'])
             for j in range(task_idx+1):
                 _eval_task = tasks_info[j]
                 agent.task_eval_start(_eval_task['name'])
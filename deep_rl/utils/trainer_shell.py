@@ -8,8 +8,11 @@ import numpy as np
 import pickle
 import os
 import datetime
+import queue
+import multiprocessing as mp
 import torch
 from .torch_utils import *
+from .logger import get_logger
 from ..shell_modules import *
 
 try:
@@ -33,115 +36,53 @@ def shell_train(agents, logger):
     shell_eval_data.append(np.zeros((num_agents, num_eval_tasks), dtype=np.float32))
     shell_metric_tcr = [] # tcr => total cumulative reward metric
 
+    # knowledge directory: the agents publish their trained tasks, and ping the holders only
+    directory = None
+    if agents[0].config.knowledge_directory:
+        directory = KnowledgeDirectory()
+        for agent_idx, agent in enumerate(agents):
+            agent.agent_id = agent_idx
+            agent.directory = directory
+
     print()
     logger.info('*****start shell training')
 
     # set the first task each agent is meant to train on
     for agent_idx, agent in enumerate(agents):
-        states_ = agent.task.reset_task(shell_tasks[agent_idx][0])
-        agent.states = agent.config.state_normalizer(states_)
-        logger.info('*****agent {0} /setting first task (task 0)'.format(agent_idx))
-        logger.info('task: {0}'.format(shell_tasks[agent_idx][0]['task']))
-        logger.info('task_label: {0}'.format(shell_tasks[agent_idx][0]['task_label']))
-        agent.task_train_start(shell_tasks[agent_idx][0]['task_label'])
+        _shell_set_task(agent, agent_idx, shell_tasks[agent_idx], 0, logger)
         print()
-    del states_
 
     while True:
         for agent_idx, agent in enumerate(agents):
             if shell_done[agent_idx]:
                 continue
-            agent.iteration()
             shell_iterations[agent_idx] += 1
-            # tensorboard log
-            if shell_iterations[agent_idx] % agent.config.iteration_log_interval == 0:
-                logger.info('agent %d, task %d / iteration %d, total steps %d, ' \
-                'mean/max/min reward %f/%f/%f' % (agent_idx, shell_task_idx[agent_idx], \
-                    shell_iterations[agent_idx],
-                    agent.total_steps,
-                    np.mean(agent.last_episode_rewards),
-                    np.max(agent.last_episode_rewards),
-                    np.min(agent.last_episode_rewards)
-                ))
-                logger.scalar_summary('agent_{0}/avg_reward'.format(agent_idx), \
-                    np.mean(agent.last_episode_rewards))
-                logger.scalar_summary('agent_{0}/max_reward'.format(agent_idx), \
-                    np.max(agent.last_episode_rewards))
-                logger.scalar_summary('agent_{0}/min_reward'.format(agent_idx), \
-                    np.min(agent.last_episode_rewards))
-
-            # evaluation block
-            if (agent.config.eval_interval is not None and \
-                shell_iterations[agent_idx] % agent.config.eval_interval == 0):
-                logger.info('*****agent {0} / evaluation block'.format(agent_idx))
-                _tasks = agent.evaluation_env.get_all_tasks()
-                _names = [eval_task_info['task'] for eval_task_info in _tasks]
-                logger.info('eval tasks: {0}'.format(', '.join(_names)))
-                for eval_task_idx, eval_task_info in enumerate(_tasks):
-                    agent.task_eval_start(eval_task_info['task_label'])
-                    eval_states = agent.evaluation_env.reset_task(eval_task_info)
-                    agent.evaluation_states = eval_states
-                    rewards, _ = agent.evaluate_cl(num_iterations=agent.config.evaluation_episodes)
-                    agent.task_eval_end()
-                    shell_eval_data[-1][agent_idx, eval_task_idx] = np.mean(rewards)
+            rewards, task_done = _shell_agent_step(agent, agent_idx, shell_task_idx[agent_idx], \
+                shell_iterations[agent_idx], logger, 'agent_{0}/'.format(agent_idx))
+            if rewards is not None:
+                shell_eval_data[-1][agent_idx] = rewards
                 shell_eval_tracker[agent_idx] = True
 
-            # checker for end of task training
-            if not agent.config.max_steps:
-                raise ValueError('`max_steps` should be set for each agent')
-            task_steps_limit = agent.config.max_steps[shell_task_idx[agent_idx]] * \
-                (shell_task_idx[agent_idx] + 1)
-            if agent.total_steps >= task_steps_limit:
+            if task_done:
                 print()
-                task_idx_ = shell_task_idx[agent_idx]
-                logger.info('*****agent {0} / end of training on task {1}'.format(agent_idx, \
-                    task_idx_))
-                #agent.task_train_end(shell_tasks[agent_idx][task_idx_]['task_label'])
-                agent.task_train_end()
-
-                task_idx_ += 1
-                shell_task_idx[agent_idx] = task_idx_
-                if task_idx_ < len(shell_tasks[agent_idx]):
-                    logger.info('*****agent {0} / set next task {1}'.format(agent_idx, task_idx_))
-                    logger.info('task: {0}'.format(shell_tasks[agent_idx][task_idx_]['task']))
-                    logger.info('task_label: {0}'.format(shell_tasks[agent_idx][task_idx_]['task_label']))
-                    states_ = agent.task.reset_task(shell_tasks[agent_idx][task_idx_]) # set new task
-                    agent.states = agent.config.state_normalizer(states_)
-                    agent.task_train_start(shell_tasks[agent_idx][task_idx_]['task_label'])
-
+                def _ping():
                     # ping other agents to see if they have knoweledge (mask) of current task
-                    logger.info('*****agent {0} / pinging other agents to leverage on existing ' \
-                        'knowledge about task'.format(agent_idx))
-                    a_idxs = list(range(len(agents)))
-                    a_idxs.remove(agent_idx)
-                    other_agents = [agents[i] for i in a_idxs]
-                    found_knowledge = agent.ping_agents(other_agents)
-                    if found_knowledge:
-                        logger.info('found knowledge about task from other agents')
+                    task_label = agent.task.get_task()['task_label']
+                    if directory is not None:
+                        a_idxs = directory.holders(task_label, exclude=agent_idx)
                     else:
-                        logger.info('could not find any agent with knowledge about task')
-                    del states_
+                        a_idxs = list(range(len(agents)))
+                        a_idxs.remove(agent_idx)
+                    return agent.ping_agents([agents[i] for i in a_idxs])
+                if _shell_agent_next_task(agent, agent_idx, shell_tasks[agent_idx], \
+                    shell_task_idx[agent_idx], logger, _ping):
+                    shell_task_idx[agent_idx] += 1
                     print()
                 else:
                     shell_done[agent_idx] = True # training done for all task for agent
-                    logger.info('*****agent {0} / end of all training'.format(agent_idx))
-                del task_idx_
                     
         if all(shell_eval_tracker):
-            _metrics = shell_eval_data[-1]
-            # compute tcr 
-            _max_reward = _metrics.max(axis=0) 
-            _agent_ids = _metrics.argmax(axis=0).tolist()
-            _agent_ids = ', '.join([str(_agent_id) for _agent_id in _agent_ids])
-            tcr = _max_reward.sum()
-            shell_metric_tcr.append(tcr)
-            # log eval to file/screen and tensorboard
-            logger.info('*****shell evaluation:')
-            logger.info('best agent per task:'.format(_agent_ids))
-            logger.info('shell eval TCR: {0}'.format(tcr))
-            logger.info('shell eval TP: {0}'.format(np.sum(shell_metric_tcr)))
-            logger.scalar_summary('shell_eval/tcr', tcr)
-            logger.scalar_summary('shell_eval/tp', np.sum(shell_metric_tcr))
+            _log_shell_eval(logger, shell_eval_data[-1], shell_metric_tcr)
             # reset eval tracker
             shell_eval_tracker = [False for _ in shell_eval_tracker]
             # initialise new eval block
@@ -157,3 +98,221 @@ def shell_train(agents, logger):
     for agent in agents:
         agent.close()
     return
+
+'''
+per agent parts of the shell training loop, shared by shell_train (single process) and
+shell_train_dp (one process per agent)
+'''
+def _shell_set_task(agent, agent_idx, tasks, task_idx, logger):
+    # set task task_idx of the agent's sequence of tasks, and start training on it
+    logger.info('*****agent {0} / set task {1}'.format(agent_idx, task_idx))
+    logger.info('task: {0}'.format(tasks[task_idx]['task']))
+    logger.info('task_label: {0}'.format(tasks[task_idx]['task_label']))
+    states_ = agent.task.reset_task(tasks[task_idx])
+    agent.states = agent.config.state_normalizer(states_)
+    agent.task_train_start(tasks[task_idx]['task_label'])
+
+def _shell_agent_step(agent, agent_idx, task_idx, iteration, logger, tag_prefix=''):
+    # training iteration `iteration` of the agent (on task task_idx of its sequence), with
+    # its logging and evaluation block. returns the agent's mean evaluation reward of each
+    # evaluation task (None if no evaluation took place) and whether the training on the
+    # task is over.
+    agent.iteration()
+    # tensorboard log
+    if iteration % agent.config.iteration_log_interval == 0:
+        logger.info('agent %d, task %d / iteration %d, total steps %d, ' \
+        'mean/max/min reward %f/%f/%f' % (agent_idx, task_idx, iteration,
+            agent.total_steps,
+            np.mean(agent.last_episode_rewards),
+            np.max(agent.last_episode_rewards),
+            np.min(agent.last_episode_rewards)
+        ))
+        logger.scalar_summary(tag_prefix + 'avg_reward', np.mean(agent.last_episode_rewards))
+        logger.scalar_summary(tag_prefix + 'max_reward', np.max(agent.last_episode_rewards))
+        logger.scalar_summary(tag_prefix + 'min_reward', np.min(agent.last_episode_rewards))
+        # per worker step latency of a ready-first env pool (AsyncParallelizedTask)
+        if hasattr(agent.task, 'log_env_latencies'):
+            agent.task.log_env_latencies(logger, tag_prefix)
+
+    # evaluation block
+    rewards = None
+    if (agent.config.eval_interval is not None and \
+        iteration % agent.config.eval_interval == 0):
+        logger.info('*****agent {0} / evaluation block'.format(agent_idx))
+        _tasks = agent.evaluation_env.get_all_tasks()
+        _names = [eval_task_info['task'] for eval_task_info in _tasks]
+        logger.info('eval tasks: {0}'.format(', '.join(_names)))
+        rewards = np.zeros(len(_tasks), dtype=np.float32)
+        if agent.config.eval_batched:
+            results = agent.evaluate_cl_batched(_tasks, \
+                num_iterations=agent.config.evaluation_episodes)
+            for eval_task_idx, (rewards_, _) in enumerate(results):
+                rewards[eval_task_idx] = np.mean(rewards_)
+        else:
+            for eval_task_idx, eval_task_info in enumerate(_tasks):
+                agent.task_eval_start(eval_task_info['task_label'])
+                eval_states = agent.evaluation_env.reset_task(eval_task_info)
+                agent.evaluation_states = eval_states
+                rewards_, _ = agent.evaluate_cl(num_iterations=\
+                    agent.config.evaluation_episodes)
+                agent.task_eval_end()
+                rewards[eval_task_idx] = np.mean(rewards_)
+
+    # checker for end of task training
+    if not agent.config.max_steps:
+        raise ValueError('`max_steps` should be set for each agent')
+    task_steps_limit = agent.config.max_steps[task_idx] * (task_idx + 1)
+    return rewards, agent.total_steps >= task_steps_limit
+
+def _shell_agent_next_task(agent, agent_idx, tasks, task_idx, logger, ping_fn):
+    # end the training on task task_idx, then set the next task of the agent's sequence and
+    # look for knowledge about it with ping_fn (agent.ping_agents: True if a mask was found,
+    # None if the answers are handled as they arrive). returns False if there is no next
+    # task.
+    logger.info('*****agent {0} / end of training on task {1}'.format(agent_idx, task_idx))
+    agent.task_train_end()
+    task_idx += 1
+    if task_idx >= len(tasks):
+        logger.info('*****agent {0} / end of all training'.format(agent_idx))
+        return False
+    _shell_set_task(agent, agent_idx, tasks, task_idx, logger)
+    logger.info('*****agent {0} / pinging other agents to leverage on existing ' \
+        'knowledge about task'.format(agent_idx))
+    found_knowledge = ping_fn()
+    if found_knowledge:
+        logger.info('found knowledge about task from other agents')
+    elif found_knowledge is None:
+        logger.info('training on, masks are installed as they arrive')
+    else:
+        logger.info('could not find any agent with knowledge about task')
+    return True
+
+def _log_shell_eval(logger, metrics, shell_metric_tcr):
+    # shell evaluation metrics of an evaluation block: metrics (num_agents, num_eval_tasks)
+    # holds the mean reward of each agent on each evaluation task
+    # compute tcr 
+    _max_reward = metrics.max(axis=0) 
+    _agent_ids = ', '.join([str(_agent_id) for _agent_id in metrics.argmax(axis=0)])
+    tcr = _max_reward.sum()
+    shell_metric_tcr.append(tcr)
+    # log eval to file/screen and tensorboard
+    logger.info('*****shell evaluation:')
+    logger.info('best agent per task: {0}'.format(_agent_ids))
+    logger.info('shell eval TCR: {0}'.format(tcr))
+    logger.info('shell eval TP: {0}'.format(np.sum(shell_metric_tcr)))
+    logger.scalar_summary('shell_eval/tcr', tcr)
+    logger.scalar_summary('shell_eval/tp', np.sum(shell_metric_tcr))
+
+'''
+shell training, distributed (multi-) process (DP) setting: one process per agent on the
+node (ShellAgent_DP), exchanging pings and masks through a local transport
+(Communications). shell_train (single process) is the reference implementation.
+
+agent_fns: one function per agent, building the agent (in its process) from its index and
+the agent's logger, created in that process. knowledge_directory: whether the agents'
+configs set knowledge_directory (the shared KnowledgeDirectory and its manager process
+are only started then). the agents' evaluation results are gathered by the parent process,
+which computes the shell evaluation metrics.
+
+the agent processes are forked (fork start method, whatever the platform default), as
+agent_fns are usually closures (e.g., in run_shell.py), which cannot be pickled for the
+spawn/forkserver start methods. forking after importing torch is safe as long as the
+parent has not initialised CUDA (checked) nor built networks or run torch operations (whose
+thread pools the children would inherit): before forking, the parent only creates the
+queues and the manager. the children do not share the parent's logger (whose tensorboard
+writer thread does not exist in a forked child).
+'''
+def shell_train_dp(agent_fns, logger, knowledge_directory=False):
+    if torch.cuda.is_initialized():
+        raise RuntimeError('CUDA initialised before forking the shell agent processes')
+    ctx = mp.get_context('fork')
+    num_agents = len(agent_fns)
+    inboxes = Communications.make_inboxes(num_agents, ctx)
+    reports = ctx.Queue()
+    directory = KnowledgeDirectory(shared=True, ctx=ctx) if knowledge_directory else None
+    procs = [ctx.Process(target=_shell_train_dp_agent, args=(agent_idx, agent_fns[agent_idx], \
+        Communications(agent_idx, inboxes), directory, reports, logger.log_dir)) \
+        for agent_idx in range(num_agents)]
+    for proc in procs:
+        proc.start()
+
+    shell_eval_data = {} # eval block -> (num_agents, num_eval_tasks) rewards
+    shell_eval_count = {}
+    shell_metric_tcr = [] # tcr => total cumulative reward metric
+    num_done = 0
+    logger.info('*****start shell training ({0} agent processes)'.format(num_agents))
+    while num_done < num_agents:
+        try:
+            report = reports.get(timeout=1.)
+        except queue.Empty:
+            if any(proc.exitcode not in (None, 0) for proc in procs):
+                for proc in procs:
+                    if proc.is_alive(): proc.terminate()
+                if directory is not None: directory.close()
+                raise RuntimeError('shell agent process failed: exit codes {0}'.format(\
+                    [proc.exitcode for proc in procs]))
+            continue
+        if report[0] == 'done':
+            num_done += 1
+            continue
+        _, agent_idx, eval_block, rewards = report
+        if eval_block not in shell_eval_data:
+            shell_eval_data[eval_block] = np.zeros((num_agents, len(rewards)), dtype=np.float32)
+            shell_eval_count[eval_block] = 0
+        shell_eval_data[eval_block][agent_idx] = rewards
+        shell_eval_count[eval_block] += 1
+        if shell_eval_count[eval_block] == num_agents:
+            _log_shell_eval(logger, shell_eval_data[eval_block], shell_metric_tcr)
+    for proc in procs:
+        proc.join()
+    if directory is not None: directory.close()
+    # save eval metrics
+    if len(shell_eval_data) > 0:
+        to_save = np.stack([shell_eval_data[k] for k in sorted(shell_eval_data)], axis=0)
+        with open(logger.log_dir + '/eval_metrics.npy', 'wb') as f:
+            np.save(f, to_save)
+    return
+
+def _shell_train_dp_agent(agent_idx, agent_fn, comm, directory, reports, log_dir):
+    # training loop of a single agent of shell_train_dp (see shell_train), in its own process
+    set_one_thread()
+    logger = get_logger('agent_{0}'.format(agent_idx), file_name='train-log', \
+        log_dir='{0}/agent_{1}'.format(log_dir, agent_idx))
+    agent = agent_fn(agent_idx, logger)
+    agent.config.logger = logger
+    agent.comm = comm
+    if agent.config.knowledge_directory:
+        if directory is None:
+            raise ValueError('config.knowledge_directory set, but shell_train_dp was called ' \
+                'with knowledge_directory=False')
+        agent.directory = directory
+    tasks = agent.config.cl_tasks_info
+    task_idx = 0
+    iteration = 0
+    eval_block = 0
+
+    _shell_set_task(agent, agent_idx, tasks, task_idx, logger)
+    while True:
+        # serve the other agents' pings (and own ping answers) between iterations
+        agent.process_messages()
+        iteration += 1
+        rewards, task_done = _shell_agent_step(agent, agent_idx, task_idx, iteration, logger)
+        if rewards is not None:
+            reports.put(('eval', agent_idx, eval_block, rewards))
+            eval_block += 1
+        if task_done:
+            if not _shell_agent_next_task(agent, agent_idx, tasks, task_idx, logger, \
+                agent.ping_agents):
+                break
+            task_idx += 1
+
+    # keep answering the other agents' pings until all of them are done. answers to own
+    # pings are of no use anymore.
+    agent.pending_pings.clear()
+    comm.broadcast(Communications.DONE, None)
+    while len(agent.peers_done) < comm.num_agents - 1:
+        agent.handle_message(comm.recv(block=True))
+    agent.close()
+    logger.close()
+    reports.put(('done', agent_idx))
+    return
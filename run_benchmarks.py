@@ -0,0 +1,203 @@
+#######################################################################
+# Copyright (C) 2017 Shangtong Zhang(zhangshangtong.cpp@gmail.com)    #
+# Permission given to modify the code as long as you keep this        #
+# declaration at the top                                              #
+#######################################################################
+
+'''
+micro-benchmarks for the performance sensitive parts of the code base
+(environment stepping, rollout processing, supermask layers).
+
+example:
+python run_benchmarks.py parallel_step --env_config_path ./env_configs/minigrid_sc_3.json
+'''
+
+import time
+import matplotlib
+matplotlib.use("Pdf")
+from deep_rl import *
+import argparse
+
+# helper function
+def timeit(fn, repeats):
+    fn() # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+'''
+ParallelizedTask: serial send/recv per worker vs pipelined fan-out/fan-in,
+with pickled (pipe) or shared memory observation transport
+'''
+def bench_parallel_step(name, args):
+    task_fn = lambda log_dir: MiniGridFlatObs(name, args.env_config_path, log_dir, 1000, False)
+    for shared_memory in [False, True]:
+        for pipelined in [False, True]:
+            task = ParallelizedTask(task_fn, args.num_workers, pipelined=pipelined, \
+                shared_memory=shared_memory, envs_per_worker=args.envs_per_worker)
+            task.reset()
+            actions = np.zeros(args.num_workers, dtype=np.int64)
+            def _step():
+                actions[:] = np.random.randint(task.action_dim, size=args.num_workers)
+                list(task.step(actions))
+            t = timeit(_step, args.repeats)
+            print('shared_memory={0}, pipelined={1}: {2:.3f} ms/step, {3:.1f} env steps/s'.format(\
+                shared_memory, pipelined, t * 1e3, args.num_workers / t))
+            task.close()
+
+'''
+per process MiniGridFlatObs envs in a ParallelizedTask vs the vectorized MiniGridVecFlatObs
+engine stepping all envs in a single process
+'''
+def bench_minigrid_vec(name, args):
+    task_fn = lambda log_dir: MiniGridFlatObs(name, args.env_config_path, log_dir, 1000, False)
+    tasks = {'ParallelizedTask': lambda: ParallelizedTask(task_fn, args.num_workers, \
+            envs_per_worker=args.envs_per_worker),
+        'MiniGridVecFlatObs': lambda: MiniGridVecFlatObs(name, args.env_config_path, \
+            args.num_workers, seed=1000)}
+    for engine, fn in tasks.items():
+        task = fn()
+        task.reset()
+        def _step():
+            actions = np.random.randint(task.action_dim, size=args.num_workers)
+            list(task.step(actions))
+        t = timeit(_step, args.repeats)
+        print('{0}: {1:.3f} ms/step, {2:.1f} env steps/s'.format(engine, t * 1e3, \
+            args.num_workers / t))
+        task.close()
+
+'''
+per process CTgraphFlatObs envs in a ParallelizedTask vs the vectorized CTgraphVecFlatObs engine
+'''
+def bench_ctgraph_vec(args):
+    name = 'CTgraph-v0'
+    task_fn = lambda log_dir: CTgraphFlatObs(name, args.env_config_path, log_dir)
+    tasks = {'ParallelizedTask': lambda: ParallelizedTask(task_fn, args.num_workers, \
+            envs_per_worker=args.envs_per_worker),
+        'CTgraphVecFlatObs': lambda: CTgraphVecFlatObs(name, args.env_config_path, \
+            args.num_workers)}
+    for engine, fn in tasks.items():
+        task = fn()
+        task.reset()
+        def _step():
+            actions = np.random.randint(task.action_dim, size=args.num_workers)
+            list(task.step(actions))
+        t = timeit(_step, args.repeats)
+        print('{0}: {1:.3f} ms/step, {2:.1f} env steps/s'.format(engine, t * 1e3, \
+            args.num_workers / t))
+        task.close()
+
+'''
+returns/advantages of a (rollout_length, num_workers) rollout: the per time step tensor loop
+previously used by the PPO/A2C agents vs the returns_and_advantages scan
+'''
+def bench_gae(args):
+    T, N, discount, gae_tau = args.rollout_length, args.num_workers, 0.99, 0.95
+    rewards = np.random.randn(T, N).astype(np.float32)
+    masks = (np.random.rand(T, N) > 0.05).astype(np.float32)
+    values = tensor(np.random.randn(T + 1, N, 1))
+
+    def _loop():
+        advantages = tensor(np.zeros((N, 1)))
+        returns = values[-1]
+        out = [None] * T
+        for i in reversed(range(T)):
+            terminals = tensor(masks[i]).unsqueeze(1)
+            rewards_ = tensor(rewards[i]).unsqueeze(1)
+            returns = rewards_ + discount * terminals * returns
+            td_error = rewards_ + discount * terminals * values[i + 1] - values[i]
+            advantages = advantages * gae_tau * discount * terminals + td_error
+            out[i] = [returns, advantages]
+        return [torch.cat(x, dim=0) for x in zip(*out)]
+
+    def _scan():
+        returns, advantages = returns_and_advantages(rewards[..., None], masks[..., None], \
+            values, discount, True, gae_tau)
+        return tensor(returns).reshape(-1, 1), tensor(advantages).reshape(-1, 1)
+
+    for x, y in zip(_loop(), _scan()):
+        assert torch.allclose(x, y, atol=1e-4), 'returns/advantages mismatch'
+    for name, fn in [('loop', _loop), ('scan', _scan)]:
+        t = timeit(fn, args.repeats)
+        print('{0}: {1:.3f} ms/rollout (T={2}, N={3})'.format(name, t * 1e3, T, N))
+
+'''
+top k% supermask of a MultitaskMaskLinearSparse layer: the full sort previously used by
+GetSubnetSparse vs kthvalue threshold selection into a reused buffer, across sparsity levels
+(archive/cl_examples_sparsity.py uses 5%)
+'''
+def bench_sparse_topk(args):
+    layer = MultitaskMaskLinearSparse(args.layer_dim, args.layer_dim)
+    scores = layer.scores[0].detach()
+    out = torch.empty_like(scores)
+
+    def _sort(k):
+        out = scores.clone()
+        _, idx = scores.flatten().sort()
+        j = int((1 - k) * scores.numel())
+        flat_out = out.flatten()
+        flat_out[idx[:j]] = 0
+        flat_out[idx[j:]] = 1
+        return out
+
+    def _select(k):
+        return GetSubnetSparse.apply(scores, k, sparse_threshold(scores, k), out)
+
+    for k in [0.05, 0.1, 0.25, 0.5, 0.9]:
+        for name, fn in [('sort', _sort), ('kthvalue', _select)]:
+            t = timeit(lambda: fn(k), args.repeats)
+            print('sparsity={0}, {1}: {2:.3f} ms/mask ({3}x{3})'.format(k, name, t * 1e3, \
+                args.layer_dim))
+
+'''
+no-grad forward pass of a MultitaskMaskLinearSparse layer: dense masked weight + F.linear vs
+the CSR sparse kernel (set_sparse_kernel), across densities and batch sizes. used to pick
+the dense/sparse crossover (SPARSE_KERNEL_CROSSOVER, SPARSE_KERNEL_MIN_BATCH)
+'''
+def bench_sparse_kernel(args):
+    for k in [0.01, 0.05, 0.1, 0.2, 0.5]:
+        layer = MultitaskMaskLinearSparse(args.layer_dim, args.layer_dim, sparsity=k)
+        layer.task = 0
+        for batch_size in [16, 128]:
+            x = torch.randn(batch_size, args.layer_dim)
+            times = []
+            for enabled in [False, True]:
+                set_sparse_kernel(layer, enabled, crossover=1.)
+                with torch.no_grad():
+                    times.append(timeit(lambda: layer(x), args.repeats))
+            print('density={0}, batch={1}: dense {2:.1f} us, sparse {3:.1f} us ({4}x{4})'.format(\
+                k, batch_size, times[0] * 1e6, times[1] * 1e6, args.layer_dim))
+
+if __name__ == '__main__':
+    set_one_thread()
+    select_device(-1)
+
+    name = 'MiniGrid'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bench', help='benchmark to run')
+    parser.add_argument('--env_config_path',help='environment config', \
+        default='./env_configs/minigrid_sc_3.json')
+    parser.add_argument('--num_workers', help='number of environment workers', default=4, type=int)
+    parser.add_argument('--envs_per_worker', help='environments per worker process', default=1, \
+        type=int)
+    parser.add_argument('--repeats', help='number of timed repeats', default=1000, type=int)
+    parser.add_argument('--rollout_length', help='rollout length (gae)', default=128, type=int)
+    parser.add_argument('--layer_dim', help='layer width (sparse_topk, sparse_kernel)', default=200, type=int)
+    args = parser.parse_args()
+
+    if args.bench == 'parallel_step':
+        bench_parallel_step(name, args)
+    elif args.bench == 'minigrid_vec':
+        bench_minigrid_vec(name, args)
+    elif args.bench == 'ctgraph_vec':
+        bench_ctgraph_vec(args)
+    elif args.bench == 'gae':
+        bench_gae(args)
+    elif args.bench == 'sparse_topk':
+        bench_sparse_topk(args)
+    elif args.bench == 'sparse_kernel':
+        bench_sparse_kernel(args)
+    else:
+        raise ValueError('not implemented')
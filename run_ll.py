@@ -37,6 +37,8 @@ def ppo_baseline_minigrid(name, args):
     log_name = name + '-ppo' + '-' + config.cl_preservation + exp_id
     config.log_dir = get_default_log_dir(log_name)
     config.num_workers = 4
+    config.num_envs_per_worker = 1
+    #config.shared_memory_obs = True
 
     # get num_tasks from env_config
     with open(env_config_path, 'r') as f:
@@ -45,9 +47,20 @@ def ppo_baseline_minigrid(name, args):
     del env_config_
 
     task_fn = lambda log_dir: MiniGridFlatObs(name, env_config_path, log_dir, config.seed, False)
-    config.task_fn = lambda: ParallelizedTask(task_fn, config.num_workers, log_dir=config.log_dir)
+    config.task_fn = lambda: ParallelizedTask(task_fn, config.num_workers, log_dir=config.log_dir, \
+        shared_memory=config.shared_memory_obs, envs_per_worker=config.num_envs_per_worker)
+    # single process vectorized alternative (crossing environments only)
+    #config.task_fn = lambda: MiniGridVecFlatObs(name, env_config_path, config.num_workers, \
+    #    seed=config.seed)
+    # ready-first env pool alternative (steps whichever workers finish first)
+    #config.task_fn = lambda: AsyncParallelizedTask(task_fn, config.num_workers, \
+    #    batch_size=config.num_workers // 2, log_dir=config.log_dir, \
+    #    shared_memory=config.shared_memory_obs, envs_per_worker=config.num_envs_per_worker)
     eval_task_fn = lambda log_dir: MiniGridFlatObs(name, env_config_path, log_dir, config.seed, True)
     config.eval_task_fn = eval_task_fn
+    # vectorized environment set for batched evaluation (crossing environments only)
+    #config.eval_vec_task_fn = lambda num_envs: MiniGridVecFlatObs(name, env_config_path, \
+    #    num_envs, seed=config.seed, eval_mode=True)
     config.optimizer_fn = lambda params, lr: torch.optim.RMSprop(params, lr=lr)
     config.network_fn = lambda state_dim, action_dim, label_dim: CategoricalActorCriticNet_CL(
         state_dim, action_dim, label_dim, 
@@ -70,6 +83,7 @@ def ppo_baseline_minigrid(name, args):
     config.gradient_clip = 5
     config.max_steps = args.max_steps
     config.evaluation_episodes = 10
+    #config.eval_batched = True
     config.logger = get_logger(log_dir=config.log_dir, file_name='train-log')
     config.cl_requires_task_label = True
 
@@ -112,6 +126,8 @@ def ppo_ll_minigrid(name, args):
     log_name = name + '-ppo' + '-' + config.cl_preservation + exp_id
     config.log_dir = get_default_log_dir(log_name)
     config.num_workers = 4
+    config.num_envs_per_worker = 1
+    #config.shared_memory_obs = True
     # get num_tasks from env_config
     with open(env_config_path, 'r') as f:
         env_config_ = json.load(f)
@@ -119,9 +135,20 @@ def ppo_ll_minigrid(name, args):
     del env_config_
 
     task_fn = lambda log_dir: MiniGridFlatObs(name, env_config_path, log_dir, config.seed, False)
-    config.task_fn = lambda: ParallelizedTask(task_fn, config.num_workers, log_dir=config.log_dir)
+    config.task_fn = lambda: ParallelizedTask(task_fn, config.num_workers, log_dir=config.log_dir, \
+        shared_memory=config.shared_memory_obs, envs_per_worker=config.num_envs_per_worker)
+    # single process vectorized alternative (crossing environments only)
+    #config.task_fn = lambda: MiniGridVecFlatObs(name, env_config_path, config.num_workers, \
+    #    seed=config.seed)
+    # ready-first env pool alternative (steps whichever workers finish first)
+    #config.task_fn = lambda: AsyncParallelizedTask(task_fn, config.num_workers, \
+    #    batch_size=config.num_workers // 2, log_dir=config.log_dir, \
+    #    shared_memory=config.shared_memory_obs, envs_per_worker=config.num_envs_per_worker)
     eval_task_fn = lambda log_dir: MiniGridFlatObs(name, env_config_path, log_dir, config.seed, True)
     config.eval_task_fn = eval_task_fn
+    # vectorized environment set for batched evaluation (crossing environments only)
+    #config.eval_vec_task_fn = lambda num_envs: MiniGridVecFlatObs(name, env_config_path, \
+    #    num_envs, seed=config.seed, eval_mode=True)
     config.optimizer_fn = lambda params, lr: torch.optim.RMSprop(params, lr=lr)
     config.network_fn = lambda state_dim, action_dim, label_dim: CategoricalActorCriticNet_SS(
         state_dim, action_dim, label_dim, 
@@ -145,6 +172,10 @@ def ppo_ll_minigrid(name, args):
     config.gradient_clip = 5
     config.max_steps = args.max_steps
     config.evaluation_episodes = 10
+    #config.eval_batched = True
+    #config.eval_mixed_tasks = True
+    #config.eval_cache = True
+    #config.mask_bank = True
     config.logger = get_logger(log_dir=config.log_dir, file_name='train-log')
     config.cl_requires_task_label = True
 
@@ -33,6 +33,8 @@ def global_config(config, name):
     config.log_dir = None
     config.logger = None 
     config.num_workers = 4
+    config.num_envs_per_worker = 1
+    #config.shared_memory_obs = True
     config.optimizer_fn = lambda params, lr: torch.optim.RMSprop(params, lr=lr)
 
     config.policy_fn = SamplePolicy
@@ -51,6 +53,18 @@ def global_config(config, name):
     config.gradient_clip = 5
     config.max_steps = 1e3
     config.evaluation_episodes = 10
+    #config.eval_batched = True
+    #config.eval_mixed_tasks = True
+    #config.eval_cache = True
+    #config.archive_masks = True
+    #config.archived_scores_dtype = None
+    #config.mask_bank = True # not with archive_masks
+    #config.share_backbone = True
+    # ping only the agents holding a mask of the task (shared knowledge directory)
+    #config.knowledge_directory = True
+    # ShellAgent_DP (--dp): do not wait for the other agents' answers to mask pings
+    #config.async_pings = True
+    #config.mask_staleness_steps = 4 * config.num_workers * config.rollout_length
     config.cl_requires_task_label = True
     config.task_fn = None
     config.eval_task_fn = None
@@ -77,11 +91,13 @@ def shell_minigrid(name, args):
     log_dir = get_default_log_dir(name + '-shell' + exp_id)
     logger = get_logger(log_dir=log_dir, file_name='train-log')
 
-    # create/initialise agents
-    for idx in range(num_agents):
-        logger.info('*****initialising agent {0}'.format(idx))
+    # create/initialise agents. agent_logger: the logger of the agent's own process (--dp)
+    def make_agent(idx, agent_logger=None):
+        agent_logger = logger if agent_logger is None else agent_logger
+        agent_logger.info('*****initialising agent {0}'.format(idx))
         config = Config()
         config = global_config(config, name)
+        config.logger = agent_logger
         # task may repeat, so get number of unique tasks.
         num_tasks = len(set(shell_config['agents'][idx]['task_ids'])) 
         config.cl_num_tasks = num_tasks
@@ -91,22 +107,37 @@ def shell_minigrid(name, args):
         else:
             config.max_steps = [shell_config['agents'][idx]['max_steps'], ] * num_tasks
         task_fn = lambda log_dir: MiniGridFlatObs(name, env_config_path, log_dir, config.seed, False)
-        config.task_fn = lambda: ParallelizedTask(task_fn,config.num_workers,log_dir=config.log_dir)
+        config.task_fn = lambda: ParallelizedTask(task_fn,config.num_workers,log_dir=config.log_dir, \
+            shared_memory=config.shared_memory_obs, envs_per_worker=config.num_envs_per_worker)
+        # ready-first env pool alternative (steps whichever workers finish first)
+        #config.task_fn = lambda: AsyncParallelizedTask(task_fn, config.num_workers, \
+        #    batch_size=config.num_workers // 2, log_dir=config.log_dir, \
+        #    shared_memory=config.shared_memory_obs, envs_per_worker=config.num_envs_per_worker)
         eval_task_fn= lambda log_dir: MiniGridFlatObs(name, env_config_path,log_dir,config.seed,True)
         config.eval_task_fn = eval_task_fn
+        # vectorized environment set for batched evaluation (crossing environments only)
+        #config.eval_vec_task_fn = lambda num_envs: MiniGridVecFlatObs(name, env_config_path, \
+        #    num_envs, seed=config.seed, eval_mode=True)
         config.network_fn = lambda state_dim, action_dim, label_dim: CategoricalActorCriticNet_SS(\
             state_dim, action_dim, label_dim, 
             phi_body=FCBody_SS(state_dim, task_label_dim=label_dim, \
-            hidden_units=(200, 200, 200), num_tasks=num_tasks), 
+            hidden_units=(200, 200, 200), num_tasks=1), 
             actor_body=DummyBody_CL(200), 
             critic_body=DummyBody_CL(200),
-            num_tasks=num_tasks)
+            num_tasks=1) # task slots are added as tasks are seen (see add_tasks)
 
-        agent = ShellAgent_SP(config)
+        agent = ShellAgent_DP(config) if args.dp else ShellAgent_SP(config)
         config.agent_name = agent.__class__.__name__ + '_{0}'.format(idx)
-        agents.append(agent)
+        return agent
 
-    shell_train(agents, logger)
+    if args.dp:
+        # one process per agent, the agents are created in their own process
+        knowledge_directory = global_config(Config(), name).knowledge_directory
+        shell_train_dp([make_agent,] * num_agents, logger, knowledge_directory)
+    else:
+        for idx in range(num_agents):
+            agents.append(make_agent(idx))
+        shell_train(agents, logger)
 
 if __name__ == '__main__':
     mkdir('log')
@@ -120,5 +151,6 @@ if __name__ == '__main__':
     parser.add_argument('--shell_config_path', help='shell config', default='./shell.json')
     parser.add_argument('--env_config_path',help='environment config', \
         default='./env_configs/minigrid_sc_3.json')
+    parser.add_argument('--dp', help='one process per agent (ShellAgent_DP)', action='store_true')
     args = parser.parse_args()
     shell_minigrid(name, args)
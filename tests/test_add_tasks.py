@@ -0,0 +1,39 @@
+import unittest
+import torch
+import torch.nn as nn
+from deep_rl.shell_modules.mmn.ssmask_utils import MultitaskMaskLinear, \
+    MultitaskMaskLinearSparse, add_tasks, cache_masks, set_model_task
+
+
+class TestAddTasks(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_grow_slots(self):
+        net = nn.Sequential(MultitaskMaskLinear(4, 5, num_tasks=1), nn.ReLU(), \
+            MultitaskMaskLinearSparse(5, 2, num_tasks=1))
+        opt = torch.optim.SGD(net.parameters(), 0.1)
+        scores = [net[idx].scores[0].detach().clone() for idx in (0, 2)]
+        new_scores = add_tasks(net, 3)
+        self.assertEqual(len(new_scores), 4)
+        self.assertEqual(add_tasks(net, 2), [])
+        opt.add_param_group({'params': new_scores})
+        for idx, s in zip((0, 2), scores):
+            self.assertEqual(net[idx].num_tasks, 3)
+            self.assertEqual(len(net[idx].scores), 3)
+            self.assertTrue(torch.equal(net[idx].scores[0], s))
+        # the new slots are trained by the optimizer, the others are left unchanged
+        set_model_task(net, 2, False)
+        before = [p.detach().clone() for p in net[0].scores]
+        opt.zero_grad()
+        net(torch.randn(8, 4)).pow(2).sum().backward()
+        opt.step()
+        self.assertTrue(torch.equal(net[0].scores[0], before[0]))
+        self.assertFalse(torch.equal(net[0].scores[2], before[2]))
+        # the stacked masks cover the new slots
+        cache_masks(net, verbose=False)
+        self.assertEqual(net[0].stacked.shape[0], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
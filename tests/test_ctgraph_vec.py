@@ -0,0 +1,60 @@
+import copy
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+
+try:
+    import gym_CTgraph
+    import skimage
+except ImportError:
+    gym_CTgraph = None
+
+from deep_rl import *
+
+ENV_CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'env_configs', 'ctgraph.json')
+
+
+@unittest.skipIf(gym_CTgraph is None, 'gym_CTgraph (and scikit-image) required')
+class TestCTgraphVec(unittest.TestCase):
+    def _config_path(self, **image_dataset):
+        with open(ENV_CONFIG_PATH, 'r') as f:
+            env_config = json.load(f)
+        env_config['image_dataset'].update(image_dataset)
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(env_config, f)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_rotation_range(self):
+        # same signed angle range as gym_CTgraph, the shipped config included
+        with open(ENV_CONFIG_PATH, 'r') as f:
+            max_angle = json.load(f)['image_dataset']['small_rotation_on_read']
+        env = CTgraphVec('CTgraph-v0', ENV_CONFIG_PATH, 4)
+        np.testing.assert_array_equal(env.rotation_angles, np.arange(-max_angle, max_angle + 1))
+        self.assertEqual(env.images.shape[0], 2 * max_angle + 1)
+
+    def test_seeded_rollout(self):
+        # without image noise and rotation, observations, rewards and dones are those of
+        # the reference environment step for step
+        path = self._config_path(noise_on_images_on_read=0, small_rotation_on_read=0)
+        ref = CTgraph('CTgraph-v0', path)
+        env = CTgraphVec('CTgraph-v0', path, 1)
+        for task in ref.get_all_tasks():
+            ref_obs = ref.reset_task(copy.deepcopy(task))
+            obs = env.reset_task(copy.deepcopy(task))
+            np.testing.assert_array_equal(obs[0], ref_obs)
+            rnd = np.random.RandomState(0)
+            for _ in range(200):
+                action = rnd.randint(ref.action_dim)
+                ref_obs, ref_reward, ref_done, _ = ref.step(action)
+                obs, reward, done, _ = env.step(np.array([action]))
+                self.assertEqual(reward[0], ref_reward)
+                self.assertEqual(done[0], ref_done)
+                np.testing.assert_array_equal(obs[0], ref_obs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+from deep_rl import *
+
+
+class _Buffer:
+    def empty(self):
+        return False
+
+    def sample(self, batch_size):
+        return [np.zeros((batch_size, 4), dtype=np.float32)]
+
+
+class _UnknownTaskAgent:
+    # infers every batch as a task not seen before
+    def __init__(self, seen_tasks, curr_train_task_label):
+        self.seen_tasks = seen_tasks
+        self.curr_train_task_label = curr_train_task_label
+        self.data_buffer = _Buffer()
+
+    def infer_task_label(self, states):
+        return None, False
+
+    def new_task_label(self):
+        return LLAgent_NoOracle.new_task_label(self)
+
+
+class TestDetect(unittest.TestCase):
+    def setUp(self):
+        label = np.eye(4, dtype=np.float32)[2]
+        self.agent = _UnknownTaskAgent({0: label}, label)
+
+    def test_patience(self):
+        mod_detect = Detect(self.agent, batch_size=8, patience=3)
+        verdicts = [mod_detect.detect(self.agent.data_buffer)[1] for _ in range(6)]
+        self.assertEqual(verdicts, [False, False, True, False, False, True])
+
+    def test_new_task_label_is_internal(self):
+        # the change decision takes no task info (environment task label): the new task
+        # gets the first one-hot label not used by a seen task
+        mod_detect = Detect(self.agent, batch_size=8, patience=1)
+        task_label, task_change = detect_task_change(self.agent, mod_detect)
+        self.assertTrue(task_change)
+        np.testing.assert_array_equal(task_label, np.eye(4, dtype=np.float32)[0])
+        self.agent.seen_tasks[1] = task_label
+        task_label, _ = detect_task_change(self.agent, mod_detect)
+        np.testing.assert_array_equal(task_label, np.eye(4, dtype=np.float32)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
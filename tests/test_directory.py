@@ -0,0 +1,32 @@
+import unittest
+import numpy as np
+from deep_rl import *
+
+
+class TestKnowledgeDirectory(unittest.TestCase):
+    def test_holders(self):
+        directory = KnowledgeDirectory()
+        labels = np.eye(4, dtype=np.float32)
+        directory.publish(labels[0], 0)
+        directory.publish(labels[0], 2)
+        directory.publish(labels[1], 1)
+        self.assertEqual(directory.holders(labels[0]), [0, 2])
+        self.assertEqual(directory.holders(labels[0], exclude=2), [0])
+        self.assertEqual(directory.holders(labels[3]), [])
+
+    def test_rounding_boundary(self):
+        # labels within the agents' matching distance (_label_to_idx) on either side of a
+        # rounding boundary still match
+        directory = KnowledgeDirectory(decimals=4)
+        label = np.array([0.12345, 0.5], dtype=np.float32)
+        other = label + np.array([2e-6, 0.], dtype=np.float32)
+        self.assertNotEqual(directory.key(label), directory.key(other))
+        directory.publish(label, 0)
+        self.assertEqual(directory.holders(other), [0])
+        directory.publish(other, 1)
+        self.assertEqual(directory.holders(label), [0, 1])
+        self.assertEqual(directory.holders(label + 1e-3), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
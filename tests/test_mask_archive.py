@@ -0,0 +1,34 @@
+import unittest
+import torch
+from deep_rl.shell_modules.mmn.ssmask_utils import MultitaskMaskLinear, \
+    MultitaskMaskLinearSparse, pack_mask, unpack_mask
+
+
+class TestMaskArchive(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_pack_unpack_round_trip(self):
+        for shape in [(1,), (7,), (8,), (3, 5), (200, 33)]:
+            mask = (torch.rand(shape) > 0.5).float()
+            packed = pack_mask(mask)
+            self.assertEqual(packed.dtype, torch.uint8)
+            self.assertEqual(packed.numel(), -(-mask.numel() // 8))
+            self.assertTrue(torch.equal(unpack_mask(packed, shape), mask))
+
+    def test_archive_restore_keeps_subnet(self):
+        for layer in [MultitaskMaskLinear(6, 5, num_tasks=2), \
+            MultitaskMaskLinearSparse(6, 5, num_tasks=2, sparsity=0.3)]:
+            subnet = layer.subnet(1).detach().clone()
+            layer.archive_task(1)
+            self.assertTrue(layer.is_archived(1))
+            self.assertEqual(layer.scores[1].numel(), 0)
+            self.assertTrue(torch.equal(layer.subnet(1), subnet))
+            layer.restore_task(1)
+            self.assertFalse(layer.is_archived(1))
+            self.assertTrue(layer.scores[1].requires_grad)
+            self.assertTrue(torch.equal(layer.subnet(1), subnet))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import torch
+import torch.nn as nn
+from deep_rl.shell_modules.mmn.ssmask_utils import MaskBank, MultitaskMaskLinear, \
+    MultitaskMaskLinearSparse, add_tasks, cached_masked_weight, set_model_task
+
+
+def _net(num_tasks):
+    return nn.Sequential(MultitaskMaskLinear(4, 5, num_tasks=num_tasks, bias=False),
+        nn.ReLU(), MultitaskMaskLinearSparse(5, 2, num_tasks=num_tasks, bias=False))
+
+
+def _train_step(net, opt, task):
+    set_model_task(net, task, False)
+    opt.zero_grad()
+    net(torch.randn(8, 4)).pow(2).sum().backward()
+    opt.step()
+
+
+class TestMaskBank(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_views(self):
+        net = _net(3)
+        scores = [[p.detach().clone() for p in net[idx].scores] for idx in (0, 2)]
+        bank = MaskBank(net)
+        for task in range(3):
+            views = bank.views(task)
+            self.assertEqual(sorted(views.keys()), ['0', '2'])
+            for idx, layer_scores in zip((0, 2), scores):
+                self.assertTrue(torch.equal(views[str(idx)], layer_scores[task]))
+                self.assertTrue(torch.equal(net[idx].scores[task], layer_scores[task]))
+            self.assertTrue(torch.equal(bank.get_mask(task), \
+                torch.cat([views['0'].flatten(), views['2'].flatten()])))
+        # the scores are views of the bank rows
+        with torch.no_grad():
+            net[0].scores[1].add_(1.)
+        self.assertTrue(torch.equal(bank.views(1)['0'], net[0].scores[1]))
+
+    def test_add_tasks_keeps_scores_and_optimizer(self):
+        net = _net(1)
+        bank = MaskBank(net)
+        opt = torch.optim.Adam(net.parameters(), 0.1)
+        _train_step(net, opt, 0)
+        row = bank.scores[0].clone()
+        new_scores = add_tasks(net, 3)
+        self.assertEqual(len(new_scores), 4)
+        opt.add_param_group({'params': new_scores})
+        self.assertEqual(bank.scores.shape[0], 3)
+        self.assertTrue(torch.equal(bank.scores[0], row))
+        # the optimizer still trains the (rebound) scores of the old and new tasks
+        for task in [0, 2]:
+            before = bank.scores.clone()
+            _train_step(net, opt, task)
+            self.assertFalse(torch.equal(bank.scores[task], before[task]))
+            self.assertTrue(torch.equal(bank.views(task)['0'], net[0].scores[task]))
+
+    def test_cache_invalidated_per_task(self):
+        net = _net(3)
+        bank = MaskBank(net)
+        opt = torch.optim.Adam(net.parameters(), 0.1)
+        layer = net[0]
+        cached = [cached_masked_weight(layer, task) for task in range(3)]
+        _train_step(net, opt, 1)
+        self.assertIs(cached_masked_weight(layer, 0), cached[0])
+        self.assertIsNot(cached_masked_weight(layer, 1), cached[1])
+        self.assertTrue(torch.equal(cached_masked_weight(layer, 1), \
+            layer.weight * layer.subnet(1)))
+        # a flat mask installed through the bank invalidates the task's entry only
+        bank.set_mask(torch.randn(bank.scores.shape[1]), 2)
+        self.assertIs(cached_masked_weight(layer, 0), cached[0])
+        self.assertTrue(torch.equal(cached_masked_weight(layer, 2), \
+            layer.weight * layer.subnet(2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
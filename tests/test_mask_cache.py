@@ -0,0 +1,37 @@
+import unittest
+import torch
+import torch.nn as nn
+from deep_rl.shell_modules.mmn.ssmask_utils import MultitaskMaskLinear, \
+    MultitaskMaskLinearSparse, cache_masks
+
+
+class TestCacheMasks(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_single_slot_update(self):
+        net = nn.Sequential(MultitaskMaskLinear(4, 5, num_tasks=3), \
+            MultitaskMaskLinearSparse(5, 2, num_tasks=3))
+        cache_masks(net, verbose=False)
+        stacked = [m.stacked for m in net]
+        before = [s.clone() for s in stacked]
+        with torch.no_grad():
+            for m in net:
+                for task in [0, 1]:
+                    m.scores[task].neg_()
+        cache_masks(net, 1, verbose=False)
+        for m, s, b in zip(net, stacked, before):
+            # updated in place, only the given task's slot
+            self.assertIs(m.stacked, s)
+            self.assertTrue(torch.equal(s[1], m.subnet(1).bool()))
+            self.assertFalse(torch.equal(s[1], b[1]))
+            self.assertTrue(torch.equal(s[0], b[0]))
+            self.assertTrue(torch.equal(s[2], b[2]))
+        # a full update refreshes all the slots
+        cache_masks(net, verbose=False)
+        for m in net:
+            self.assertTrue(torch.equal(m.stacked[0], m.subnet(0).bool()))
+
+
+if __name__ == '__main__':
+    unittest.main()
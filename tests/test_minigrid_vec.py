@@ -0,0 +1,49 @@
+import copy
+import os
+import unittest
+import numpy as np
+
+try:
+    import gym
+    import gym_minigrid
+    # MiniGrid (the reference) uses the reset/step API of gym < 0.26
+    OLD_GYM_API = tuple(int(v) for v in gym.__version__.split('.')[:2]) < (0, 26)
+except ImportError:
+    gym_minigrid = None
+
+from deep_rl import *
+
+ENV_CONFIG_DIR = os.path.join(os.path.dirname(__file__), '..', 'env_configs')
+
+
+@unittest.skipIf(gym_minigrid is None or not OLD_GYM_API, 'gym_minigrid and gym < 0.26 required')
+class TestMiniGridVec(unittest.TestCase):
+    def _check_rollout(self, config_name, num_steps=1000):
+        # observations, rewards and dones are those of the reference environment step for
+        # step, episode ends (goal, lava, time limit) and automatic resets included
+        path = os.path.join(ENV_CONFIG_DIR, config_name)
+        ref = MiniGridFlatObs('MiniGrid', path, None, 1000, True)
+        env = MiniGridVecFlatObs('MiniGrid', path, 1, seed=1000, eval_mode=True)
+        for task in ref.get_all_tasks():
+            ref_obs = ref.reset_task(copy.deepcopy(task))
+            obs = env.reset_task(copy.deepcopy(task))
+            np.testing.assert_array_equal(obs[0], ref_obs)
+            rnd = np.random.RandomState(0)
+            for _ in range(num_steps):
+                # forward biased random walk, to reach the goal or the lava now and then
+                action = rnd.choice(3, p=[0.2, 0.2, 0.6])
+                ref_obs, ref_reward, ref_done, _ = ref.step(action)
+                obs, reward, done, _ = env.step(np.array([action]))
+                self.assertAlmostEqual(reward[0], ref_reward)
+                self.assertEqual(done[0], ref_done)
+                np.testing.assert_array_equal(obs[0], ref_obs)
+
+    def test_simple_crossing(self):
+        self._check_rollout('minigrid_sc_3.json')
+
+    def test_lava_crossing(self):
+        self._check_rollout('minigrid_sc_lc_6.json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import torch
+import torch.nn.functional as F
+from deep_rl.shell_modules.mmn.ssmask_utils import MIXED_TASK_BMM_MAX_NUMEL, \
+    MultitaskMaskLinear, MultitaskMaskLinearSparse, mixed_task_linear
+
+
+class TestMixedTaskLinear(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def _layers(self):
+        # small layers take the bmm path, large ones the grouped path
+        for in_dims, out_dims in [(8, 6), (64, 48)]:
+            for cls in [MultitaskMaskLinear, MultitaskMaskLinearSparse]:
+                yield in_dims * out_dims <= MIXED_TASK_BMM_MAX_NUMEL, \
+                    cls(in_dims, out_dims, num_tasks=3)
+
+    def _reference(self, layer, x, tasks):
+        return torch.cat([F.linear(x[i : i + 1], layer.weight * layer.subnet(task), \
+            layer.bias) for i, task in enumerate(tasks.tolist())])
+
+    def test_matches_per_row_linear(self):
+        tasks = torch.tensor([2, 0, 2, 1, 0, 0, 1])
+        for bmm, layer in self._layers():
+            x = torch.randn(len(tasks), layer.weight.shape[1])
+            with torch.no_grad():
+                expected = self._reference(layer, x, tasks)
+                self.assertTrue(torch.allclose(mixed_task_linear(layer, x, tasks), \
+                    expected, atol=1e-5), 'bmm' if bmm else 'grouped')
+                # the layer forward with a tensor of tasks (see set_model_task)
+                layer.task = tasks
+                self.assertTrue(torch.allclose(layer(x), expected, atol=1e-5))
+            # single task batch
+            single = torch.zeros(len(tasks), dtype=torch.long)
+            with torch.no_grad():
+                self.assertTrue(torch.allclose(mixed_task_linear(layer, x, single), \
+                    self._reference(layer, x, single), atol=1e-5))
+
+    def test_gradients(self):
+        tasks = torch.tensor([1, 0, 1, 2])
+        for bmm, layer in self._layers():
+            x = torch.randn(len(tasks), layer.weight.shape[1])
+            mixed_task_linear(layer, x, tasks).pow(2).sum().backward()
+            grads = [p.grad.clone() for p in layer.scores]
+            layer.zero_grad()
+            self._reference(layer, x, tasks).pow(2).sum().backward()
+            for g, p in zip(grads, layer.scores):
+                self.assertTrue(torch.allclose(g, p.grad, atol=1e-5), \
+                    'bmm' if bmm else 'grouped')
+
+
+if __name__ == '__main__':
+    unittest.main()
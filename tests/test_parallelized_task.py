@@ -0,0 +1,39 @@
+import unittest
+import numpy as np
+from deep_rl.component.task import ParallelizedTask
+
+
+class _Task:
+    # minimal task whose current task is set by reset_task
+    state_dim = 2
+    action_dim = 2
+    name = 'dummy'
+
+    def __init__(self, log_dir=None):
+        self.current_task = None
+
+    def seed(self, seed):
+        pass
+
+    def reset_task(self, task_info):
+        self.current_task = task_info
+        return np.zeros(self.state_dim)
+
+    def get_task(self):
+        return self.current_task
+
+
+class TestParallelizedTask(unittest.TestCase):
+    def test_get_task_all_workers_per_env(self):
+        for envs_per_worker in [1, 2]:
+            task = ParallelizedTask(_Task, 4, envs_per_worker=envs_per_worker)
+            try:
+                infos = [{'task': str(idx)} for idx in range(4)]
+                task.reset_tasks(infos)
+                self.assertEqual(task.get_task(all_workers=True), infos)
+            finally:
+                task.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
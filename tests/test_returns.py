@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+import torch
+from deep_rl.utils.misc import discounted_returns, returns_and_advantages
+
+
+def _loop(rewards, masks, values, discount, use_gae, gae_tau):
+    # per time step loop of the agents before the shared scan
+    returns = values[-1]
+    advantages = torch.zeros_like(values[-1])
+    all_returns, all_advantages = [None] * len(rewards), [None] * len(rewards)
+    for i in reversed(range(len(rewards))):
+        returns = rewards[i] + discount * masks[i] * returns
+        if not use_gae:
+            advantages = returns - values[i]
+        else:
+            td_error = rewards[i] + discount * masks[i] * values[i + 1] - values[i]
+            advantages = advantages * gae_tau * discount * masks[i] + td_error
+        all_returns[i], all_advantages[i] = returns, advantages
+    return torch.stack(all_returns), torch.stack(all_advantages)
+
+
+class TestReturns(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        T, N = 16, 5
+        self.rewards = torch.randn(T, N, 1)
+        self.masks = (torch.rand(T, N, 1) > 0.2).float()
+        self.values = torch.randn(T + 1, N, 1)
+
+    def test_returns_and_advantages(self):
+        for use_gae in [False, True]:
+            expected = _loop(self.rewards, self.masks, self.values, 0.99, use_gae, 0.95)
+            # tensor inputs (RolloutStorage entries)
+            returns, advantages = returns_and_advantages(self.rewards, self.masks, \
+                self.values, 0.99, use_gae, 0.95)
+            self.assertTrue(torch.allclose(returns, expected[0], atol=1e-5))
+            self.assertTrue(torch.allclose(advantages, expected[1], atol=1e-5))
+            # numpy inputs (rollout lists of the A2C/n-step agents)
+            returns, advantages = returns_and_advantages(self.rewards.numpy(), \
+                self.masks.numpy(), self.values.numpy(), 0.99, use_gae, 0.95)
+            self.assertIsInstance(returns, np.ndarray)
+            self.assertTrue(np.allclose(returns, expected[0].numpy(), atol=1e-5))
+            self.assertTrue(np.allclose(advantages, expected[1].numpy(), atol=1e-5))
+
+    def test_discounted_returns(self):
+        expected = _loop(self.rewards, self.masks, self.values, 0.9, False, 1.0)[0]
+        returns = discounted_returns(self.rewards, self.masks, self.values[-1], 0.9)
+        self.assertTrue(torch.allclose(returns, expected, atol=1e-5))
+        # pending value broadcast over the (num_workers, 1) rewards
+        returns = discounted_returns(self.rewards.numpy(), self.masks.numpy(), \
+            self.values[-1].numpy(), 0.9)
+        self.assertTrue(np.allclose(returns, expected.numpy(), atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+import torch
+from deep_rl.component.replay import RolloutStorage
+
+
+class TestRolloutStorage(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_insert_and_flat(self):
+        T, N = 4, 3
+        storage = RolloutStorage(T, N)
+        states = torch.randn(T + 1, N, 2)
+        rewards = np.random.randn(T, N)
+        for t in range(T):
+            storage.insert(t, states=states[t], rewards=rewards[t], masks=np.ones(N))
+        storage.insert(T, states=states[T])
+        self.assertEqual(tuple(storage.states.shape), (T + 1, N, 2))
+        self.assertEqual(tuple(storage.rewards.shape), (T, N))
+        self.assertEqual(storage.rewards.dtype, torch.float32)
+        self.assertTrue(torch.equal(storage.states, states))
+        # flat views are time step major, and skip the pending state
+        flat_states, flat_rewards = storage.flat('states', 'rewards')
+        self.assertTrue(torch.equal(flat_states, torch.cat(list(states[:T]))))
+        self.assertTrue(torch.allclose(flat_rewards, \
+            torch.from_numpy(rewards.astype(np.float32)).flatten()))
+        # the storage is reused in place by the next rollout
+        buf = storage.states
+        storage.insert(0, states=torch.zeros(N, 2))
+        self.assertIs(storage.states, buf)
+        self.assertTrue(torch.equal(flat_states[:N], torch.zeros(N, 2)))
+
+    def test_insert_per_env_and_whole(self):
+        T, N = 3, 4
+        storage = RolloutStorage(T, N)
+        storage.insert(None, returns=torch.zeros(T, N, 1))
+        # workers at different time steps (e.g., asynchronous rollouts)
+        storage.insert(np.array([0, 2]), env_ids=np.array([1, 3]), \
+            returns=torch.tensor([[1.], [2.]]))
+        expected = torch.zeros(T, N, 1)
+        expected[0, 1], expected[2, 3] = 1., 2.
+        self.assertTrue(torch.equal(storage.returns, expected))
+        whole = torch.randn(T, N, 1)
+        storage.insert(None, returns=whole)
+        self.assertTrue(torch.equal(storage.returns, whole))
+        self.assertTrue(torch.equal(storage.flat('returns')[0], whole.reshape(T * N, 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import gc
+import unittest
+import torch
+from deep_rl import *
+from deep_rl.shell_modules.mmn import ssmask_utils
+
+
+def _net(seed, state_dim=8):
+    torch.manual_seed(seed)
+    return FCBody_SS(state_dim, task_label_dim=2, hidden_units=(16, 16), num_tasks=1)
+
+
+def _weights(net):
+    return [m.weight for m in net.modules() if isinstance(m, MultitaskMaskLinear)]
+
+
+class TestShareBackbone(unittest.TestCase):
+    def setUp(self):
+        reset_shared_backbone()
+
+    def test_same_seed_shares(self):
+        a, b = _net(1), _net(1)
+        share_backbone(a, 1)
+        share_backbone(b, 1)
+        for wa, wb in zip(_weights(a), _weights(b)):
+            self.assertIs(wa, wb)
+
+    def test_other_seed_or_shape_gets_own_backbone(self):
+        a, b, c = _net(1), _net(2), _net(1, state_dim=12)
+        for net, seed in [(a, 1), (b, 2), (c, 1)]:
+            share_backbone(net, seed)
+        for wa, wb, wc in zip(_weights(a), _weights(b), _weights(c)):
+            self.assertIsNot(wa, wb)
+            self.assertIsNot(wa, wc)
+
+    def test_released_with_models(self):
+        a = _net(1)
+        share_backbone(a, 1)
+        self.assertGreater(len(ssmask_utils._shared_backbone), 0)
+        del a
+        gc.collect()
+        self.assertEqual(len(ssmask_utils._shared_backbone), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import torch
+from deep_rl.shell_modules.mmn.ssmask_utils import GetSubnetSparse, \
+    MultitaskMaskLinearSparse, sparse_threshold
+
+
+def _sort_subnet(scores, k):
+    # reference supermask: the j = (1 - k) * n lowest scores (by sorting) masked out
+    out = scores.clone()
+    _, idx = scores.flatten().sort()
+    j = int((1 - k) * scores.numel())
+    flat_out = out.flatten()
+    flat_out[idx[:j]] = 0
+    flat_out[idx[j:]] = 1
+    return out
+
+
+class TestSparseSubnet(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_matches_sort(self):
+        layer = MultitaskMaskLinearSparse(64, 48)
+        scores = layer.scores[0].detach()
+        out = torch.empty_like(scores)
+        for k in [0., 0.05, 0.1, 0.25, 0.5, 0.9, 1.]:
+            expected = _sort_subnet(scores, k)
+            self.assertTrue(torch.equal(GetSubnetSparse.apply(scores, k), expected))
+            self.assertTrue(torch.equal(GetSubnetSparse.apply(scores, k, \
+                sparse_threshold(scores, k), out), expected))
+
+    def test_buffer_history_does_not_grow(self):
+        layer = MultitaskMaskLinearSparse(6, 5, num_tasks=2, sparsity=0.4)
+        layer.task = 1
+        opt = torch.optim.SGD(layer.parameters(), 0.1)
+        for _ in range(3):
+            expected = _sort_subnet(layer.scores[1].detach(), layer.sparsity)
+            opt.zero_grad()
+            layer(torch.randn(4, 6)).pow(2).sum().backward()
+            opt.step()
+            self.assertIsNone(layer.subnet_buffer.grad_fn)
+            self.assertFalse(layer.subnet_buffer.requires_grad)
+            self.assertTrue(torch.equal(layer.subnet_buffer, expected))
+        # the graph of a step reaches the scores only (no node of an earlier step)
+        layer.scores[1].grad = None
+        y = layer(torch.randn(4, 6)).sum()
+        nodes, stack = set(), [y.grad_fn]
+        while stack:
+            node = stack.pop()
+            if node is None or node in nodes:
+                continue
+            nodes.add(node)
+            stack += [f for f, _ in node.next_functions]
+        self.assertEqual(sum(type(n).__name__ == 'GetSubnetSparseBackward' for n in nodes), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()